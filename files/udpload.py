@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+#
+
+""" load generator for the udp plugin .. blast encrypted alerts at the bot and report packets per second. """
+
+## boot
+
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+## commandline options
+
+from optparse import OptionParser
+
+parser = OptionParser(usage='usage: %prog [options]')
+
+parser.add_option('-p', '--printto', type='string', default="#dunkbots", dest='printto',
+                  help="channel/user to print to, comma separated for more targets")
+parser.add_option('-H', '--host', type='string', default="localhost", dest='host',
+                  help="host the bot listens on")
+parser.add_option('-P', '--port', type='int', default=5500, dest='port',
+                  help="port the bot listens on")
+parser.add_option('-w', '--passwd', type='string', default="mekker", dest='passwd',
+                  help="udppassword of the bot")
+parser.add_option('-s', '--seed', type='string', default="blablablablablaz", dest='seed',
+                  help="udpseed of the bot, empty to send plain text")
+parser.add_option('-n', '--number', type='int', default=10000, dest='number',
+                  help="number of packets to send")
+parser.add_option('-r', '--rate', type='int', default=0, dest='rate',
+                  help="packets per second to send, 0 is as fast as possible")
+parser.add_option('-l', '--length', type='int', default=64, dest='length',
+                  help="length of the alert text")
+parser.add_option('-6', '--ipv6', action='store_true', default=False, dest='ipv6',
+                  help="send over ipv6")
+
+opts, args = parser.parse_args()
+
+## encryption
+
+def makepacket(crypt, txt):
+    z = ('%s %s' % (opts.passwd, txt)).encode("utf-8")
+    while len(z) % 16:
+        z += b"\0"
+    if not crypt:
+        return z
+    return b"".join([crypt.encrypt(z[i:i + 16]) for i in range(0, len(z), 16)])
+
+crypt = None
+if opts.seed:
+    from py3rijndael import Rijndael
+    crypt = Rijndael(opts.seed)
+
+## prepare .. encrypting is slow, so make a set of packets up front and cycle through them
+
+targets = opts.printto.split(",")
+packets = []
+for i in range(100):
+    txt = ("alert %s " % i).ljust(opts.length, "x")
+    packets.append(makepacket(crypt, "%s %s" % (targets[i % len(targets)], txt)))
+
+## blast
+
+if opts.ipv6:
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+else:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+addr = (opts.host, opts.port)
+start = time.time()
+for i in range(opts.number):
+    sock.sendto(packets[i % len(packets)], addr)
+    if opts.rate:
+        wait = start + float(i + 1) / opts.rate - time.time()
+        if wait > 0:
+            time.sleep(wait)
+elapsed = time.time() - start or 0.000001
+
+print("sent %s packets of %s bytes in %.2f seconds - %.1f packets/sec" % (opts.number, len(packets[0]), elapsed, opts.number / elapsed))
+print("use the udp-status command on the bot to see how many were received")
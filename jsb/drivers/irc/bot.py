@@ -20,7 +20,7 @@ import time
 
 from jsb.lib.botbase import BotBase
 from jsb.lib.callbacks import callbacks
-from jsb.lib.channelbase import ChannelBase
+from jsb.lib.channelbase import channels
 from jsb.lib.commands import cmnds
 from jsb.lib.errors import NoSuchCommand
 from jsb.lib.eventbase import EventBase
@@ -174,7 +174,7 @@ class IRCBot(Irc):
                     ievent.queues = [q]
                     ievent.txt = ievent.txt[1:]
                     self.doevent(ievent)
-                    result = waitforqueue(q, 3000)
+                    result = waitforqueue(q, 300)
                     if result:
                         for i in result:
                             partyline.say_broadcast("[bot] %s" % i)
@@ -228,7 +228,7 @@ class IRCBot(Irc):
 
     def join(self, channel, password=None):
         """join a channel .. use optional password."""
-        chan = ChannelBase(channel, self.cfg.name)
+        chan = channels.get(channel, self.cfg.name)
         if password:
             chan.data.key = password.strip()
             chan.save()
@@ -283,8 +283,11 @@ class IRCBot(Irc):
         nick = ievent.nick
         if nick == self.cfg.nick:
             logging.warn("joined %s (%s)" % (ievent.channel, self.cfg.name))
-            time.sleep(0.5)
-            self.who(chan)
+            if self.engine:
+                self.engine.calllater(0.5, self.who, chan)
+            else:
+                time.sleep(0.5)
+                self.who(chan)
             return
         logging.info("%s - %s joined %s" % (self.cfg.name, ievent.nick, ievent.channel))
         self.userhosts[nick] = ievent.userhost
@@ -414,7 +417,7 @@ class IRCBot(Irc):
         i332 = waiter.register("332", queue=q)
         i333 = waiter.register("333", queue=q)
         self.putonqueue(7, None, "TOPIC %s" % channel)
-        res = waitforqueue(q, 5000)
+        res = waitforqueue(q, 500)
         who = what = when = None
         for r in res:
             if not r.postfix:
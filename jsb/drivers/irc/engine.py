@@ -0,0 +1,444 @@
+# jsb/drivers/irc/engine.py
+#
+#
+
+"""
+    selector based engine that services all irc connections of the fleet
+    from one I/O thread .. reading, writing, keepalive and reconnect are
+    done in the loop, parsed events are handed to dispatcher threads.
+
+"""
+
+# basic imports
+
+import errno
+import heapq
+import logging
+import queue
+import selectors
+import socket
+import threading
+import time
+
+# jsb imports
+
+from jsb.lib.config import getmainconfig
+from jsb.lib.morphs import inputmorphs
+from jsb.lib.threads import start_new_thread
+from jsb.utils.exception import handle_exception
+from jsb.utils.statdict import StatDict
+
+# IrcConnection class
+
+
+class IrcConnection(object):
+
+    """state of one bot's connection in the engine."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.sock = None
+        self.connecting = False
+        self.inbuf = b""
+        self.outbuf = bytearray()
+        self.lock = threading.Lock()
+        self.lastin = 0
+        self.dispatcher = None
+
+
+# IrcEngine class
+
+
+class IrcEngine(object):
+
+    """one thread multiplexing the sockets of all irc bots with a selector."""
+
+    def __init__(self, nrdispatchers=4):
+        self.selector = selectors.DefaultSelector()
+        self.conns = {}
+        self.timers = []
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.wakeread, self.wakewrite = socket.socketpair()
+        self.wakeread.setblocking(False)
+        self.wakewrite.setblocking(False)
+        self.selector.register(self.wakeread, selectors.EVENT_READ)
+        self.dispatchers = [queue.Queue() for i in range(max(nrdispatchers, 1))]
+        self.stats = StatDict()
+        self.running = False
+        self.stopped = False
+        self.ident = None
+
+    def start(self):
+        """start the I/O and dispatcher threads."""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        for q in self.dispatchers:
+            start_new_thread(self._dispatchloop, (q,))
+        start_new_thread(self._loop, ())
+
+    def stop(self):
+        """stop the engine, connections are closed."""
+        self.stopped = True
+        for q in self.dispatchers:
+            q.put(None)
+        self.wakeup()
+
+    def wakeup(self):
+        """make the I/O thread return from select."""
+        try:
+            self.wakewrite.send(b"x")
+        except (BlockingIOError, OSError):
+            pass
+
+    def calllater(self, delay, func, *args):
+        """run func(*args) in the I/O thread after delay seconds."""
+        with self.lock:
+            self.seq += 1
+            heapq.heappush(self.timers, (time.time() + delay, self.seq, func, args))
+        self.wakeup()
+
+    # connections
+
+    def add(self, bot):
+        """let the engine handle the connection of a bot."""
+        conn = IrcConnection(bot)
+        conn.dispatcher = self.dispatchers[len(self.conns) % len(self.dispatchers)]
+        bot.engine = self
+        bot.scheduler.notify = self.wakeup
+        self.calllater(0, self._add, conn)
+        self.start()
+
+    def _add(self, conn):
+        old = self.conns.get(conn.bot.cfg.name)
+        if old:
+            self.close(old)
+        self.conns[conn.bot.cfg.name] = conn
+        self.connect(conn)
+        self.calllater(self.pingsleep(conn), self.keepalive, conn)
+
+    def remove(self, bot):
+        """stop handling a bot, its connection is closed."""
+        self.calllater(0, self._remove, bot.cfg.name)
+
+    def _remove(self, name):
+        conn = self.conns.pop(name, None)
+        if conn:
+            self.close(conn)
+
+    def connect(self, conn):
+        """start a non blocking connect, the server is resolved in a thread."""
+        bot = conn.bot
+        if bot.stopped or self.conns.get(bot.cfg.name) is not conn:
+            return
+        conn.connecting = True
+        bot.connecting = True
+        bot.connectok.clear()
+        start_new_thread(self._resolve, (conn,))
+
+    def _resolve(self, conn):
+        bot = conn.bot
+        try:
+            family = bot.cfg.ipv6 and socket.AF_INET6 or socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            bot.oldsock = sock
+            server = bot.bind()
+            addr = socket.getaddrinfo(
+                server, int(str(bot.cfg.port)), family, socket.SOCK_STREAM
+            )[0][4]
+        except Exception as ex:
+            logging.error(
+                "can't resolve %s - %s (%s)" % (bot.cfg.server, ex, bot.cfg.name)
+            )
+            self.calllater(0, self.disconnected, conn)
+            return
+        self.calllater(0, self._connect, conn, sock, addr)
+
+    def _connect(self, conn, sock, addr):
+        bot = conn.bot
+        logging.warn(
+            "connecting to %s - %s - %s (%s)"
+            % (addr[0], bot.cfg.server, bot.cfg.port, bot.cfg.name)
+        )
+        sock.setblocking(False)
+        conn.sock = sock
+        try:
+            err = sock.connect_ex(addr)
+        except OSError as ex:
+            err = ex.errno
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            logging.error(
+                "can't connect: %s (%s)" % (errno.errorcode.get(err, err), bot.cfg.name)
+            )
+            self.disconnected(conn)
+            return
+        self.selector.register(sock, selectors.EVENT_WRITE, conn)
+        self.calllater(30, self.connecttimeout, conn, sock)
+
+    def connecttimeout(self, conn, sock):
+        if conn.connecting and conn.sock is sock:
+            logging.error("connect timeout (%s)" % conn.bot.cfg.name)
+            self.disconnected(conn)
+
+    def connected(self, conn):
+        """the socket is connected, log on to the server."""
+        bot = conn.bot
+        err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            logging.error(
+                "can't connect: %s (%s)" % (errno.errorcode.get(err, err), bot.cfg.name)
+            )
+            self.disconnected(conn)
+            return
+        logging.warn("connected! (%s)" % bot.cfg.name)
+        conn.connecting = False
+        conn.lastin = time.time()
+        conn.inbuf = b""
+        self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+        bot.sock = conn.sock
+        bot.connected = True
+        bot.connecting = False
+        bot.connecttime = time.time()
+        bot.nickchanged = 0
+        bot.reconnectcount = 0
+        for line in bot.logonlines():
+            bot._raw(line)
+        self.stats.upitem("connects")
+
+    def close(self, conn):
+        """close the socket of a connection."""
+        if conn.sock:
+            try:
+                self.selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+            try:
+                conn.sock.close()
+            except OSError:
+                pass
+        conn.sock = None
+        conn.connecting = False
+        with conn.lock:
+            del conn.outbuf[:]
+
+    def disconnected(self, conn):
+        """close the connection and schedule a reconnect with backoff."""
+        bot = conn.bot
+        self.close(conn)
+        bot.connected = False
+        bot.connectok.clear()
+        if bot.stopped or self.conns.get(bot.cfg.name) is not conn:
+            return
+        bot.reconnectcount += 1
+        sleepsec = min(bot.reconnectcount * 5, 300)
+        logging.warn("reconnecting in %s seconds (%s)" % (sleepsec, bot.cfg.name))
+        self.stats.upitem("reconnects")
+        self.calllater(sleepsec, self.connect, conn)
+
+    def reconnect(self, bot):
+        """drop the connection of a bot, the engine reconnects it."""
+        conn = self.conns.get(bot.cfg.name)
+        if conn:
+            self.calllater(0, self.disconnected, conn)
+
+    def pingsleep(self, conn):
+        return float(conn.bot.cfg.pingsleep or 60)
+
+    def keepalive(self, conn):
+        """ping the server when idle, reconnect when it doesn't answer."""
+        if self.conns.get(conn.bot.cfg.name) is not conn:
+            return
+        interval = self.pingsleep(conn)
+        if conn.sock and not conn.connecting:
+            idle = time.time() - conn.lastin
+            if idle > 3 * interval:
+                logging.warn("no pong received (%s)" % conn.bot.cfg.name)
+                self.disconnected(conn)
+            elif idle > interval:
+                conn.bot.ping()
+        self.calllater(interval, self.keepalive, conn)
+
+    # I/O
+
+    def write(self, bot, data):
+        """queue data for the socket of a bot, the I/O thread sends it."""
+        conn = self.conns.get(bot.cfg.name)
+        if not conn or not conn.sock:
+            return False
+        with conn.lock:
+            conn.outbuf += data
+        if threading.current_thread().ident != self.ident:
+            self.wakeup()
+        return True
+
+    def flush(self, conn):
+        """send as much of the output buffer as the socket takes."""
+        with conn.lock:
+            try:
+                sent = conn.sock.send(conn.outbuf)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as ex:
+                logging.error("can't send: %s (%s)" % (str(ex), conn.bot.cfg.name))
+                sent = -1
+            if sent > 0:
+                del conn.outbuf[:sent]
+                self.stats.upitem("bytesout", sent)
+            pending = len(conn.outbuf)
+        if sent < 0:
+            self.disconnected(conn)
+            return
+        events = selectors.EVENT_READ
+        if pending:
+            events |= selectors.EVENT_WRITE
+        if self.selector.get_key(conn.sock).events != events:
+            self.selector.modify(conn.sock, events, conn)
+
+    def read(self, conn):
+        """read from the socket and hand complete lines to the dispatcher."""
+        bot = conn.bot
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as ex:
+            bot.error = str(ex)
+            data = b""
+        if not data:
+            logging.error("remote disconnected (%s)" % bot.cfg.name)
+            self.disconnected(conn)
+            return
+        self.stats.upitem("bytesin", len(data))
+        conn.lastin = time.time()
+        lines = (conn.inbuf + data).split(b"\n")
+        conn.inbuf = lines.pop()
+        for line in lines:
+            txt = line.decode(bot.encoding or "utf-8", "replace").rstrip("\r")
+            if not txt:
+                continue
+            self.stats.upitem("lines")
+            if txt.startswith("PING "):
+                bot._raw("PONG %s" % txt[5:])
+                continue
+            conn.dispatcher.put((bot, txt))
+
+    def sendqueued(self):
+        """take lines from the output schedulers, return seconds until the next one."""
+        wait = None
+        for conn in list(self.conns.values()):
+            if not conn.sock or conn.connecting:
+                continue
+            while 1:
+                line, delay = conn.bot.scheduler.next()
+                if not line:
+                    break
+                conn.bot._raw(line)
+            if delay is not None and (wait is None or delay < wait):
+                wait = delay
+            if conn.outbuf:
+                self.flush(conn)
+        return wait
+
+    def runtimers(self):
+        """run due timers, return seconds until the next one."""
+        while 1:
+            with self.lock:
+                if not self.timers:
+                    return None
+                when = self.timers[0][0]
+                if when > time.time():
+                    return when - time.time()
+                when, seq, func, args = heapq.heappop(self.timers)
+            try:
+                func(*args)
+            except Exception as ex:
+                handle_exception()
+
+    def _loop(self):
+        logging.warn("irc engine started")
+        self.ident = threading.current_thread().ident
+        while not self.stopped:
+            try:
+                timeout = self.runtimers()
+                wait = self.sendqueued()
+                if wait is not None and (timeout is None or wait < timeout):
+                    timeout = wait
+                for key, mask in self.selector.select(timeout):
+                    if key.fileobj is self.wakeread:
+                        try:
+                            self.wakeread.recv(4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    conn = key.data
+                    if conn.connecting:
+                        self.connected(conn)
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self.read(conn)
+                    if conn.sock and mask & selectors.EVENT_WRITE:
+                        self.flush(conn)
+            except Exception as ex:
+                handle_exception()
+        for conn in list(self.conns.values()):
+            self.close(conn)
+        logging.warn("irc engine stopped")
+
+    def _dispatchloop(self, q):
+        while not self.stopped:
+            item = q.get()
+            if not item:
+                break
+            bot, txt = item
+            try:
+                ievent = bot._parseline(inputmorphs.do(txt))
+                if ievent:
+                    bot.handle_ievent(ievent)
+            except Exception as ex:
+                handle_exception()
+
+    def status(self):
+        """return engine statistics."""
+        return {
+            "connections": len(self.conns),
+            "connected": len(
+                [c for c in self.conns.values() if c.sock and not c.connecting]
+            ),
+            "timers": len(self.timers),
+            "dispatchqueue": sum(q.qsize() for q in self.dispatchers),
+            "connects": self.stats.connects or 0,
+            "reconnects": self.stats.reconnects or 0,
+            "lines": self.stats.lines or 0,
+            "bytesin": self.stats.bytesin or 0,
+            "bytesout": self.stats.bytesout or 0,
+        }
+
+
+# global engine
+
+engine = None
+
+
+def getengine():
+    """return the global irc engine, None when the engine is disabled in the mainconfig."""
+    global engine
+    cfg = getmainconfig()
+    if not cfg.ircengine:
+        return None
+    if not engine:
+        engine = IrcEngine(int(cfg.ircenginedispatchers or 4))
+    return engine
+
+
+def stopengine():
+    """stop the global irc engine, if it was started."""
+    if engine:
+        engine.stop()
+
+
+def size():
+    if not engine:
+        return "disabled"
+    return engine.status()
@@ -39,7 +39,9 @@ from jsb.utils.generic import (
 from jsb.utils.locking import lock_object, lockdec, release_object
 from jsb.utils.pdod import Pdod
 
+from .engine import getengine
 from .ircevent import IrcEvent
+from .output import OutputScheduler
 
 # jsb.irc imports
 
@@ -82,6 +84,11 @@ class Irc(BotBase):
         self.blocking = 1
         self.lastoutput = 0
         self.splitted = []
+        self.outloopid = None
+        self.engine = None
+        self.targmax = 1
+        self.scheduler = OutputScheduler(self.cfg.name)
+        self.setlimiter()
         if not self.cfg.server:
             self.cfg.server = self.cfg.host or "localhost"
         assert self.cfg.port
@@ -102,7 +109,9 @@ class Irc(BotBase):
                 logging.warn("> %s (%s)" % (itxt, self.cfg.name))
             else:
                 logging.info("> %s (%s)" % (itxt, self.cfg.name))
-            if "ssl" in self.cfg and self.cfg["ssl"]:
+            if self.engine:
+                self.engine.write(self, itxt[:500] + b"\n")
+            elif "ssl" in self.cfg and self.cfg["ssl"]:
                 self.sock.write(itxt + "\n")
             else:
                 self.sock.send(itxt[:500] + b"\n")
@@ -111,6 +120,58 @@ class Irc(BotBase):
                 "%s - can't send: %s" % (self.cfg.name, traceback.format_exc())
             )
 
+    def setlimiter(self):
+        """configure the output scheduler from the bot config."""
+        if self.cfg.nolimiter:
+            interval = 0
+        else:
+            interval = self.cfg.sleepsec or 4
+        maxtargets = self.cfg.outmaxtargets or 4
+        if self.targmax:
+            maxtargets = min(self.targmax, maxtargets)
+        self.scheduler.setlimits(
+            interval,
+            self.cfg.outburst or 5,
+            self.cfg.outmaxage or 60,
+            self.cfg.outdropprio or 7,
+            self.cfg.outmaxqueue or 100,
+            maxtargets,
+        )
+
+    def _outloop(self):
+        """output loop, sends lines when the output scheduler allows it."""
+        logging.debug("%s - starting output loop" % self.cfg.name)
+        self.stopoutloop = 0
+        self.outloopid = loopid = object()
+        self.scheduler.wake()
+        while not self.stopped and not self.stopoutloop and self.outloopid is loopid:
+            try:
+                txt = self.scheduler.get()
+                if txt:
+                    self._raw(txt)
+            except Exception as ex:
+                handle_exception()
+        logging.debug("%s - stopping output loop" % self.cfg.name)
+
+    def startloops(self):
+        """start read and output threads, not needed when the engine is used."""
+        if not self.engine:
+            BotBase.startloops(self)
+
+    def putonqueue(self, nr, *args):
+        """put raw output on the output scheduler, nr is the priority."""
+        if len(args) == 2 and args[0] is None:
+            if args[1]:
+                self.scheduler.put(nr, args[1])
+            else:
+                self.scheduler.wake()
+            return
+        BotBase.putonqueue(self, nr, *args)
+
+    def outputsizes(self):
+        """return sizes of output queues."""
+        return (self.scheduler.depth, self.eventqueue.qsize())
+
     def _connect(self):
         """connect to server/port using nick."""
         self.stopped = False
@@ -227,30 +288,7 @@ class Irc(BotBase):
                 for r in intxt:
                     if not r:
                         continue
-                    try:
-                        r = strippedtxt(r.rstrip(), ["\001", "\002", "\003"])
-                        rr = str(fromenc(r.rstrip(), self.encoding))
-                    except UnicodeDecodeError:
-                        logging.warn("decode error - ignoring (%s)" % self.cfg.name)
-                        continue
-                    if not rr:
-                        continue
-                    res = rr
-                    try:
-                        ievent = IrcEvent().parse(self, res)
-                    except Exception as ex:
-                        handle_exception()
-                        continue
-                    try:
-                        if int(ievent.cmnd) > 400:
-                            logging.error("< %s (%s)" % (res, self.cfg.name))
-                        elif int(ievent.cmnd) >= 300:
-                            logging.info("< %s (%s)" % (res, self.cfg.name))
-                    except ValueError:
-                        if not res.startswith("PING") and not res.startswith("NOTICE"):
-                            logging.warn("< %s (%s)" % (res, self.cfg.name))
-                        else:
-                            logging.info("< %s (%s)" % (res, self.cfg.name))
+                    ievent = self._parseline(r)
                     if ievent:
                         self.handle_ievent(ievent)
                     timeout = 1
@@ -311,12 +349,39 @@ class Irc(BotBase):
             time.sleep(2)
             self.reconnect()
 
-    def logon(self):
-        """log on to the network."""
-        time.sleep(2)
+    def _parseline(self, r):
+        """turn a line received from the server into an IrcEvent."""
+        try:
+            r = strippedtxt(r.rstrip(), ["\001", "\002", "\003"])
+            res = str(fromenc(r.rstrip(), self.encoding))
+        except UnicodeDecodeError:
+            logging.warn("decode error - ignoring (%s)" % self.cfg.name)
+            return
+        if not res:
+            return
+        try:
+            ievent = IrcEvent().parse(self, res)
+        except Exception as ex:
+            handle_exception()
+            return
+        try:
+            if int(ievent.cmnd) > 400:
+                logging.error("< %s (%s)" % (res, self.cfg.name))
+            elif int(ievent.cmnd) >= 300:
+                logging.info("< %s (%s)" % (res, self.cfg.name))
+        except ValueError:
+            if not res.startswith("PING") and not res.startswith("NOTICE"):
+                logging.warn("< %s (%s)" % (res, self.cfg.name))
+            else:
+                logging.info("< %s (%s)" % (res, self.cfg.name))
+        return ievent
+
+    def logonlines(self):
+        """return the lines needed to register with the server."""
+        result = []
         if self.cfg.password:
             logging.debug("%s - sending password" % self.cfg.name)
-            self._raw("PASS %s" % self.cfg.password)
+            result.append("PASS %s" % self.cfg.password)
         logging.warn(
             "registering with %s using nick %s (%s)"
             % (self.cfg.server, self.cfg.nick, self.cfg.name)
@@ -324,10 +389,18 @@ class Irc(BotBase):
         logging.warn("%s - this may take a while" % self.cfg.name)
         username = self.cfg.username or "jsb"
         realname = self.cfg.realname or "jsonbot"
-        time.sleep(1)
-        self._raw("NICK %s" % self.cfg.nick)
-        time.sleep(1)
-        self._raw("USER %s localhost %s :%s" % (username, self.cfg.server, realname))
+        result.append("NICK %s" % self.cfg.nick)
+        result.append(
+            "USER %s localhost %s :%s" % (username, self.cfg.server, realname)
+        )
+        return result
+
+    def logon(self):
+        """log on to the network."""
+        time.sleep(2)
+        for line in self.logonlines():
+            self._raw(line)
+            time.sleep(1)
 
     def _onconnect(self):
         """overload this to run after connect."""
@@ -441,8 +514,13 @@ class Irc(BotBase):
     def connect(self, reconnect=True):
         """
         connect to server/port using nick .. connect can timeout so catch
-        exception .. reconnect if enabled.
+        exception .. reconnect if enabled. when the irc engine is enabled
+        the engine connects and reconnects.
         """
+        engine = getengine()
+        if engine and not self.cfg.ssl:
+            engine.add(self)
+            return True
         res = self._connect()
         logging.info("%s - starting logon" % self.cfg.name)
         self.logon()
@@ -458,6 +536,8 @@ class Irc(BotBase):
         """shutdown the bot."""
         logging.warn("shutdown (%s)" % self.cfg.name)
         self.stopoutputloop = 1
+        if self.engine:
+            self.engine.remove(self)
         # self.close()
         self.connecting = False
         self.connected = False
@@ -481,6 +561,13 @@ class Irc(BotBase):
         except:
             pass
 
+    def reconnect(self, start=False, close=False):
+        """reconnect to the server, the irc engine does this itself."""
+        if self.engine:
+            self.engine.reconnect(self)
+            return
+        BotBase.reconnect(self, start, close)
+
     def handle_pong(self, ievent):
         """set pongcheck on received pong."""
         logging.debug("%s - received server pong" % self.cfg.name)
@@ -562,33 +649,13 @@ class Irc(BotBase):
             return
         self.send("PRIVMSG %s :%s" % (printto, what))
 
-    # @outlocked
-    def send(self, txt):
-        """send text to irc server."""
+    def send(self, txt, prio=5):
+        """queue text for the irc server, the output loop sends it."""
         if not txt:
             return
         if self.stopped:
             return
-        try:
-            # lock_object(self)
-            now = time.time()
-            txt = txt.rstrip()
-            self._raw(txt)
-            if self.cfg.sleepsec:
-                timetosleep = self.cfg.sleepsec - (now - self.lastoutput)
-            else:
-                timetosleep = 4 - (now - self.lastoutput)
-            if (
-                timetosleep > 0
-                and not self.cfg.nolimiter
-                and not (time.time() - self.connecttime < 5)
-            ):
-                logging.debug("%s - flood protect" % self.cfg.name)
-                time.sleep(timetosleep)
-        except Exception as ex:
-            logging.error("%s - send error: %s" % (self.cfg.name, str(ex)))
-            handle_exception()
-        # finally: release_object(self)
+        self.scheduler.put(prio, txt)
 
     def voice(self, channel, who):
         """give voice."""
@@ -690,12 +757,48 @@ class Irc(BotBase):
 
     def handle_001(self, ievent):
         """we are connected."""
+        rejoin = self.engine and self.started
+        self.targmax = 1
+        self.setlimiter()
+        if self.engine:
+            start_new_thread(self._connected, (rejoin,))
+        else:
+            self._connected(rejoin)
+
+    def _connected(self, rejoin=False):
+        """run the connect actions, these sleep so the engine runs them in their own thread."""
         time.sleep(1)
         self._onconnect()
+        if rejoin:
+            start_new_thread(self.joinchannels, ())
         self.connectok.set()
         self.connected = True
         self.whois(self.cfg.nick)
 
+    def handle_005(self, ievent):
+        """server features .. use TARGMAX/MAXTARGETS as the number of targets to coalesce."""
+        limits = []
+        for token in ievent.arguments[1:] + ievent.txt.split():
+            if token.startswith(":"):
+                break
+            name, sep, value = token.partition("=")
+            if name == "MAXTARGETS":
+                limits.append(int(value) if value.isdigit() else 0)
+            elif name == "TARGMAX":
+                for item in value.split(","):
+                    cmnd, sep, nr = item.partition(":")
+                    if cmnd.upper() in ["PRIVMSG", "NOTICE"]:
+                        limits.append(int(nr) if nr.isdigit() else 0)
+        if not limits:
+            return
+        limits = [nr for nr in limits if nr]
+        self.targmax = min(limits) if limits else 0
+        logging.warn(
+            "%s - server allows %s targets"
+            % (self.cfg.name, self.targmax or "unlimited")
+        )
+        self.setlimiter()
+
     def handle_privmsg(self, ievent):
         """check if msg is ctcp or not .. return 1 on handling."""
         if ievent.txt and ievent.txt[0] == "\001":
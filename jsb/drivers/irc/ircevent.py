@@ -28,6 +28,8 @@ class IrcEvent(EventBase):
 
     """represents an IRC event."""
 
+    __slots__ = ()
+
     def __deepcopy__(self, bla):
         e = IrcEvent()
         e.copyin(self)
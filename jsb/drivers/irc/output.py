@@ -0,0 +1,254 @@
+# jsb/drivers/irc/output.py
+#
+#
+
+"""
+    output scheduler for irc connections .. lines are sent when a token
+    bucket allows it, targets of the same priority take turns.
+
+"""
+
+# basic imports
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+# jsb imports
+
+from jsb.utils.statdict import StatDict
+
+# defines
+
+maxline = 510
+
+# splitline function
+
+
+def splitline(line):
+    """return (cmnd, target, txt) of a line, cmnd is None for non messages."""
+    try:
+        cmnd, rest = line.split(" ", 1)
+    except ValueError:
+        return (None, "", line)
+    cmnd = cmnd.upper()
+    if cmnd in ["PRIVMSG", "NOTICE"] and " :" in rest:
+        target, txt = rest.split(" :", 1)
+        return (cmnd, target, txt)
+    return (None, rest.split(" ", 1)[0], line)
+
+
+# OutputScheduler class
+
+
+class OutputScheduler(object):
+
+    """
+    token bucket output scheduler with a round robin over targets per
+    priority (lower number goes first, like putonqueue).
+
+    identical pending lines of dropprio or higher are merged, a
+    PRIVMSG/NOTICE with the same text for another target is coalesced into
+    one line with up to maxtargets targets (the server's TARGMAX, 1 until
+    it is known) and lines of dropprio or higher are dropped when older
+    than maxage seconds.
+
+    """
+
+    def __init__(
+        self,
+        name,
+        interval=4.0,
+        burst=5,
+        maxage=60.0,
+        dropprio=7,
+        maxqueue=100,
+        maxtargets=1,
+    ):
+        self.name = name
+        self.cond = threading.Condition()
+        self.levels = {}
+        self.pending = {}
+        self.depth = 0
+        self.stats = StatDict()
+        self.wakeups = 0
+        self.notify = None
+        self.setlimits(interval, burst, maxage, dropprio, maxqueue, maxtargets)
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+
+    def setlimits(
+        self,
+        interval=4.0,
+        burst=5,
+        maxage=60.0,
+        dropprio=7,
+        maxqueue=100,
+        maxtargets=1,
+    ):
+        """set the bucket and queue limits, an interval of 0 disables throttling."""
+        self.interval = float(interval)
+        self.burst = max(int(burst), 1)
+        self.maxage = float(maxage)
+        self.dropprio = int(dropprio)
+        self.maxqueue = int(maxqueue)
+        self.maxtargets = max(int(maxtargets), 1)
+
+    def put(self, prio, line):
+        """queue a line, returns False when the line is dropped."""
+        line = line.rstrip()
+        if not line:
+            return False
+        cmnd, target, txt = splitline(line)
+        key = (prio, cmnd, txt)
+        with self.cond:
+            entry = self.pending.get(key)
+            if entry:
+                if target in entry[2]:
+                    if prio >= self.dropprio:
+                        self.stats.upitem("merged")
+                        return True
+                    entry = None
+            if entry:
+                if (
+                    cmnd
+                    and len(entry[2]) < self.maxtargets
+                    and len(line) + len(",".join(entry[2])) < maxline
+                ):
+                    entry[2].append(target)
+                    self.stats.upitem("coalesced")
+                    return True
+            level = self.levels.setdefault(prio, OrderedDict())
+            queue = level.get(target)
+            if queue is None:
+                queue = level[target] = deque()
+            if len(queue) >= self.maxqueue:
+                self.stats.upitem("dropped")
+                if prio >= self.dropprio:
+                    return False
+                self.remove(queue.popleft())
+            entry = [time.time(), key, [target]]
+            queue.append(entry)
+            self.pending[key] = entry
+            self.depth += 1
+            self.cond.notify_all()
+        if self.notify:
+            self.notify()
+        return True
+
+    def remove(self, entry):
+        """forget about an entry that leaves the queues."""
+        self.depth -= 1
+        if self.pending.get(entry[1]) is entry:
+            del self.pending[entry[1]]
+
+    def refill(self, now):
+        """add the tokens earned since the last refill."""
+        if self.interval <= 0:
+            self.tokens = float(self.burst)
+        else:
+            self.tokens += (now - self.stamp) / self.interval
+            if self.tokens > self.burst:
+                self.tokens = float(self.burst)
+        self.stamp = now
+
+    def peek(self, now):
+        """return (prio, target, queue) of the next line to send, expired lines are dropped."""
+        for prio in sorted(self.levels):
+            level = self.levels[prio]
+            while level:
+                target, queue = next(iter(level.items()))
+                while queue and prio >= self.dropprio:
+                    if now - queue[0][0] <= self.maxage:
+                        break
+                    self.remove(queue.popleft())
+                    self.stats.upitem("expired")
+                if queue:
+                    return (prio, target, queue)
+                del level[target]
+            del self.levels[prio]
+        return (None, None, None)
+
+    def next(self, now=None):
+        """
+        return (line, 0) if a line can be sent now, (None, seconds) if the
+        bucket is empty and (None, None) if there is nothing to send.
+
+        """
+        now = now or time.time()
+        with self.cond:
+            self.refill(now)
+            prio, target, queue = self.peek(now)
+            if not queue:
+                return (None, None)
+            if self.tokens < 1:
+                return (None, (1 - self.tokens) * self.interval)
+            self.tokens -= 1
+            entry = queue.popleft()
+            level = self.levels[prio]
+            if queue:
+                level.move_to_end(target)
+            else:
+                del level[target]
+            self.remove(entry)
+            queued, (prio, cmnd, txt), targets = entry
+            waited = now - queued
+            self.stats.upitem("sent")
+            self.stats.upitem("waited", waited)
+            if waited > (self.stats.maxwait or 0):
+                self.stats.set("maxwait", waited)
+            if cmnd:
+                return ("%s %s :%s" % (cmnd, ",".join(targets), txt), 0)
+            return (txt, 0)
+
+    def get(self):
+        """block until a line can be sent, returns None when woken up."""
+        with self.cond:
+            wakeups = self.wakeups
+            while wakeups == self.wakeups:
+                line, wait = self.next()
+                if line:
+                    return line
+                self.cond.wait(wait)
+
+    def wake(self):
+        """wake up threads blocking in get()."""
+        with self.cond:
+            self.wakeups += 1
+            self.cond.notify_all()
+
+    def clear(self):
+        """drop all queued lines."""
+        with self.cond:
+            self.stats.upitem("dropped", self.depth)
+            self.levels = {}
+            self.pending = {}
+            self.depth = 0
+
+    def status(self):
+        """return queue depth and time in queue metrics."""
+        with self.cond:
+            now = time.time()
+            self.refill(now)
+            oldest = 0
+            targets = StatDict()
+            for prio, level in self.levels.items():
+                for target, queue in level.items():
+                    targets.upitem(target, len(queue))
+                    if queue:
+                        oldest = max(oldest, now - queue[0][0])
+            sent = self.stats.sent or 0
+            return {
+                "depth": self.depth,
+                "targets": len(targets),
+                "busiest": targets.top(start=2)[-3:],
+                "tokens": "%.1f/%s" % (self.tokens, self.burst),
+                "sent": sent,
+                "avgwait": "%.2fs" % (sent and (self.stats.waited or 0) / sent or 0),
+                "maxwait": "%.2fs" % (self.stats.maxwait or 0),
+                "oldest": "%.2fs" % oldest,
+                "merged": self.stats.merged or 0,
+                "coalesced": self.stats.coalesced or 0,
+                "expired": self.stats.expired or 0,
+                "dropped": self.stats.dropped or 0,
+            }
@@ -18,6 +18,7 @@ from jsb.utils.lazydict import LazyDict
 # defines
 
 aliases = LazyDict()
+version = 0  # bumped when the global aliases change
 
 # getaliases function
 
@@ -25,6 +26,7 @@ aliases = LazyDict()
 def getaliases(ddir=None, force=True):
     """return global aliases."""
     global aliases
+    global version
     if not aliases or force:
         from jsb.lib.persist import Persist
         from jsb.utils.lazydict import LazyDict
@@ -33,6 +35,8 @@ def getaliases(ddir=None, force=True):
         p = Persist(d + os.sep + "run" + os.sep + "aliases")
         if not p.data:
             p.data = LazyDict()
+        if p.data is not aliases:
+            version += 1
         aliases = p.data
     return aliases
 
@@ -40,6 +44,8 @@ def getaliases(ddir=None, force=True):
 def savealiases(ddir=None):
     """return global aliases."""
     global aliases
+    global version
+    version += 1
     if aliases:
         logging.warn("saving aliases")
         from jsb.lib.persist import Persist
@@ -74,4 +80,6 @@ def size():
 
 def setalias(first, second):
     global aliases
+    global version
     aliases[first] = second
+    version += 1
@@ -11,12 +11,16 @@ import importlib
 import logging
 import os
 import sys
+import time
 
 from jsb.lib.aliases import savealiases
+from jsb.lib.cache import setlimits
 from jsb.lib.config import Config, getmainconfig
 from jsb.lib.datadir import getdatadir, makedirs
 from jsb.lib.jsbimport import _import
+from jsb.lib.manifest import Manifest, plugfile
 from jsb.lib.persist import Persist
+from jsb.lib.runner import setpools
 from jsb.memcached import startmcdaemon
 from jsb.utils.exception import handle_exception
 from jsb.utils.generic import botuser, checkpermissions, isdebian
@@ -72,6 +76,8 @@ shorttable = None
 timestamps = None
 plugwhitelist = None
 plugblacklist = None
+manifest = None
+boottimes = []
 cpy = copy.deepcopy
 
 # scandir function
@@ -86,15 +92,15 @@ def scandir(d, dbenable=False):
         mods = []
         if changed:
             logging.debug("files changed %s" % str(changed))
-            for plugfile in changed:
-                if not dbenable and os.sep + "db" in plugfile:
-                    logging.warn("db not enabled .. skipping %s" % plugfile)
+            for fn in changed:
+                if not dbenable and os.sep + "db" in fn:
+                    logging.warn("db not enabled .. skipping %s" % fn)
                     continue
-                if ongae and "socket" in plugfile:
-                    logging.warn("on GAE .. skipping %s" % plugfile)
+                if ongae and "socket" in fn:
+                    logging.warn("on GAE .. skipping %s" % fn)
                     continue
-                if not ongae and ("gae" in plugfile or "wave" in plugfile):
-                    logging.warn("not on GAE .. skipping %s" % plugfile)
+                if not ongae and ("gae" in fn or "wave" in fn):
+                    logging.warn("not on GAE .. skipping %s" % fn)
                     continue
         return changed
     except Exception as ex:
@@ -120,6 +126,16 @@ def boot(
 ):
     """initialize the bot."""
     global plugin_packages
+    global boottimes
+    boottimes = []
+    started = last = time.time()
+
+    def stamp(what):
+        nonlocal last
+        now = time.time()
+        boottimes.append((what, now - last))
+        last = now
+
     if not ongae:
         try:
             if os.getuid() == 0:
@@ -176,6 +192,8 @@ def boot(
     global timestamps
     global plugwhitelist
     global plugblacklist
+    global manifest
+    stamp("setup")
     if not retable:
         retable = Persist(rundir + os.sep + "retable")
     if clear:
@@ -209,11 +227,19 @@ def boot(
         plugblacklist.data = []
     if not cmndperms:
         cmndperms = Config("cmndperms", ddir=ddir)
+    if not manifest:
+        manifest = Manifest(rundir + os.sep + "manifest")
+    if clear:
+        manifest.data.plugins = {}
     changed = []
     gotlocal = False
     dosave = clear or False
     maincfg = getmainconfig(ddir=ddir)
     logging.warn("mainconfig used is %s" % maincfg.cfile)
+    setlimits(maincfg.cachemaxitems, maincfg.cachemaxbytes)
+    setpools(maincfg)
+    lazy = maincfg.lazyboot and not ongae
+    stamp("tables")
     if os.path.isdir("jsb"):
         gotlocal = True
         packages = find_packages("jsb" + os.sep + "plugs")
@@ -230,12 +256,13 @@ def boot(
                 plugin_packages.append(p)
     for plug in default_plugins:
         plugs.reload(plug, showerror=True, force=True)
+    stamp("default plugins")
     changed = scandir(getdatadir() + os.sep + "myplugs", dbenable=maincfg.dbenable)
     if changed:
         logging.debug("myplugs has changed -=- %s" % str(changed))
-        for plugfile in changed:
+        for fn in changed:
             try:
-                plugs.reloadfile(plugfile, force=True)
+                plugs.reloadfile(fn, force=True)
             except Exception as ex:
                 handle_exception()
         dosave = True
@@ -243,21 +270,23 @@ def boot(
     if configchanges:
         logging.info("there are configuration changes: %s" % str(configchanges))
         for f in configchanges:
-            if "mainconfig" in f:
+            if "mainconfig" in f and not lazy:
                 force = True
                 dosave = True
-    if os.path.isdir("jsb"):
+    stamp("myplugs and config")
+    if os.path.isdir("jsb") and not lazy:
         corechanges = scandir("jsb" + os.sep + "plugs", dbenable=maincfg.dbenable)
         if corechanges:
             logging.debug("core changed -=- %s" % str(corechanges))
-            for plugfile in corechanges:
-                if not maincfg.dbenable and "db" in plugfile:
+            for fn in corechanges:
+                if not maincfg.dbenable and "db" in fn:
                     continue
                 try:
-                    plugs.reloadfile(plugfile, force=True)
+                    plugs.reloadfile(fn, force=True)
                 except Exception as ex:
                     handle_exception()
             dosave = True
+        stamp("changed core plugins")
     if not ongae and maincfg.dbenable:
         plugin_packages.append("jsb.plugs.db")
         try:
@@ -277,14 +306,130 @@ def boot(
             plugin_packages.remove("jsb.plugs.db")
         except ValueError:
             pass
-    if force or dosave or not cmndtable.data or len(cmndtable.data) < 100:
+    if lazy:
+        lazyload(plugin_packages, force=force, saveperms=saveperms)
+        stamp("lazy load")
+    elif force or dosave or not cmndtable.data or len(cmndtable.data) < 100:
         logging.debug("using target %s" % str(plugin_packages))
         plugs.loadall(plugin_packages, force=True)
+        stamp("load all plugins")
         savecmndtable(saveperms=saveperms)
         savepluginlist()
         savecallbacktable()
         savealiases()
-    logging.warn("ready")
+        stamp("save tables")
+    logging.warn("ready in %.2f seconds" % (time.time() - started))
+
+
+# lazyload function
+
+
+def lazyload(packages, force=False, saveperms=True):
+    """
+    fill the boot tables from the plugin manifest, only plugins that are
+    not in the manifest or whose file changed get imported. other plugins
+    are imported on first use by the reloadcheck() of commands and callbacks.
+
+    """
+    from jsb.lib.examples import examples
+    from jsb.lib.plugins import plugs
+
+    global manifest
+    available = []
+    for package in packages:
+        try:
+            imp = _import(package)
+        except ImportError as ex:
+            logging.info("no %s plugin package found - %s" % (package, str(ex)))
+            continue
+        except Exception as ex:
+            handle_exception()
+            continue
+        for plug in getattr(imp, "__plugs__", []):
+            modname = "%s.%s" % (package, plug)
+            if plugblacklist and modname in plugblacklist.data:
+                continue
+            available.append(modname)
+    stale = [m for m in available if force or not manifest.fresh(m, plugfile(m))]
+    if stale:
+        logging.warn("manifest - importing %s" % ", ".join(stale))
+    for modname in stale:
+        error = None
+        try:
+            plugs.reload(modname, force=True, showerror=True)
+        except Exception as ex:
+            handle_exception()
+            error = str(ex)
+        filename = plugfile(modname)
+        if filename:
+            manifest.record(modname, filename, error)
+    manifest.save()
+    target = LazyDict()
+    short = LazyDict()
+    cbtable = LazyDict()
+    plugnames = []
+    for modname in available:
+        entry = manifest.data.plugins.get(modname)
+        if not entry:
+            continue
+        for cmndname, perms in entry["cmnds"].items():
+            target[cmndname] = modname
+            cmndperms[cmndname] = perms
+        for regex in entry["regex"]:
+            retable.data[regex] = modname
+        for types in entry["callbacks"].values():
+            for type in types:
+                if type not in cbtable:
+                    cbtable[type] = []
+                if modname not in cbtable[type]:
+                    cbtable[type].append(modname)
+        for name, (descr, ex, url) in entry["examples"].items():
+            if name not in examples:
+                examples.add(name, descr, ex, url)
+        if entry["cmnds"] and modname.split(".")[-1] not in plugnames:
+            plugnames.append(modname.split(".")[-1])
+    for cmndname in target:
+        try:
+            s = cmndname.split("-")[1]
+        except IndexError:
+            continue
+        if s not in target:
+            if s not in short:
+                short[s] = []
+            short[s].append(cmndname)
+    cmndtable.data = target
+    cmndtable.save()
+    shorttable.data = short
+    shorttable.save()
+    retable.save()
+    callbacktable.data = cbtable
+    callbacktable.save()
+    plugnames.sort()
+    pluginlist.data = plugnames
+    pluginlist.save()
+    if saveperms:
+        cmndperms.save()
+    savealiases()
+    from jsb.lib.commands import resolver
+
+    resolver.invalidate()
+    logging.warn(
+        "manifest - %s plugins known, %s imported" % (len(available), len(stale))
+    )
+    return stale
+
+
+# bootreport function
+
+
+def bootreport():
+    """return time spent in the phases of the last boot and the slowest plugin imports."""
+    from jsb.lib.plugins import plugs
+
+    result = ["%s %.3fs" % (what, took) for what, took in boottimes]
+    loads = sorted(plugs.loadtimes.items(), key=lambda a: a[1], reverse=True)
+    result.extend(["%s %.3fs" % (modname, took) for modname, took in loads[:10]])
+    return result
 
 
 # filestamps stuff
@@ -411,7 +556,7 @@ def savecmndtable(modname=None, saveperms=True):
     else:
         short = LazyDict()
     global cmndperms
-    from jsb.lib.commands import cmnds
+    from jsb.lib.commands import cmnds, resolver
 
     assert cmnds
     for cmndname, c in cmnds.items():
@@ -446,6 +591,7 @@ def savecmndtable(modname=None, saveperms=True):
         retable.data[command.regex] = command.modname
     assert retable
     retable.save()
+    resolver.invalidate()
     if saveperms:
         logging.warn("saving command perms")
         cmndperms.save()
@@ -455,13 +601,14 @@ def removecmnds(modname):
     """remove commands belonging to modname form cmndtable."""
     global cmndtable
     assert cmndtable
-    from jsb.lib.commands import cmnds
+    from jsb.lib.commands import cmnds, resolver
 
     assert cmnds
     for cmndname, c in cmnds.items():
         if c.modname == modname:
             del cmndtable.data[cmndname]
     cmndtable.save()
+    resolver.invalidate()
 
 
 def getcmndtable():
@@ -591,6 +738,9 @@ def clear_tables():
     global pluginlist
     cmndtable.data = {}
     cmndtable.save()
+    from jsb.lib.commands import resolver
+
+    resolver.invalidate()
     callbacktable.data = {}
     callbacktable.save()
     pluginlist.data = []
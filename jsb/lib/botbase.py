@@ -28,7 +28,7 @@ from jsb.utils.url import decode_html_entities
 from .aliases import getaliases
 from .boot import boot, default_plugins, getcmndperms
 from .callbacks import callbacks, first_callbacks, last_callbacks, remote_callbacks
-from .channelbase import ChannelBase
+from .channelbase import channels
 from .commands import Commands, cmnds
 from .config import Config, getmainconfig
 from .errors import (
@@ -299,6 +299,11 @@ class BotBase(LazyDict):
                 handle_exception()
         logging.debug("%s - stopping output loop" % self.cfg.name)
 
+    def startloops(self):
+        """start the threads reading from and writing to the connection."""
+        start_new_thread(self._readloop, ())
+        start_new_thread(self._outloop, ())
+
     def _pingloop(self):
         """output loop."""
         logging.debug("%s - starting ping loop" % self.cfg.name)
@@ -362,7 +367,7 @@ class BotBase(LazyDict):
         for i in target:
             try:
                 logging.debug("%s - joining %s" % (self.cfg.name, i))
-                channel = ChannelBase(i, self.cfg.name)
+                channel = channels.get(i, self.cfg.name)
                 if channel:
                     key = channel.data.key
                 else:
@@ -408,8 +413,7 @@ class BotBase(LazyDict):
             if connect:
                 if not self.connect():
                     return False
-                start_new_thread(self._readloop, ())
-                start_new_thread(self._outloop, ())
+                self.startloops()
                 self.connectok.wait()
                 if self.stopped:
                     logging.warn("bot is stopped")
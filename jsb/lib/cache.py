@@ -7,45 +7,229 @@
 # jsb imports
 
 import logging
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
-from jsb.utils.lazydict import LazyDict
+from jsb.lib.callbacks import callbacks
+from jsb.utils.statdict import StatDict
 
 # basic imports
 
 
 # defines
 
-cache = LazyDict()
+maxitems = 10000
+maxbytes = 64 * 1024 * 1024
+
+# approxsize function
+
+
+def approxsize(item, depth=2):
+    """approximate the number of bytes an item takes up in memory."""
+    try:
+        size = sys.getsizeof(item)
+    except TypeError:
+        return 0
+    if depth <= 0:
+        return size
+    if isinstance(item, dict):
+        for key, value in item.items():
+            size += sys.getsizeof(key) + approxsize(value, depth - 1)
+    elif isinstance(item, (list, tuple)):
+        for value in item:
+            size += approxsize(value, depth - 1)
+    return size
+
+
+# Cache class
+
+
+class Cache(object):
+
+    """
+    LRU cache bounded on number of items and size in bytes, with per item
+    timeouts. items that are pinned by a live owner (a Persist sharing its
+    data through the cache) are never evicted.
+
+    """
+
+    def __init__(self, maxitems=maxitems, maxbytes=maxbytes):
+        self.maxitems = maxitems
+        self.maxbytes = maxbytes
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.pins = {}
+        self.lock = threading.RLock()
+        self.stats = StatDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, name, namespace=""):
+        """get item from the cache, None when not found or expired."""
+        key = (namespace, name)
+        with self.lock:
+            try:
+                item, expire, size = self.items[key]
+            except KeyError:
+                self.stats.upitem("misses")
+                return None
+            if expire and expire < time.time():
+                self._remove(key)
+                self.stats.upitem("expired")
+                self.stats.upitem("misses")
+                return None
+            self.items.move_to_end(key)
+            self.stats.upitem("hits")
+            return item
+
+    def set(self, name, item, timeout=0, namespace=""):
+        """set item in the cache. timeout is in seconds, 0 never expires."""
+        key = (namespace, name)
+        size = approxsize(item)
+        expire = timeout and time.time() + timeout or 0
+        with self.lock:
+            if key in self.items:
+                self._remove(key)
+            self.items[key] = (item, expire, size)
+            self.bytes += size
+            self.stats.upitem("sets")
+            self.evict()
+
+    def delete(self, name, namespace=""):
+        """delete item from the cache."""
+        with self.lock:
+            return self._remove((namespace, name))
+
+    def pin(self, name, owner, namespace=""):
+        """keep item in the cache for as long as owner is alive."""
+        with self.lock:
+            owners = self.pins.get((namespace, name))
+            if owners is None:
+                owners = self.pins[(namespace, name)] = weakref.WeakSet()
+            owners.add(owner)
+
+    def pinned(self, key):
+        """check if a live owner still holds on to key."""
+        owners = self.pins.get(key)
+        if owners is None:
+            return False
+        if not owners:
+            del self.pins[key]
+            return False
+        return True
+
+    def _remove(self, key):
+        try:
+            item, expire, size = self.items.pop(key)
+        except KeyError:
+            return False
+        self.bytes -= size
+        return True
+
+    def evict(self):
+        """drop least recently used items that are not pinned until we are within bounds."""
+        with self.lock:
+            tries = len(self.items)
+            while tries and (
+                len(self.items) > self.maxitems or self.bytes > self.maxbytes
+            ):
+                tries -= 1
+                key = next(iter(self.items))
+                if self.pinned(key):
+                    self.items.move_to_end(key)
+                    continue
+                item, expire, size = self.items.pop(key)
+                self.bytes -= size
+                self.stats.upitem("evictions")
+                logging.debug("cache - evicted %s" % str(key))
+
+    def expire(self):
+        """remove all expired items."""
+        now = time.time()
+        with self.lock:
+            for key in [k for k, v in self.items.items() if v[1] and v[1] < now]:
+                self._remove(key)
+                self.stats.upitem("expired")
+            for key in list(self.pins):
+                self.pinned(key)
+
+    def setlimits(self, maxitems=None, maxbytes=None):
+        """change the bounds of the cache."""
+        if maxitems:
+            self.maxitems = int(maxitems)
+        if maxbytes:
+            self.maxbytes = int(maxbytes)
+        self.evict()
+
+    def namespaces(self):
+        """return number of items per namespace."""
+        result = StatDict()
+        with self.lock:
+            for namespace, name in self.items:
+                result.upitem(namespace or "default")
+        return result
+
+    def status(self):
+        """return statistics of the cache."""
+        hits = self.stats.hits or 0
+        misses = self.stats.misses or 0
+        total = hits + misses
+        return {
+            "items": len(self.items),
+            "maxitems": self.maxitems,
+            "bytes": self.bytes,
+            "maxbytes": self.maxbytes,
+            "hits": hits,
+            "misses": misses,
+            "hitrate": total and "%.1f%%" % (100.0 * hits / total) or "0%",
+            "pinned": len(self.pins),
+            "evictions": self.stats.evictions or 0,
+            "expired": self.stats.expired or 0,
+        }
+
+
+cache = Cache()
 
 # functions
 
 
 def get(name, namespace=""):
     """get data from the cache."""
-    global cache
-    try:
-        # logging.debug("cache - returning %s" % cache[name])
-        return cache[name]
-    except KeyError:
-        pass
+    return cache.get(name, namespace)
 
 
 def set(name, item, timeout=0, namespace=""):
     """set data in the cache."""
-    # logging.debug("cache - setting %s to %s" % (name, str(item)))
-    global cache
-    cache[name] = item
+    cache.set(name, item, timeout, namespace)
 
 
 def delete(name, namespace=""):
     """delete data from the cache."""
-    try:
-        global cache
-        del cache[name]
+    if cache.delete(name, namespace):
         logging.warn("cache - deleted %s" % name)
         return True
-    except KeyError:
-        return False
+    return False
+
+
+def pin(name, owner, namespace=""):
+    """keep data in the cache while owner is alive."""
+    cache.pin(name, owner, namespace)
+
+
+def setlimits(maxitems=None, maxbytes=None):
+    """set the bounds of the global cache."""
+    cache.setlimits(maxitems, maxbytes)
+
+
+def cacheexpire(bot, event):
+    cache.expire()
+
+
+callbacks.add("TICK60", cacheexpire)
 
 
 def size():
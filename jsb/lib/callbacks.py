@@ -48,6 +48,10 @@ class Callback(object):
         self.speed = copy.deepcopy(speed)  # speed to execute callback with
         self.activate = False
         self.enable = True
+        self.calls = 0  # times the callback was checked
+        self.fired = 0  # times the prereq let it through
+        self.time = 0.0  # seconds spent in prereq and dispatch
+        self.maxtime = 0.0
 
 
 # Callbacks class (holds multiple callbacks)
@@ -59,10 +63,33 @@ class Callbacks(object):
     dict of lists containing callbacks.  Callbacks object take care of
     dispatching the callbacks based on incoming events. see Callbacks.check()
 
+    per cbtype dispatch tables (with the ALL callbacks in front) are built
+    on first use and thrown away when plugins add or unload callbacks.
+
     """
 
     def __init__(self):
         self.cbs = Dol()
+        self.tables = {}
+        self.checked = set()
+
+    def invalidate(self):
+        """drop the dispatch tables and the on demand reload bookkeeping."""
+        self.tables = {}
+        self.checked = set()
+
+    def gettable(self, type, deny=()):
+        """return tuple of callbacks to run for type, leaving out plugins in deny."""
+        key = (type, tuple(deny))
+        try:
+            return self.tables[key]
+        except KeyError:
+            pass
+        table = tuple(self.cbs.get("ALL", [])) + tuple(self.cbs.get(type, []))
+        if deny:
+            table = tuple(cb for cb in table if cb.plugname not in deny)
+        self.tables[key] = table
+        return table
 
     def size(self):
         """return number of callbacks."""
@@ -82,6 +109,7 @@ class Callbacks(object):
             )
         else:
             self.cbs.add(what, Callback(modname, func, prereq, kwargs, threaded, speed))
+        self.invalidate()
         logging.debug("added %s (%s)" % (what, modname))
         return self
 
@@ -99,6 +127,7 @@ class Callbacks(object):
         for callback in unload[::-1]:
             self.cbs.delete(callback[0], callback[1])
             logging.debug(" unloaded %s (%s)" % (callback[0], modname))
+        self.invalidate()
 
     def disable(self, plugname):
         """disable all callbacks registered in a plugin."""
@@ -138,17 +167,41 @@ class Callbacks(object):
 
         return result
 
+    def report(self):
+        """return per callback statistics, most time spent first."""
+        result = []
+        cbs = [cb for cblist in list(self.cbs.values()) for cb in cblist if cb.calls]
+        cbs.sort(key=lambda cb: cb.time, reverse=True)
+        for cb in cbs:
+            result.append(
+                "%s.%s: %s/%s fired - %.2f ms avg (max %.2f)"
+                % (
+                    cb.plugname,
+                    getname(cb.func).split(".")[-1],
+                    cb.fired,
+                    cb.calls,
+                    1000 * cb.time / cb.calls,
+                    1000 * cb.maxtime,
+                )
+            )
+        return result
+
     def check(self, bot, event):
         """check for callbacks to be fired."""
-        self.reloadcheck(bot, event)
         type = event.cbtype or event.cmnd
-        if "ALL" in self.cbs:
-            for cb in self.cbs["ALL"]:
-                self.callback(cb, bot, event)
-        if type in self.cbs:
-            target = self.cbs[type]
-            for cb in target:
-                self.callback(cb, bot, event)
+        key = (bot.cfg.name, type)
+        if key not in self.checked:
+            self.reloadcheck(bot, event)
+            self.checked.add(key)
+        table = self.gettable(type)
+        if not table:
+            return
+        if not event.bonded:
+            event.bind(bot)
+        if event.chan and event.chan.data.denyplug:
+            table = self.gettable(type, event.chan.data.denyplug)
+        for cb in table:
+            self.callback(cb, bot, event)
 
     def callback(self, cb, bot, event):
         """do the actual callback with provided bot and event as arguments."""
@@ -156,16 +209,12 @@ class Callbacks(object):
         event.calledfrom = cb.modname
         if not event.bonded:
             event.bind(bot)
+        start = time.time()
         try:
             if event.status == "done":
                 if not event.nolog:
                     logging.debug("callback - event is done .. ignoring")
                 return
-            if event.chan and cb.plugname in event.chan.data.denyplug:
-                logging.debug(
-                    "%s denied in %s - %s" % (cb.modname, event.channel, event.auth)
-                )
-                return
             if cb.prereq:
                 if not event.nolog:
                     logging.debug("executing in loop %s" % str(cb.prereq))
@@ -184,13 +233,13 @@ class Callbacks(object):
                     % (bot.cfg.name, getname(cb.func), event.cbtype)
                 )
             event.iscallback = True
-            if not event.nolog:
+            cb.fired += 1
+            if not event.nolog and logging.getLogger().isEnabledFor(logging.DEBUG):
                 logging.debug(
                     "%s - %s - trail - %s"
                     % (bot.cfg.name, getname(cb.func), callstack(sys._getframe())[::-1])
                 )
             # if not event.direct and cb.threaded and not bot.isgae: start_new_thread(cb.func, (bot, event))
-            time.sleep(0.01)
             if cb.threaded and not bot.isgae:
                 start_new_thread(cb.func, (bot, event))
             else:
@@ -217,6 +266,12 @@ class Callbacks(object):
             return True
         except Exception as ex:
             handle_exception()
+        finally:
+            took = time.time() - start
+            cb.calls += 1
+            cb.time += took
+            if took > cb.maxtime:
+                cb.maxtime = took
 
     def reloadcheck(self, bot, event, target=None):
         """check if plugin need to be reloaded for callback,"""
@@ -8,18 +8,26 @@
 
 import logging
 import os
+import threading
 import time
+from collections import OrderedDict
 
+from jsb.lib.cache import cache
 from jsb.lib.datadir import getdatadir
 from jsb.lib.errors import NoChannelProvided, NoChannelSet
 from jsb.lib.persist import Persist
 from jsb.utils.lazydict import LazyDict
 from jsb.utils.name import stripname
+from jsb.utils.statdict import StatDict
 from jsb.utils.trace import whichmodule
 
 # basic imports
 
 
+# defines
+
+maxchannels = 1000
+
 # classes
 
 
@@ -116,3 +124,79 @@ class ChannelBase(Persist):
         self.data.webchannels = self.data.webchannels[:2]
         self.save()
         return (webchan, token)
+
+
+# ChannelRegistry class
+
+
+class ChannelRegistry(object):
+
+    """
+    live channel objects per bot, so binding an event to its channel is a
+    dict lookup instead of a new Persist. the least recently used channels
+    are dropped when there are more than maxchannels. a channel picks up
+    the data of other ChannelBase objects of the same file that were saved
+    after it was made.
+
+    """
+
+    def __init__(self, maxchannels=maxchannels):
+        self.maxchannels = maxchannels
+        self.channels = OrderedDict()
+        self.lock = threading.RLock()
+        self.stats = StatDict()
+
+    def get(self, id, botname=None):
+        """return the live channel object of id on bot botname."""
+        key = (botname, id)
+        with self.lock:
+            chan = self.channels.get(key)
+            if chan is not None:
+                self.channels.move_to_end(key)
+        if chan is None:
+            chan = ChannelBase(id, botname)
+            with self.lock:
+                chan = self.channels.setdefault(key, chan)
+                while len(self.channels) > self.maxchannels:
+                    self.channels.popitem(last=False)
+                    self.stats.upitem("evicted")
+            self.stats.upitem("misses")
+            return chan
+        data = cache.get(chan.fn)
+        if data is None:
+            cache.set(chan.fn, chan.data)
+        elif data is not chan.data:
+            chan.data = data
+            self.stats.upitem("reloaded")
+        self.stats.upitem("hits")
+        return chan
+
+    def forget(self, id, botname=None):
+        """drop the channel object of id, the next get() makes a new one."""
+        with self.lock:
+            return self.channels.pop((botname, id), None)
+
+    def clear(self, botname=None):
+        """drop all channel objects of a bot, or of all bots."""
+        with self.lock:
+            for key in list(self.channels):
+                if botname is None or key[0] == botname:
+                    del self.channels[key]
+
+    def status(self):
+        """return number of live channels and hit statistics."""
+        with self.lock:
+            return {
+                "channels": len(self.channels),
+                "hits": self.stats.hits or 0,
+                "misses": self.stats.misses or 0,
+                "reloaded": self.stats.reloaded or 0,
+                "evicted": self.stats.evicted or 0,
+            }
+
+
+channels = ChannelRegistry()
+
+
+def size():
+    return len(channels.channels)
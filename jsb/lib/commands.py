@@ -21,6 +21,7 @@ from jsb.utils.lazydict import LazyDict
 from jsb.utils.trace import calledfrom, whichmodule
 from jsb.utils.xmpp import stripped
 
+from . import aliases as aliasmod
 from .aliases import aliascheck, getaliases
 from .boot import getcmndperms
 from .errors import NoSuchCommand, NoSuchUser
@@ -36,6 +37,108 @@ from .threads import start_bot_command, start_new_thread
 
 cpy = copy.deepcopy
 
+# Resolver class
+
+
+class Resolver(object):
+
+    """
+    precomputed command lookup .. one dict maps command names, global
+    aliases and short forms to the command they resolve to and all regex
+    commands are combined into one pattern that rules out non matching
+    lines in a single search. rebuilt when commands, aliases or the boot
+    tables change.
+
+    """
+
+    def __init__(self):
+        self.names = None
+        self.regexes = []
+        self.reprefilter = None
+        self.aliasversion = -1
+        self.builds = 0
+
+    def invalidate(self):
+        """rebuild on next use."""
+        self.names = None
+
+    def build(self, cmnds):
+        """build the name table and regex prefilter."""
+        from .boot import getcmndtable, retable, shorttable
+
+        names = {}
+        if shorttable and shorttable.data:
+            for short, cmndlist in shorttable.data.items():
+                if cmndlist:
+                    names[short] = len(cmndlist) == 1 and cmndlist[0] or cmndlist
+        for cmnd in getcmndtable():
+            names[cmnd] = cmnd
+        for cmnd, c in list(cmnds.items()):
+            if isinstance(c, Command):
+                names[cmnd] = cmnd
+        aliasversion = aliasmod.version
+        for alias, target in list(getaliases(force=False).items()):
+            if target:
+                names[alias] = target.split()[0]
+        regexes = []
+        for c in cmnds.regex:
+            regexes.append((c.cmnd, c, None))
+        if retable and retable.data:
+            for regex, modname in retable.data.items():
+                regexes.append((regex, None, modname))
+        compiled = []
+        for regex, c, modname in regexes:
+            try:
+                compiled.append((re.compile(regex), c, modname))
+            except re.error as ex:
+                logging.warn("can't compile %s regex command - %s" % (regex, str(ex)))
+        try:
+            prefilter = re.compile(
+                "|".join("(?:%s)" % r.pattern for r, c, modname in compiled) or "(?!)"
+            )
+        except re.error:
+            prefilter = None
+        self.regexes = compiled
+        self.reprefilter = prefilter
+        self.aliasversion = aliasversion
+        self.names = names
+        self.builds += 1
+        logging.debug(
+            "resolver built - %s names - %s regexes" % (len(names), len(compiled))
+        )
+
+    def gettable(self, cmnds):
+        """return the name table, rebuilt if anything changed."""
+        names = self.names
+        if names is None or self.aliasversion != aliasmod.version:
+            self.build(cmnds)
+            names = self.names
+        return names
+
+    def resolve(self, cmnds, name):
+        """return command name for name, a list when a short form is ambiguous."""
+        return self.gettable(cmnds).get(name)
+
+    def matchre(self, cmnds, txt, table=False):
+        """
+        return (command, match) of the first regex command matching txt, with
+        table set (modname, match) of the first regex in the boot RE table.
+
+        """
+        self.gettable(cmnds)
+        if self.reprefilter and not self.reprefilter.search(txt):
+            return (None, None)
+        for regex, c, modname in self.regexes:
+            target = table and modname or not table and c
+            if target:
+                match = regex.search(txt)
+                if match:
+                    return (target, match)
+        return (None, None)
+
+
+resolver = Resolver()
+
 # Command class
 
 
@@ -112,6 +215,7 @@ class Commands(LazyDict):
         target = Command(
             modname, cmnd, func, perms, threaded, wait, orig, how, speed=speed
         )
+        resolver.invalidate()
         if regex:
             logging.info("regex command detected - %s" % cmnd)
             self.regex.append(target)
@@ -138,12 +242,11 @@ class Commands(LazyDict):
         return self
 
     def checkre(self, bot, event):
-        for r in self.regex:
-            s = re.search(r.cmnd, event.stripcc().strip())
-            if s:
-                logging.info("regex matches %s" % r.cmnd)
-                event.groups = list(s.groups())
-                return r
+        r, s = resolver.matchre(self, event.stripcc().strip())
+        if r:
+            logging.info("regex matches %s" % r.cmnd)
+            event.groups = list(s.groups())
+            return r
 
     def wouldmatchre(self, bot, event, cmnd=""):
         groups = self.checkre(bot, event)
@@ -171,24 +274,12 @@ class Commands(LazyDict):
             if a:
                 cmnd = a.split()[0]
         except (KeyError, TypeError):
-            try:
-                a = getaliases()[cmnd]
-                if a:
-                    cmnd = a.split()[0]
-            except (KeyError, TypeError):
-                if cmnd not in self:
-                    try:
-                        from .boot import shorttable
-
-                        if cmnd in shorttable.data:
-                            cmndlist = shorttable.data[cmnd]
-                            if len(cmndlist) == 1:
-                                cmnd = cmndlist[0]
-                            else:
-                                event.reply("choose one of: ", cmndlist)
-                                return
-                    except Exception as ex:
-                        handle_exception()
+            target = resolver.resolve(self, cmnd)
+            if type(target) == list:
+                event.reply("choose one of: ", target)
+                return
+            if target:
+                cmnd = target
         logging.info("trying for %s" % cmnd)
         result = None
         try:
@@ -306,6 +397,7 @@ class Commands(LazyDict):
                 delete.append(cmnd)
         for cmnd in delete:
             cmnd.enable = False
+        resolver.invalidate()
         return self
 
     def apropos(self, search):
@@ -352,39 +444,24 @@ class Commands(LazyDict):
         plugloaded = None
         plugin = None
         target = target or event.usercmnd.lower()
-        from jsb.lib.aliases import getaliases
-
-        aliases = getaliases()
-        try:
-            target = aliases[target]
-        except KeyError:
+        if target not in aliasmod.aliases:
             try:
-                target = event.chan.data.aliases[target]
+                target = event.chan.data.aliases[target] or target
             except (AttributeError, KeyError, TypeError):
                 pass
-            if target not in getcmndtable():
-                try:
-                    from .boot import shorttable
-
-                    if target in shorttable.data:
-                        cmndlist = shorttable.data[target]
-                        if len(cmndlist) == 1:
-                            target = cmndlist[0]
-                except Exception as ex:
-                    handle_exception()
         if target:
             target = target.split()[0]
+            resolved = resolver.resolve(self, target)
+            if resolved and type(resolved) != list:
+                target = resolved
         logging.debug("checking for reload of %s" % target)
         try:
             plugin = getcmndtable()[target]
         except KeyError:
             try:
-                from .boot import retable
-
-                for regex, mod in retable.data.items():
-                    if re.search(regex, event.stripcc() or event.txt):
-                        plugin = mod
-                        break
+                plugin, match = resolver.matchre(
+                    self, event.stripcc() or event.txt, table=True
+                )
             except Exception as ex:
                 handle_exception()
         logging.info("plugin is %s" % plugin)
@@ -379,6 +379,14 @@ class Config(LazyDict):
             self.setdefault("dotchars", ", ")
             self._comments["floodallow"] = "# - whether the bot is allowed to flood."
             self.setdefault("floodallow", 1)
+            self._comments[
+                "floodchannel"
+            ] = "# - max commands per minute in one channel, 0 disables."
+            self.setdefault("floodchannel", 30)
+            self._comments[
+                "floodbot"
+            ] = "# - max commands per minute on one bot, 0 disables."
+            self.setdefault("floodbot", 100)
             self._comments[
                 "auto_register"
             ] = "# - enable automatic registration of new users."
@@ -425,6 +433,48 @@ class Config(LazyDict):
             self.setdefault("ticksleep", 1)
             self._comments["bindhost"] = "# - host to bind to"
             self.setdefault("bindhost", "")
+            self._comments[
+                "persistinterval"
+            ] = "# - nr of seconds between write-behind flushes of persisted data, 0 saves directly."
+            self.setdefault("persistinterval", 0)
+            self._comments[
+                "persistmaxdirty"
+            ] = "# - nr of unsaved files that triggers an early write-behind flush."
+            self.setdefault("persistmaxdirty", 50)
+            self._comments[
+                "cachemaxitems"
+            ] = "# - maximum nr of items kept in the bot's memory cache."
+            self.setdefault("cachemaxitems", 10000)
+            self._comments[
+                "cachemaxbytes"
+            ] = "# - approximate maximum nr of bytes kept in the bot's memory cache."
+            self.setdefault("cachemaxbytes", 64 * 1024 * 1024)
+            self._comments[
+                "runnerpool"
+            ] = "# - run commands and callbacks on pools of long lived workers."
+            self.setdefault("runnerpool", 0)
+            self._comments["runnerpoolmin"] = "# - minimum nr of workers kept per pool."
+            self.setdefault("runnerpoolmin", 2)
+            self._comments[
+                "runnerpoolmax"
+            ] = "# - maximum nr of workers per pool, 0 uses each pool's default."
+            self.setdefault("runnerpoolmax", 0)
+            self._comments[
+                "runnerpoolidle"
+            ] = "# - nr of seconds an idle worker above the minimum lives."
+            self.setdefault("runnerpoolidle", 60)
+            self._comments[
+                "ircengine"
+            ] = "# - service all irc connections from one selector based I/O thread."
+            self.setdefault("ircengine", 0)
+            self._comments[
+                "ircenginedispatchers"
+            ] = "# - nr of threads handing events of the irc engine to the bots."
+            self.setdefault("ircenginedispatchers", 4)
+            self._comments[
+                "lazyboot"
+            ] = "# - fill the command tables from the plugin manifest and import plugins on first use."
+            self.setdefault("lazyboot", 0)
         self["createdfrom"] = whichmodule()
         if "xmpp" in self.cfile:
             self.setdefault("fulljids", 1)
@@ -12,6 +12,7 @@ import logging
 import threading
 import time
 import traceback
+import types
 import uuid
 from collections import deque
 
@@ -25,8 +26,9 @@ from jsb.utils.lazydict import LazyDict
 from jsb.utils.locking import lockdec
 from jsb.utils.opts import makeeventopts
 from jsb.utils.trace import whichmodule
+from jsb.utils.waitqueue import WaitQueue
 
-from .channelbase import ChannelBase
+from .channelbase import channels
 from .errors import NoSuchCommand, NoSuchUser, RequireError
 
 # basic imports
@@ -37,14 +39,103 @@ from .errors import NoSuchCommand, NoSuchUser, RequireError
 cpy = copy.deepcopy
 lock = _thread.allocate_lock()
 locked = lockdec(lock)
-
-# classes
+synclock = threading.RLock()
+missing = object()
+functiontypes = (types.FunctionType, types.MethodType)
+bindstats = {}
+bindlock = threading.Lock()
+
+# bind statistics
+
+
+def recordbind(cbtype, elapsed):
+    """keep number, total and max time of binds per event type."""
+    with bindlock:
+        stat = bindstats.setdefault(cbtype or "none", [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        if elapsed > stat[2]:
+            stat[2] = elapsed
+
+
+def bindreport():
+    """return bind statistics per event type, busiest first."""
+    with bindlock:
+        stats = sorted(bindstats.items(), key=lambda a: a[1][0], reverse=True)
+    return [
+        "%s: %s binds - %.1f us (max %.1f)"
+        % (cbtype, nr, 1000000 * total / nr, 1000000 * maxtime)
+        for cbtype, (nr, total, maxtime) in stats
+    ]
+
+
+syncnames = frozenset(
+    ["token", "finished", "busy", "inqueue", "outqueue", "resqueue", "ok"]
+)
+
+# EventSync class
+
+
+class EventSync(object):
+
+    """
+    token, condition, queues and ok flag of an event. they are made on first
+    use, so events that are never waited on (PING, TICK, JOIN ..) don't pay
+    for them. copies of an event share its EventSync.
+
+    """
+
+    __slots__ = (
+        "token",
+        "finished",
+        "busy",
+        "inqueue",
+        "outqueue",
+        "resqueue",
+        "ok",
+        "done",
+    )
+
+    def __init__(self):
+        self.token = self.finished = self.busy = self.ok = None
+        self.inqueue = self.outqueue = self.resqueue = None
+        self.done = False
+
+    def get(self, name):
+        """return attribute name, make it when it's not there yet."""
+        value = getattr(self, name)
+        if value is None:
+            with synclock:
+                value = getattr(self, name)
+                if value is None:
+                    value = self.make(name)
+                    setattr(self, name, value)
+        return value
+
+    def make(self, name):
+        if name == "token":
+            return str(uuid.uuid4().hex)
+        if name == "finished":
+            return threading.Condition()
+        if name == "busy":
+            return deque()
+        if name == "ok":
+            return threading.Event()
+        queue = WaitQueue(cond=self.get("finished"))
+        if name != "inqueue":
+            queue.done = self.done
+        return queue
+
+
+# EventBase class
 
 
 class EventBase(LazyDict):
 
     """basic event class."""
 
+    __slots__ = ()
+
     def __init__(self, input={}, bot=None):
         LazyDict.__init__(self)
         if bot:
@@ -54,22 +145,53 @@ class EventBase(LazyDict):
         self.nrout = self.nrout or 0
         if input:
             self.copyin(input)
-        if not self.token:
-            self.setup()
+        if "_sync" not in self:
+            self["_sync"] = EventSync()
+
+    def __getattr__(self, attr, default=""):
+        """missing attributes are empty, synchronisation attributes are made on first use."""
+        value = dict.get(self, attr, missing)
+        if value is not missing:
+            return value
+        if attr in syncnames:
+            return self.makesync(attr)
+        if default == "":
+            return ""
+        return cpy(default)
+
+    def __setattr__(self, attr, value):
+        """set attribute, only replacing a function goes through the lazydict check."""
+        if type(dict.get(self, attr)) in functiontypes:
+            LazyDict.__setattr__(self, attr, value)
+        else:
+            self[attr] = value
 
     def copyin(self, eventin):
         """copy in an event."""
         self.update(eventin)
         return self
 
+    def synced(self, name):
+        """return synchronisation attribute name if it's made already, None otherwise."""
+        value = dict.get(self, name)
+        if value is None:
+            sync = dict.get(self, "_sync")
+            value = sync and getattr(sync, name)
+        return value
+
+    def makesync(self, name):
+        """return synchronisation attribute name, make it when it's not there yet."""
+        sync = dict.get(self, "_sync")
+        if sync is None:
+            sync = self["_sync"] = EventSync()
+        value = self[name] = sync.get(name)
+        return value
+
     def setup(self):
-        self.token = self.token or str(uuid.uuid4().hex)
-        self.finished = threading.Condition()
-        self.busy = deque()
-        self.inqueue = deque()
-        self.outqueue = deque()
-        self.resqueue = deque()
-        self.ok = threading.Event()
+        """make the synchronisation attributes now instead of on first use."""
+        for name in syncnames:
+            if dict.get(self, name) is None:
+                self.makesync(name)
         return self
 
     def __deepcopy__(self, a):
@@ -89,19 +211,30 @@ class EventBase(LazyDict):
         """signal the event as ready - push None to all queues."""
         if self.nodispatch:
             return
+        busy = self.synced("busy")
         if "TICK" not in self.cbtype:
-            logging.info(self.busy)
-        try:
-            self.busy.remove(self.token)
-        except ValueError:
-            pass
-        if not self.busy or force:
+            logging.info(busy)
+        if busy:
+            try:
+                busy.remove(self.token)
+            except ValueError:
+                pass
+        if not busy or force:
             self.notify()
 
     def notify(self, p=None):
-        self.finished.acquire()
-        self.finished.notifyAll()
-        self.finished.release()
+        sync = dict.get(self, "_sync")
+        if sync:
+            sync.done = True
+        finished = self.synced("finished")
+        if finished is None:
+            return
+        finished.acquire()
+        for q in (self.synced("outqueue"), self.synced("resqueue")):
+            if isinstance(q, WaitQueue):
+                q.done = True
+        finished.notify_all()
+        finished.release()
         if "TICK" not in self.cbtype:
             logging.info("notified %s" % str(self))
 
@@ -117,22 +250,29 @@ class EventBase(LazyDict):
         logging.info("%s wont dispatch" % self.txt)
 
     def wait(self, nr=1000):
+        """wait for the event to be ready, nr is the timeout in milliseconds."""
         nr = int(nr)
         # if self.nodispatch: return
         if not self.busy:
             self.startout()
+        deadline = time.time() + nr / 1000.0
         self.finished.acquire()
-        while nr > 0 and (self.busy and not self.dostop):
-            self.finished.wait(0.1)
-            nr -= 100
-        self.finished.release()
+        try:
+            while self.busy and not self.dostop:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.finished.wait(remaining)
+        finally:
+            self.finished.release()
+        nr = max(0, int((deadline - time.time()) * 1000))
         if self.wait and self.thread:
             logging.warn("joining thread %s" % self.thread)
-            self.thread.join(nr // 1000)
+            self.thread.join(nr / 1000.0)
         if "TICK" not in self.cbtype:
             logging.info(self.busy)
         if not self.resqueue:
-            res = waitforqueue(self.resqueue, nr)
+            res = waitforqueue(self.resqueue, nr // 10)
         else:
             res = self.resqueue
         return list(res)
@@ -182,7 +322,7 @@ class EventBase(LazyDict):
             if t[0] != ";":
                 t = ";" + t
             e = self.bot.make_event(self.userhost, self.channel, t)
-            e.outqueue = deque()
+            e.outqueue = WaitQueue(cond=e.finished)
             e.busy = deque()
             e.prev = None
             e.pipelined = True
@@ -226,21 +366,23 @@ class EventBase(LazyDict):
             logging.debug("already bonded")
             return
         dolog and logging.debug("starting bind on %s - %s" % (self.userhost, self.txt))
+        started = time.time()
         target = self.auth or self.userhost
         bot = bot or self.bot
         if not self.chan:
             if chan:
                 self.chan = chan
             elif self.channel:
-                self.chan = ChannelBase(self.channel, bot.cfg.name)
+                self.chan = channels.get(self.channel, bot.cfg.name)
             elif self.userhost:
-                self.chan = ChannelBase(self.userhost, bot.cfg.name)
+                self.chan = channels.get(self.userhost, bot.cfg.name)
             if self.chan:
                 # self.debug = self.chan.data.debug or False
                 dolog and logging.debug("channel bonded - %s" % self.chan.data.id)
         self.prepare(bot)
         if not target:
             self.bonded = True
+            recordbind(self.cbtype, time.time() - started)
             return
         if not self.user and target and not self.nodispatch:
             if user:
@@ -272,6 +414,7 @@ class EventBase(LazyDict):
         if self.bot:
             self.inchan = self.channel in self.bot.state.data.joinedchannels
         self.bonded = True
+        recordbind(self.cbtype, time.time() - started)
         return self
 
     def bloh(self, bot=None, *args, **kwargs):
@@ -39,6 +39,9 @@ def globalshutdown(exit=True):
         if fleet:
             logging.warn("shutting down fleet")
             fleet.exit()
+        from jsb.drivers.irc.engine import stopengine
+
+        stopengine()
         logging.warn("shutting down plugins")
         from jsb.lib.plugins import plugs
 
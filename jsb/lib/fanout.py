@@ -0,0 +1,191 @@
+# jsb/lib/fanout.py
+#
+#
+
+"""
+    fan out events to other bots/channels .. relay, forward and watcher
+    build one message per event and deliver it to the targets found in a
+    precomputed routing table.
+
+"""
+
+# jsb imports
+
+from jsb.lib.fleet import getfleet
+from jsb.utils.exception import handle_exception
+from jsb.utils.generic import stripcolor
+
+# basic imports
+
+import logging
+import threading
+import time
+
+# Message class
+
+
+class Message(object):
+
+    """
+    formatted message of one event, shared by all targets it goes to. the
+    text is normalized once per bot class it is sent with.
+
+    """
+
+    __slots__ = ("kind", "origin", "txt", "event", "created", "rendered")
+
+    def __init__(self, kind, origin, txt, event):
+        self.kind = kind
+        self.origin = origin
+        self.txt = txt
+        self.event = event
+        self.created = time.time()
+        self.rendered = {}
+
+    def render(self, bot):
+        """return the text as bot would send it."""
+        try:
+            return self.rendered[type(bot)]
+        except KeyError:
+            txt = self.rendered[type(bot)] = stripcolor(bot.normalize(self.txt))
+            return txt
+
+
+# Routes class
+
+
+class Routes(object):
+
+    """routing table of one kind of fan out, rebuilt after invalidate()."""
+
+    def __init__(self, kind, builder):
+        self.kind = kind
+        self.builder = builder
+        self.table = None
+        self.builds = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.table = None
+
+    def get(self, origin):
+        """return the targets of origin."""
+        table = self.table
+        if table is None:
+            with self.lock:
+                table = self.table
+                if table is None:
+                    try:
+                        table = self.builder()
+                    except Exception:
+                        handle_exception()
+                        table = {}
+                    self.table = table
+                    self.builds += 1
+        return table.get(origin, ())
+
+
+# FanOut class
+
+
+class FanOut(object):
+
+    """routing tables, bots to send with and fan out statistics per kind."""
+
+    def __init__(self):
+        self.routes = {}
+        self.bots = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def register(self, kind, builder):
+        """register the function that builds the routing table of kind."""
+        self.routes[kind] = Routes(kind, builder)
+
+    def invalidate(self, kind=None):
+        """rebuild the routing table of kind (or all) on next use."""
+        for routes in self.routes.values():
+            if kind is None or routes.kind == kind:
+                routes.invalidate()
+        if kind is None:
+            self.bots = {}
+
+    def targets(self, kind, origin):
+        """return the targets of origin in the routing table of kind."""
+        try:
+            return self.routes[kind].get(origin)
+        except KeyError:
+            return ()
+
+    def getbot(self, botname, type=None):
+        """return the bot to send with, made when it is not in the fleet."""
+        bot = self.bots.get(botname)
+        if bot is not None and not bot.stopped:
+            return bot
+        fleet = getfleet()
+        bot = fleet.byname(botname)
+        if not bot and type:
+            bot = fleet.makebot(type, botname)
+        if bot:
+            self.bots[botname] = bot
+        return bot
+
+    def deliver(self, message, targets, *args):
+        """send message to (botname, type, target) targets, every target once."""
+        seen = set()
+        sent = 0
+        for botname, type, target in targets:
+            if (botname, target) in seen:
+                continue
+            seen.add((botname, target))
+            outbot = self.getbot(botname, type)
+            if not outbot:
+                logging.info("can't find bot for (%s,%s,%s)" % (botname, type, target))
+                continue
+            try:
+                outbot.outnocb(
+                    target, message.render(outbot), *args, event=message.event
+                )
+                sent += 1
+            except Exception:
+                handle_exception()
+        self.record(message, sent)
+        return sent
+
+    def record(self, message, sent):
+        """keep messages, deliveries and fan out latency per kind."""
+        elapsed = time.time() - message.created
+        with self.lock:
+            stat = self.stats.setdefault(message.kind, [0, 0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += sent
+            stat[2] += elapsed
+            if elapsed > stat[3]:
+                stat[3] = elapsed
+
+    def report(self):
+        """return fan out statistics per kind."""
+        result = []
+        with self.lock:
+            stats = sorted(self.stats.items())
+        for kind, (nr, sent, total, maxtime) in stats:
+            routes = self.routes.get(kind)
+            result.append(
+                "%s: %s messages to %s targets - %.2f ms (max %.2f) - %s route builds"
+                % (
+                    kind,
+                    nr,
+                    sent,
+                    1000 * total / nr,
+                    1000 * maxtime,
+                    routes and routes.builds or 0,
+                )
+            )
+        return result
+
+
+fanout = FanOut()
+
+
+def size():
+    return len(fanout.routes)
@@ -2,101 +2,219 @@
 #
 #
 
-""" JSONBOT flood control. """
+"""
+    JSONBOT flood control .. sliding windows of command times per userhost,
+    with aggregate windows per channel and per bot to catch floods that are
+    spread over many hosts.
 
-# jsb imports
+"""
 
-import logging
-import time
+# jsb imports
 
+from jsb.lib.callbacks import callbacks
 from jsb.lib.config import getmainconfig
-from jsb.utils.lazydict import LazyDict
 from jsb.utils.statdict import StatDict
 
 # basic imports
 
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+# defines
+
+maxentries = 10000
+aggregateperiod = 60
+aggregatewait = 60
+
+# FloodEntry class
+
+
+class FloodEntry(object):
 
-##
+    """flood state of one userhost, channel or bot."""
+
+    __slots__ = ("times", "last", "until", "warned", "limits")
+
+    def __init__(self, limits=None):
+        self.times = deque()
+        self.last = 0.0
+        self.until = 0.0
+        self.warned = False
+        self.limits = limits
+
+
+# FloodControl class
 
 
 class FloodControl(object):
-    def __init__(self):
+
+    """
+    per userhost sliding window limiter. entries are kept in LRU order,
+    bounded to maxentries and expired when idle. the thresholds of a
+    user are looked up once and cached in its entry until reset().
+
+    """
+
+    def __init__(self, maxentries=maxentries):
+        self.maxentries = maxentries
+        self.users = OrderedDict()
+        self.aggregates = OrderedDict()
+        self.lock = threading.RLock()
         self.stats = StatDict()
-        self.times = LazyDict()
-        self.wait = LazyDict()
-        self.warned = LazyDict()
 
     def reset(self, userhost):
-        try:
-            del self.times[userhost]
-        except KeyError:
-            pass
-        try:
-            del self.stats[userhost]
-        except KeyError:
-            pass
-        try:
-            del self.wait[userhost]
-        except KeyError:
-            pass
-        try:
-            del self.warned[userhost]
-        except KeyError:
-            pass
+        """forget the flood state and cached thresholds of userhost."""
+        with self.lock:
+            try:
+                del self.users[userhost]
+            except KeyError:
+                pass
 
-    def check(self, userhost, timetomonitor=60, threshold=10, wait=120, floodrate=1):
-        u = userhost
-        t = time.time()
-        w = wait
-        if u in self.times:
-            if t - self.times[u] > w:
-                self.reset(u)
-                return False
-            if t - self.times[u] < timetomonitor:
-                self.stats.upitem(u)
-            if (self.stats.get(u) > threshold) or (t - self.times[u] < floodrate):
-                self.wait[userhost] = wait
-                return True
+    def getentry(self, table, key, limits=None):
+        """return the entry of key, made most recently used."""
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = FloodEntry(limits)
+            while len(table) > self.maxentries:
+                table.popitem(last=False)
+                self.stats.upitem("evicted")
         else:
-            self.times[u] = t
-            return False
-        if self.stats.get(u) <= threshold:
-            return False
-        return True
+            table.move_to_end(key)
+        return entry
+
+    def hit(self, entry, now, period, threshold, wait, floodrate=0):
+        """count a command in the window of entry, returns True when blocked."""
+        last = entry.last
+        entry.last = now
+        if entry.until:
+            if entry.until > now:
+                return True
+            entry.until = 0.0
+            entry.warned = False
+        times = entry.times
+        while times and now - times[0] > period:
+            times.popleft()
+        times.append(now)
+        if floodrate and now - last < floodrate:
+            times.append(now)
+        if len(times) > threshold:
+            times.clear()
+            entry.until = now + wait
+            self.stats.upitem("blocked")
+            return True
+        return False
+
+    def check(self, userhost, timetomonitor=60, threshold=10, wait=120, floodrate=1):
+        """check if userhost is flooding, commands within floodrate seconds count double."""
+        with self.lock:
+            entry = self.getentry(self.users, userhost)
+            return self.hit(
+                entry, time.time(), timetomonitor, threshold, wait, floodrate
+            )
+
+    def getlimits(self, event, dobind=True):
+        """return (period, threshold, wait, floodrate, isoper) of the user of event."""
+        user = event.user
+        if not user and dobind and event.bot and event.bot.users:
+            user = event.bot.users.getuser(event.userhost)
+        data = user and user.data or {}
+        return (
+            max(data.get("floodtime") or 60, 60),
+            max(data.get("floodthreshold") or 20, 20),
+            max(data.get("floodwait") or 120, 120),
+            max(data.get("floodrate") or 0.1, 0.1),
+            "OPER" in (data.get("perms") or []),
+        )
+
+    def checkaggregate(self, key, now, threshold):
+        """count a command in an aggregate window, returns the entry when blocked."""
+        if not threshold:
+            return None
+        entry = self.getentry(self.aggregates, key)
+        if self.hit(entry, now, aggregateperiod, threshold, aggregatewait):
+            return entry
 
     def checkevent(self, event, dobind=True):
         if not event.iscommand:
             return False
-        if getmainconfig().floodallow:
-            return False
-        if dobind:
-            event.bind()
-        if not event.user:
-            got = False
-        else:
-            got = True
-        t = got and event.user.data.floodtime or 60
-        if t < 60:
-            t = 60
-        threshold = got and event.user.data.floodthreshold or 20
-        if threshold < 20:
-            threshold = 20
-        wait = got and event.user.data.floodwait or 120
-        if wait < 120:
-            wait = 120
-        floodrate = got and event.user.data.floodrate or 0.1
-        if floodrate < 0.1:
-            floodrate = 0.1
-        if not self.check(event.userhost, t, threshold, wait, floodrate):
+        cfg = getmainconfig()
+        if cfg.floodallow:
             return False
-        if event.user and "OPER" in event.user.data.perms:
-            return False
-        logging.warn("floodcontrol block on %s" % event.userhost)
-        if event.userhost not in self.warned:
+        now = time.time()
+        with self.lock:
+            entry = self.users.get(event.userhost)
+            if entry is None or entry.limits is None:
+                limits = self.getlimits(event, dobind)
+                entry = self.getentry(self.users, event.userhost, limits)
+                entry.limits = limits
+            else:
+                self.users.move_to_end(event.userhost)
+            period, threshold, wait, floodrate, oper = entry.limits
+            if oper:
+                return False
+            if not self.hit(entry, now, period, threshold, wait, floodrate):
+                botname = event.bot and event.bot.cfg.name or ""
+                entry = self.checkaggregate(
+                    ("channel", botname, event.channel), now, cfg.floodchannel
+                ) or self.checkaggregate(("bot", botname), now, cfg.floodbot)
+                if not entry:
+                    return False
+                wait = aggregatewait
+            warned = entry.warned
+            entry.warned = True
+        if not warned:
             logging.warn("floodcontrol block on %s" % event.userhost)
             event.reply("floodcontrol enabled (%s seconds)" % wait)
-        self.warned[event.userhost] = time.time()
         return True
 
+    def expire(self, now=None):
+        """drop entries that have been idle longer than their window and wait."""
+        now = now or time.time()
+        with self.lock:
+            for table in [self.users, self.aggregates]:
+                while table:
+                    key, entry = next(iter(table.items()))
+                    if entry.limits:
+                        period, wait = entry.limits[0], entry.limits[2]
+                    else:
+                        period, wait = aggregateperiod, aggregatewait
+                    if entry.until > now or now - entry.last < max(period, wait):
+                        break
+                    del table[key]
+                    self.stats.upitem("expired")
+
+    def status(self):
+        """return number of tracked entries and block statistics."""
+        now = time.time()
+        with self.lock:
+            return {
+                "users": len(self.users),
+                "aggregates": len(self.aggregates),
+                "blocked now": len(
+                    [
+                        e
+                        for table in [self.users, self.aggregates]
+                        for e in table.values()
+                        if e.until > now
+                    ]
+                ),
+                "blocked": self.stats.blocked or 0,
+                "expired": self.stats.expired or 0,
+                "evicted": self.stats.evicted or 0,
+            }
+
 
 floodcontrol = FloodControl()
+
+
+def floodexpire(bot, event):
+    floodcontrol.expire()
+
+
+callbacks.add("TICK60", floodexpire)
+
+
+def size():
+    return len(floodcontrol.users)
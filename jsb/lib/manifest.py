@@ -0,0 +1,134 @@
+# jsb/lib/manifest.py
+#
+#
+
+"""
+    plugin manifest .. what every plugin registers (commands, regexes,
+    callbacks and examples), keyed on mtime and hash of the plugin file so
+    the boot tables can be filled without importing the plugins.
+
+"""
+
+# basic imports
+
+import hashlib
+import importlib.util
+import os
+import sys
+
+# jsb imports
+
+from jsb.utils.lazydict import LazyDict
+
+from .persist import Persist
+
+# filehash function
+
+
+def filehash(filename):
+    """return sha1 hex digest of a file."""
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# plugfile function
+
+
+def plugfile(modname):
+    """return the file a plugin is imported from without importing it."""
+    try:
+        mod = sys.modules.get(modname)
+        if mod:
+            return getattr(mod, "__file__", None)
+        spec = importlib.util.find_spec(modname)
+        return spec and spec.origin
+    except (ImportError, ValueError, AttributeError):
+        return None
+
+
+# Manifest class
+
+
+class Manifest(Persist):
+
+    """per plugin registrations, valid as long as the plugin file is unchanged."""
+
+    def __init__(self, filename):
+        Persist.__init__(self, filename)
+        if not self.data:
+            self.data = LazyDict()
+        self.data.plugins = self.data.plugins or {}
+
+    def fresh(self, modname, filename):
+        """check if the entry of modname still describes filename, rehashes when only the mtime changed."""
+        entry = self.data.plugins.get(modname)
+        if not entry or not filename or entry.get("file") != filename:
+            return False
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return True
+        if entry["hash"] == filehash(filename):
+            entry["mtime"] = stat.st_mtime
+            return True
+        return False
+
+    def record(self, modname, filename, error=None):
+        """store what the (just imported) plugin modname registered."""
+        from .callbacks import (
+            api_callbacks,
+            callbacks,
+            first_callbacks,
+            last_callbacks,
+            remote_callbacks,
+        )
+        from .commands import Command, cmnds
+        from .examples import examples
+
+        stat = os.stat(filename)
+        entry = {
+            "file": filename,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": filehash(filename),
+            "error": error,
+            "cmnds": {},
+            "regex": {},
+            "callbacks": {},
+            "examples": {},
+        }
+        for name, c in list(cmnds.items()):
+            if isinstance(c, Command) and c.modname == modname and c.enable:
+                entry["cmnds"][name] = c.perms
+        for c in cmnds.regex:
+            if c.modname == modname and c.enable:
+                entry["regex"][c.regex] = c.perms
+        for name, cbs in [
+            ("first", first_callbacks),
+            ("callbacks", callbacks),
+            ("last", last_callbacks),
+            ("remote", remote_callbacks),
+            ("api", api_callbacks),
+        ]:
+            types = [
+                type
+                for type, cblist in cbs.cbs.items()
+                if [cb for cb in cblist if cb.modname == modname]
+            ]
+            if types:
+                entry["callbacks"][name] = types
+        for name in entry["cmnds"]:
+            if name in examples:
+                ex = examples[name]
+                entry["examples"][name] = [ex.descr, ex.example, ex.url]
+        self.data.plugins[modname] = entry
+        return entry
+
+    def forget(self, modname):
+        """drop the entry of modname."""
+        return self.data.plugins.pop(modname, None)
+
+    def size(self):
+        return len(self.data.plugins)
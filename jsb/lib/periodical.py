@@ -11,12 +11,16 @@ __license__ = "BSD License"
 
 import _thread
 import datetime
+import heapq
+import itertools
 import logging
 import sys
+import threading
 import time
+from collections import deque
 
 import jsb.lib.threads as thr
-from jsb.lib.callbacks import callbacks
+from jsb.lib.runner import Runner, Runners
 from jsb.utils.exception import handle_exception
 from jsb.utils.locking import lockdec
 from jsb.utils.timeutils import strtotime
@@ -33,6 +37,8 @@ locked = lockdec(plock)
 # defines
 
 pidcount = 0
+maxworkers = 10
+groupmax = 2
 
 # JobError class
 
@@ -56,6 +62,16 @@ class Job(object):
         global pidcount
         pidcount += 1
         self.pid = pidcount
+        self.seq = None
+        self.busy = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.deferred = 0
+        self.lateness = 0.0
+        self.maxlateness = 0.0
+        self.runtime = 0.0
+        self.maxruntime = 0.0
 
     def id(self):
         """return job id."""
@@ -66,11 +82,55 @@ class Job(object):
         return self.group == group
 
     def do(self):
-        """try the callback."""
+        """try the callback, returns False when it raised an exception."""
+        started = time.time()
         try:
             self.func(*self.args, **self.kw)
+            return True
         except Exception:
+            self.failures += 1
             handle_exception()
+            return False
+        finally:
+            elapsed = time.time() - started
+            self.runtime += elapsed
+            if elapsed > self.maxruntime:
+                self.maxruntime = elapsed
+
+    def late(self, lateness):
+        """record how late a run was started."""
+        self.lateness += lateness
+        if lateness > self.maxlateness:
+            self.maxlateness = lateness
+
+    def reschedule(self, now):
+        """set the time of the next run."""
+        self.next = now + self.interval
+
+    def finished(self):
+        """check whether the job ran its number of repeats."""
+        return self.repeat > 0 and self.counts >= self.repeat
+
+    def status(self):
+        """return one line of job statistics."""
+        runs = self.runs or 1
+        return (
+            "%s %s (%s) - next in %ss - %s runs, %s failed, %s skipped, %s deferred - late %.1f ms (max %.1f) - run %.1f ms (max %.1f)"
+            % (
+                self.pid,
+                self.description,
+                self.group,
+                int(self.next - time.time()),
+                self.runs,
+                self.failures,
+                self.skipped,
+                self.deferred,
+                1000 * self.lateness / runs,
+                1000 * self.maxlateness,
+                1000 * self.runtime / runs,
+                1000 * self.maxruntime,
+            )
+        )
 
 
 class JobAt(Job):
@@ -98,6 +158,7 @@ class JobAt(Job):
             self.delta = d.seconds
         else:
             self.delta = interval
+        self.interval = self.delta
 
     def __repr__(self):
         """return a string representation of the JobAt object."""
@@ -108,16 +169,9 @@ class JobAt(Job):
             str(self.func),
         )
 
-    def check(self):
-        """run check to see if job needs to be scheduled."""
-        if self.next <= time.time():
-            logging.info("running %s - %s" % (str(self.func), self.description))
-            self.func(*self.args, **self.kw)
-            self.next += self.delta
-            self.counts += 1
-            if self.repeat > 0 and self.counts >= self.repeat:
-                return False
-        return True
+    def reschedule(self, now):
+        """at jobs keep their time of day."""
+        self.next += self.delta
 
 
 class JobInterval(Job):
@@ -151,57 +205,184 @@ class JobInterval(Job):
             )
         )
 
-    def check(self):
-        """run check to see if job needs to be scheduled."""
-        if self.next <= time.time():
-            logging.info("running %s - %s" % (str(self.func), self.description))
-            self.next = time.time() + self.interval
-            thr.start_new_thread(self.do, ())
-            self.counts += 1
-            if self.repeat > 0 and self.counts >= self.repeat:
-                return False
-        return True
+
+# JobRunner class
+
+
+class JobRunner(Runner):
+
+    """pool worker running periodical jobs."""
+
+    def handle(self, speed, args):
+        """run a job and hand it back to the scheduler."""
+        descr, func, job = args
+        self.working = True
+        try:
+            func(job)
+        except Exception as ex:
+            handle_exception()
+        self.working = False
+
+
+# Periodical class
 
 
 class Periodical(object):
 
-    """periodical scheduler."""
+    """
+    periodical scheduler. jobs are kept in a heap on their next run time,
+    a scheduler thread sleeps until the first one is due and dispatches it
+    on a bounded worker pool. a job is never run twice at the same time
+    and at most groupmax jobs of one plugin run at once, the others wait
+    for a free slot in their group.
 
-    def __init__(self):
+    """
+
+    def __init__(self, maxworkers=maxworkers, groupmax=groupmax):
         self.jobs = []
         self.running = []
         self.run = True
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition(threading.RLock())
+        self.changed = False
+        self.started = False
+        self.groupmax = groupmax
+        self.active = {}
+        self.waiting = {}
+        self.runner = Runners("periodical", maxworkers, JobRunner)
+        self.runner.setpool(0, maxworkers)
 
     def size(self):
         return len(self.jobs)
 
+    def push(self, job, when=None):
+        """put job on the heap at its next run time, stale entries are skipped later."""
+        with self.cond:
+            job.seq = next(self.seq)
+            heapq.heappush(self.heap, (when or job.next, job.seq, job))
+            self.changed = True
+            self.cond.notify()
+
+    def schedule(self, job):
+        """add a job and make sure the scheduler thread runs."""
+        with self.cond:
+            self.jobs.append(job)
+            self.push(job)
+            if not self.started:
+                self.started = True
+                thr.start_new_thread(self.loop, ())
+
     def addjob(self, sleeptime, repeat, function, description="", *args, **kw):
         """add a periodical job."""
         job = JobInterval(sleeptime, repeat, function, *args, **kw)
         job.group = calledfrom(sys._getframe())
         job.description = str(description) or whichmodule()
-        self.jobs.append(job)
+        self.schedule(job)
         return job.pid
 
     def changeinterval(self, pid, interval):
         """change interval of of peridical job."""
-        for i in periodical.jobs:
-            if i.pid == pid:
-                i.interval = interval
-                i.next = time.time() + interval
-
-    def looponce(self, bot, event):
-        """loop over the jobs."""
-        for job in self.jobs:
-            if job.next <= time.time():
-                self.runjob(job)
-
-    def runjob(self, job):
-        """run a periodical job."""
-        if not job.check():
-            self.killjob(job.id())
+        with self.cond:
+            for i in self.jobs:
+                if i.pid == pid:
+                    i.interval = interval
+                    i.next = time.time() + interval
+                    self.push(i)
+
+    def loop(self):
+        """scheduler thread .. sleep until the next job is due."""
+        logging.warn("periodical - scheduler started")
+        while self.run:
+            wait = self.looponce()
+            with self.cond:
+                if self.changed:
+                    self.changed = False
+                    continue
+                if not self.run:
+                    break
+                self.cond.wait(wait)
+
+    def looponce(self, bot=None, event=None):
+        """run the jobs that are due, returns seconds until the next one."""
+        now = time.time()
+        wait = None
+        with self.cond:
+            while self.heap:
+                when, seq, job = self.heap[0]
+                if seq != job.seq:
+                    heapq.heappop(self.heap)
+                    continue
+                if when > now:
+                    wait = when - now
+                    break
+                heapq.heappop(self.heap)
+                job.seq = None
+                self.runjob(job, now)
+            self.changed = False
+        return wait
+
+    def runjob(self, job, now=None):
+        """dispatch a due job, skip it when still running or park it when its group is full."""
+        now = now or time.time()
+        with self.cond:
+            if job not in self.jobs:
+                return
+            if job.busy:
+                job.skipped += 1
+                job.reschedule(now)
+                self.push(job)
+                return
+            if self.active.get(job.group, 0) >= self.groupmax:
+                job.deferred += 1
+                self.waiting.setdefault(job.group, deque()).append(job)
+                return
+            self.dispatch(job, now)
+
+    def dispatch(self, job, now):
+        """put job on the worker pool and schedule its next run."""
+        logging.info("running %s - %s" % (str(job.func), job.description))
+        job.late(now - job.next)
+        job.busy = True
+        job.runs += 1
+        job.counts += 1
+        self.active[job.group] = self.active.get(job.group, 0) + 1
+        self.running.append(job)
+        if job.finished():
+            self.jobs.remove(job)
         else:
-            self.running.append(job)
+            job.reschedule(now)
+            self.push(job)
+        self.runner.put(5, job.description, self.dojob, job)
+
+    def dojob(self, job):
+        """run job in a pool worker, then start the next parked job of its group."""
+        try:
+            job.do()
+        finally:
+            with self.cond:
+                job.busy = False
+                self.active[job.group] -= 1
+                if not self.active[job.group]:
+                    del self.active[job.group]
+                try:
+                    self.running.remove(job)
+                except ValueError:
+                    pass
+                waiting = self.waiting.get(job.group)
+                while waiting:
+                    parked = waiting.popleft()
+                    if parked in self.jobs:
+                        self.dispatch(parked, time.time())
+                        break
+                if not waiting:
+                    self.waiting.pop(job.group, None)
+
+    def status(self):
+        """return statistics of all jobs, the first to run first."""
+        with self.cond:
+            jobs = sorted(self.jobs, key=lambda j: j.next)
+            return [job.status() for job in jobs]
 
     def kill(self):
         """kill all jobs invoked by another module."""
@@ -210,37 +391,27 @@ class Periodical(object):
 
     def killgroup(self, group):
         """kill all jobs with the same group."""
-
-        def shoot():
-            """knock down all jobs belonging to group."""
+        with self.cond:
             deljobs = [job for job in self.jobs if job.member(group)]
             for job in deljobs:
                 self.jobs.remove(job)
-                try:
-                    self.running.remove(job)
-                except ValueError:
-                    pass
-            logging.warn("killed %d jobs for %s" % (len(deljobs), group))
-            del deljobs
-
-        return shoot()
+                job.seq = None
+        logging.warn("killed %d jobs for %s" % (len(deljobs), group))
 
     def killjob(self, jobId):
         """kill one job by its id."""
-
-        def shoot():
+        with self.cond:
             deljobs = [x for x in self.jobs if x.id() == jobId]
-            numjobs = len(deljobs)
             for job in deljobs:
                 self.jobs.remove(job)
-                try:
-                    self.running.remove(job)
-                except ValueError:
-                    pass
-            del deljobs
-            return numjobs
+                job.seq = None
+        return len(deljobs)
 
-        return shoot()
+    def stop(self):
+        """stop the scheduler thread."""
+        with self.cond:
+            self.run = False
+            self.cond.notify()
 
 
 def interval(sleeptime, repeat=0):
@@ -254,7 +425,7 @@ def interval(sleeptime, repeat=0):
             job = JobInterval(sleeptime, repeat, function, *args, **kw)
             job.group = group
             job.description = whichmodule()
-            periodical.jobs.append(job)
+            periodical.schedule(job)
             logging.warn(
                 "new interval job %d with sleeptime %d" % (job.id(), sleeptime)
             )
@@ -275,7 +446,7 @@ def at(start, interval=1, repeat=1):
             job = JobAt(start, interval, repeat, function, *args, **kw)
             job.group = group
             job.description = whichmodule()
-            periodical.jobs.append(job)
+            periodical.schedule(job)
 
         wrapper.__dict__ = function.__dict__
         return wrapper
@@ -292,7 +463,7 @@ def persecond(function):
         job = JobInterval(1, 0, function, *args, **kw)
         job.group = group
         job.description = whichmodule()
-        periodical.jobs.append(job)
+        periodical.schedule(job)
         logging.debug("new interval job %d running per second" % job.id())
 
     return wrapper
@@ -307,7 +478,7 @@ def minutely(function):
         job = JobInterval(60, 0, function, *args, **kw)
         job.group = group
         job.description = whichmodule()
-        periodical.jobs.append(job)
+        periodical.schedule(job)
         logging.warn("new interval job %d running minutely" % job.id())
 
     return wrapper
@@ -324,7 +495,7 @@ def hourly(function):
         job.group = group
         job.description = whichmodule()
         logging.warn("new interval job %d running hourly" % job.id())
-        periodical.jobs.append(job)
+        periodical.schedule(job)
 
     return wrapper
 
@@ -339,16 +510,14 @@ def daily(function):
         job = JobInterval(86400, 0, function, *args, **kw)
         job.group = group
         job.description = whichmodule()
-        periodical.jobs.append(job)
-        logging.warb("new interval job %d running daily" % job.id())
+        periodical.schedule(job)
+        logging.warn("new interval job %d running daily" % job.id())
 
     return wrapper
 
 
 periodical = Periodical()
 
-callbacks.add("TICK", periodical.looponce)
-
 
 def size():
     return periodical.size()
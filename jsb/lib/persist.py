@@ -16,15 +16,18 @@ import logging
 import os
 import os.path
 import sys
+import threading
 from collections import deque
 
 from jsb.imports import getjson
 from jsb.lib.callbacks import callbacks
 from jsb.lib.errors import JSONParseError, MemcachedCounterError
+from jsb.lib.threads import start_new_thread
 from jsb.utils.exception import handle_exception
 from jsb.utils.lazydict import LazyDict
 from jsb.utils.locking import lockdec
 from jsb.utils.name import stripname
+from jsb.utils.statdict import StatDict
 from jsb.utils.timeutils import elapsedstring
 from jsb.utils.trace import calledfrom, callstack, where, whichmodule
 
@@ -52,9 +55,79 @@ persistlocked = lockdec(persistlock)
 
 needsaving: deque = deque()
 
+# write-behind state .. dirty Persist objects keyed on filename
+
+dirty: dict = {}
+dirtylock = _thread.allocate_lock()
+flushevent = threading.Event()
+flusher = None
+persiststats = StatDict()
+
+
+def getwritebehind():
+    """return (interval, maxdirty) of the write-behind mode. interval 0 is disabled."""
+    try:
+        from jsb.lib.config import getmainconfig
+
+        cfg = getmainconfig()
+        return (int(cfg.persistinterval or 0), int(cfg.persistmaxdirty or 50))
+    except (ImportError, ValueError, TypeError):
+        return (0, 50)
+
+
+def markdirty(p):
+    """mark a Persist object as needing a save, coalescing saves of the same file."""
+    global flusher
+    interval, maxdirty = getwritebehind()
+    with dirtylock:
+        if p.fn in dirty:
+            persiststats.upitem("coalesced")
+        dirty[p.fn] = p
+        nrdirty = len(dirty)
+        if not flusher:
+            flusher = start_new_thread(flushloop, ())
+    persiststats.upitem("saves")
+    if nrdirty >= maxdirty:
+        flushevent.set()
+
+
+def flush():
+    """write all dirty Persist objects to disk."""
+    with dirtylock:
+        todo = list(dirty.values())
+        dirty.clear()
+    if not todo:
+        return 0
+    persiststats.upitem("flushes")
+    for p in todo:
+        try:
+            p.dosave(indent=None)
+        except RuntimeError as ex:
+            logging.warn("%s changed during flush, retrying - %s" % (p.fn, str(ex)))
+            markdirty(p)
+        except (OSError, IOError) as ex:
+            logging.error("failed to flush %s - %s" % (p.fn, str(ex)))
+            if p not in needsaving:
+                needsaving.append(p)
+    logging.info("flushed %s persist objects" % len(todo))
+    return len(todo)
+
+
+def flushloop():
+    """background flusher of the write-behind mode."""
+    while True:
+        interval = getwritebehind()[0] or 1
+        flushevent.wait(interval)
+        flushevent.clear()
+        try:
+            flush()
+        except Exception as ex:
+            handle_exception()
+
 
 def cleanup(bot=None, event=None):
     global needsaving
+    flush()
     todo = cpy(needsaving)
     r = []
     for p in todo:
@@ -343,7 +416,7 @@ except ImportError:
                 got = True
         if got == False:
             logging.debug("no memcached found - using own cache")
-        from .cache import get, set, delete
+        from .cache import get, set, delete, pin
 
     import fcntl
 
@@ -388,6 +461,7 @@ except ImportError:
             self.dontsave = False
             if init:
                 self.init(default)
+                pin(self.fn, self)
                 if default is None:
                     default = LazyDict()
 
@@ -401,6 +475,8 @@ except ImportError:
             try:
                 logging.debug("using name %s" % self.fn)
                 a = get(self.fn)
+                if a is None and self.fn in dirty:
+                    a = dirty[self.fn].data
                 if a:
                     self.data = a
                 else:
@@ -466,6 +542,10 @@ except ImportError:
             return self
 
         def save(self):
+            if getwritebehind()[0]:
+                set(self.fn, self.data)
+                markdirty(self)
+                return
             cleanup()
             global needsaving
             try:
@@ -476,7 +556,7 @@ except ImportError:
                     needsaving.append(self)
 
         @persistlocked
-        def dosave(self):
+        def dosave(self, indent=True):
             """persist data attribute."""
             try:
                 if self.dontsave:
@@ -511,7 +591,10 @@ except ImportError:
                 tmp = fn + ".tmp"  # tmp file to save to
                 datafile = open(tmp, "w")
                 fcntl.flock(datafile, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                json.dump(self.data, datafile, indent=True)
+                if indent:
+                    json.dump(self.data, datafile, indent=indent)
+                else:
+                    json.dump(self.data, datafile, separators=(",", ":"))
                 fcntl.flock(datafile, fcntl.LOCK_UN)
                 datafile.close()
                 try:
@@ -519,6 +602,7 @@ except ImportError:
                 except (IOError, OSError):
                     os.remove(fn)
                     os.rename(tmp, fn)
+                persiststats.upitem("writes")
                 jsontxt = json.dumps(self.data)
                 logging.debug("setting cache %s - %s" % (fn, jsontxt))
                 self.jsontxt = jsontxt
@@ -687,3 +771,13 @@ class GlobalPersistCollection(PersistCollection):
 
 
 callbacks.add("TICK60", cleanup)
+
+
+def size():
+    return "dirty: %s - saves: %s - coalesced: %s - writes: %s - flushes: %s" % (
+        len(dirty),
+        persiststats.saves or 0,
+        persiststats.coalesced or 0,
+        persiststats.writes or 0,
+        persiststats.flushes or 0,
+    )
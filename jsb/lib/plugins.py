@@ -49,6 +49,7 @@ class Plugins(LazyDict):
     """the plugins object contains all the plugins."""
 
     loading = LazyDict()
+    loadtimes = LazyDict()
 
     def size(self):
         return len(self)
@@ -181,6 +182,7 @@ class Plugins(LazyDict):
         if plugblacklist and modname in plugblacklist.data:
             logging.warn("%s is in blacklist .. not loading." % modname)
             return loaded
+        start = time.time()
         if modname in self:
             try:
                 logging.debug("%s already loaded" % modname)
@@ -222,6 +224,7 @@ class Plugins(LazyDict):
             logging.debug("%s threaded_init started" % modname)
         except Exception as ex:
             raise
+        self.loadtimes[modname] = time.time() - start
         logging.warn("%s loaded" % modname)
         return self[modname]
 
@@ -7,8 +7,12 @@
 # jsb imports
 
 import _thread
+import itertools
 import logging
+import queue
 import random
+import sys
+import threading
 import time
 
 from jsb.lib.callbacks import callbacks
@@ -67,6 +71,34 @@ class Runner(RunnerLoop):
         # finally: rlockmanager.release()
         self.working = False
 
+    def _poolloop(self):
+        """pool worker loop .. take jobs from the shared queue of the pool."""
+        pool = self.pool
+        logging.debug("%s - starting pool worker" % self.name)
+        self.running = True
+        while not self.stopped:
+            pool.setidle(1)
+            try:
+                speed, seq, queued, data = pool.queue.get(timeout=pool.idle)
+            except queue.Empty:
+                if pool.retire(self):
+                    break
+                continue
+            finally:
+                pool.setidle(-1)
+            if self.stopped or not data:
+                break
+            self.nowrunning = getname(data[1])
+            started = time.time()
+            try:
+                self.handle(speed, data)
+            except Exception as ex:
+                handle_exception()
+            pool.record(data[0], started - queued, time.time() - started)
+        self.running = False
+        pool.retire(self, force=True)
+        logging.debug("%s - stopping pool worker" % self.name)
+
     def done(self, event):
         try:
             int(event.cbtype)
@@ -148,14 +180,82 @@ class Runners(object):
         self.runners = []
         self.runnertype = runnertype
         self.doready = doready
+        self.pool = False
+        self.min = 0
+        self.idle = 60
+        self.idlers = 0
+        self.queue = queue.PriorityQueue()
+        self.seq = itertools.count()
+        self.lock = threading.RLock()
+        self.longrunning = []
+        self.stats = {}
 
     def names(self):
         return [getname(runner.name) for runner in self.runners]
 
     def size(self):
+        if self.pool:
+            return "%s/%s" % (self.queue.qsize(), len(self.runners))
         qsize = [runner.queue.qsize() for runner in self.runners]
         return "%s/%s" % (qsize, len(self.runners))
 
+    def setpool(self, min=2, max=None, idle=60):
+        """switch to pool mode .. long lived workers on one shared priority queue."""
+        with self.lock:
+            self.min = min
+            self.max = max or self.max
+            self.idle = idle
+            if self.pool:
+                return
+            self.pool = True
+            old = self.runners
+            self.runners = []
+            for runner in old:
+                runner.queue.put((sys.maxsize, None))
+            while len(self.runners) < self.min:
+                self.makenew()
+        logging.warn(
+            "%s - pool mode (%s-%s workers, %s sec idle)"
+            % (self.name, self.min, self.max, self.idle)
+        )
+
+    def setidle(self, delta):
+        """adjust the number of pool workers waiting for a job."""
+        with self.lock:
+            self.idlers += delta
+
+    def retire(self, runner, force=False):
+        """remove an idle pool worker when we have more than min workers."""
+        with self.lock:
+            if runner not in self.runners:
+                return True
+            if not force and len(self.runners) <= self.min:
+                return False
+            self.runners.remove(runner)
+            return True
+
+    def record(self, descr, waited, ran):
+        """keep per plugin statistics of pool jobs."""
+        with self.lock:
+            stat = self.stats.setdefault(descr, [0, 0.0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += waited
+            stat[2] += ran
+            if waited > stat[3]:
+                stat[3] = waited
+
+    def report(self):
+        """return pool statistics per plugin, busiest first."""
+        result = []
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda a: a[1][0], reverse=True)
+        for descr, (nr, waited, ran, maxwait) in stats:
+            result.append(
+                "%s: %s jobs - wait %.1f ms (max %.1f) - run %.1f ms"
+                % (descr, nr, 1000 * waited / nr, 1000 * maxwait, 1000 * ran / nr)
+            )
+        return result
+
     def runnersizes(self):
         """return sizes of runner objects."""
         result = []
@@ -166,13 +266,23 @@ class Runners(object):
     def stop(self):
         """stop runners."""
         for runner in self.runners:
-            runner.stop()
+            if self.pool:
+                runner.stopped = True
+                self.queue.put((-1, next(self.seq), time.time(), None))
+            else:
+                runner.stop()
 
     def start(self):
         """overload this if needed."""
 
     def put(self, speed, *data):
         """put a job on a free runner."""
+        if self.pool:
+            self.queue.put((speed, next(self.seq), time.time(), data))
+            with self.lock:
+                if self.idlers < self.queue.qsize() and len(self.runners) < self.max:
+                    self.makenew()
+            return
         for runner in self.runners:
             if runner.queue.empty():
                 runner.put(speed, *data)
@@ -193,6 +303,14 @@ class Runners(object):
     def makenew(self):
         """create a new runner."""
         runner = None
+        if self.pool:
+            with self.lock:
+                runner = self.runnertype(self.name + "-" + str(next(self.seq)))
+                runner.pool = self
+                runner.longrunning = self.longrunning
+                self.runners.append(runner)
+            start_new_thread(runner._poolloop, ())
+            return runner
         if len(self.runners) < self.max:
             runner = self.runnertype(self.name + "-" + str(len(self.runners)))
             runner.start()
@@ -203,6 +321,8 @@ class Runners(object):
 
     def cleanup(self):
         """clean up idle runners."""
+        if self.pool:
+            return
         r = []
         for runner in self.runners:
             if runner.queue.empty():
@@ -236,6 +356,21 @@ callbackrunner = Runners("callback", 30, BotEventRunner)
 waitrunner = Runners("wait", 20, BotEventRunner)
 apirunner = Runners("api", 10, BotEventRunner)
 
+# pool mode
+
+
+def setpools(cfg):
+    """switch the global runners to pool mode when enabled in the config."""
+    if not cfg.runnerpool:
+        return
+    for runners in [cmndrunner, longrunner, callbackrunner, waitrunner, apirunner]:
+        runners.setpool(
+            int(cfg.runnerpoolmin or 2),
+            int(cfg.runnerpoolmax or 0),
+            int(cfg.runnerpoolidle or 60),
+        )
+
+
 # cleanup
 
 
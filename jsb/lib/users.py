@@ -9,6 +9,8 @@
 import copy
 import logging
 import os
+import re
+import threading
 
 from jsb.utils.exception import exceptionmsg, handle_exception
 from jsb.utils.generic import stripped
@@ -47,6 +49,97 @@ class JsonUser(Persist):
         self.data.status = self.data.status or list(status)
         self.data.email = self.data.email or list(email)
         self.state = UserState(name)
+        self.key = name
+        self.index = None
+
+    def save(self):
+        """save the user and update the index it is resident in."""
+        Persist.save(self)
+        if self.index:
+            self.index.add(self)
+
+
+# UserIndex class
+
+
+def maskre(mask):
+    """regex of a userhost mask, only * and ? are wildcards."""
+    return re.escape(mask).replace("\\*", ".*").replace("\\?", ".") + r"\Z"
+
+
+class UserIndex(object):
+
+    """
+    resident index of users .. user objects, their perms/permits/status
+    and the users per perm and status. userhost masks with * and ? wildcards
+    are compiled into one regex that is rebuilt when the names change, they
+    match case sensitive just like the exact userhost lookup.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}
+        self.perms = {}
+        self.permits = {}
+        self.status = {}
+        self.byperm = {}
+        self.bystatus = {}
+        self.masks = None
+        self.complete = False
+
+    def get(self, key):
+        """return resident user object of key, None if not loaded yet."""
+        return self.users.get(key)
+
+    def add(self, user):
+        """(re)index user, deleted users are kept resident but not indexed."""
+        with self.lock:
+            self.drop(user.key)
+            user.index = self
+            self.users[user.key] = user
+            if not user.data.userhosts or user.data.deleted:
+                return
+            name = user.data.name.lower()
+            self.perms[user.key] = frozenset(user.data.perms)
+            self.permits[user.key] = frozenset(user.data.permits)
+            self.status[user.key] = frozenset(user.data.status)
+            for perm in self.perms[user.key]:
+                self.byperm.setdefault(perm, set()).add(name)
+            for status in self.status[user.key]:
+                self.bystatus.setdefault(status, set()).add(name)
+
+    def drop(self, key):
+        """remove user with key from the index."""
+        with self.lock:
+            user = self.users.pop(key, None)
+            for perm in self.perms.pop(key, []):
+                self.byperm[perm].discard(user.data.name.lower())
+            for status in self.status.pop(key, []):
+                self.bystatus[status].discard(user.data.name.lower())
+            self.permits.pop(key, None)
+
+    def setnames(self):
+        """mark the userhost masks as changed."""
+        self.masks = None
+
+    def match(self, userhost, names):
+        """return name of the first userhost mask in names matching userhost."""
+        masks = self.masks
+        if masks is None:
+            with self.lock:
+                userhosts = [u for u in names if "*" in u or "?" in u]
+                pattern = "|".join(
+                    "(?P<m%s>%s)" % (nr, maskre(mask))
+                    for nr, mask in enumerate(userhosts)
+                )
+                masks = self.masks = (
+                    re.compile(pattern or "(?!)"),
+                    [names[u] for u in userhosts],
+                )
+        match = masks[0].match(userhost)
+        if match:
+            return masks[1][int(match.lastgroup[1:])]
 
 
 # Users class
@@ -63,6 +156,15 @@ class Users(Persist):
         if not self.data:
             self.data = LazyDict()
         self.data.names = self.data.names or {}
+        self.index = UserIndex()
+
+    def loadall(self):
+        """make all users resident so the perm and status indexes are complete."""
+        if self.index.complete:
+            return
+        for name in set(self.data.names.values()):
+            self.byname(name)
+        self.index.complete = True
 
     def all(self):
         """get all users."""
@@ -82,11 +184,13 @@ class Users(Persist):
         return list(self.data.names.values())
 
     def byname(self, name):
-        """return user by name."""
+        """return user by name, loaded from disk only the first time."""
         try:
-            name = name.lower()
-            # name = stripname(name)
-            user = JsonUser(name)
+            key = stripname(name.lower())
+            user = self.index.get(key)
+            if not user:
+                user = JsonUser(key)
+                self.index.add(user)
             if user.data.userhosts and not user.data.deleted:
                 return user
         except KeyError:
@@ -101,6 +205,7 @@ class Users(Persist):
                 user.data.userhosts.append(userhost)
                 user.save()
             self.data.names[userhost] = name
+            self.index.setnames()
             self.save()
             logging.warn("%s merged with %s" % (userhost, name))
             return 1
@@ -114,13 +219,13 @@ class Users(Persist):
         return result
 
     def getuser(self, userhost):
-        """get user based on userhost."""
-        try:
-            user = self.byname(self.data.names[userhost])
-            if user:
-                return user
-        except KeyError:
-            logging.debug("can't find %s in names cache" % userhost)
+        """get user based on userhost, userhosts with wildcards act as masks."""
+        name = self.data.names.get(userhost) or self.index.match(
+            userhost, self.data.names
+        )
+        if name:
+            return self.byname(name)
+        logging.debug("can't find %s in names cache" % userhost)
 
     # Check functions
 
@@ -144,10 +249,8 @@ class Users(Persist):
             logging.warn("%s userhost denied" % userhost)
             return res
         else:
-            uperms = set(user.data.perms)
-            sperms = set(perms)
-            intersection = sperms.intersection(uperms)
-            res = list(intersection) or None
+            uperms = self.index.perms.get(user.key, frozenset())
+            res = [perm for perm in perms if perm in uperms] or None
         if not res and log:
             logging.warn("%s perm %s denied (%s)" % (userhost, str(perms), str(uperms)))
         return res
@@ -157,7 +260,7 @@ class Users(Persist):
         user = self.getuser(userhost)
         res = None
         if user:
-            if "%s %s" % (who, what) in user.data.permits:
+            if "%s %s" % (who, what) in self.index.permits.get(user.key, ()):
                 res = 1
         return res
 
@@ -166,7 +269,7 @@ class Users(Persist):
         user = self.getuser(userhost)
         res = None
         if user:
-            if status.upper() in user.data.status:
+            if status.upper() in self.index.status.get(user.key, ()):
                 res = 1
         return res
 
@@ -264,22 +367,13 @@ class Users(Persist):
 
     def getpermusers(self, perm):
         """return all users that have the specified perm."""
-        result = []
-        names = cpy(self.data.names)
-        for name in names:
-            user = JsonUser(name)
-            if perm.upper() in user.data.perms:
-                result.append(user.data.name)
-        return result
+        self.loadall()
+        return sorted(self.index.byperm.get(perm.upper(), ()))
 
     def getstatususers(self, status):
         """return all users that have the specified status."""
-        result = []
-        for name in self.data.names:
-            user = JsonUser(name.lower())
-            if status in user.data.status:
-                result.append(user.data.name.lower())
-        return result
+        self.loadall()
+        return sorted(self.index.bystatus.get(status, ()))
 
     # Set Functions
 
@@ -304,6 +398,8 @@ class Users(Persist):
         newuser = JsonUser(name, userhosts, perms)
         for userhost in userhosts:
             self.data.names[userhost] = name
+        self.index.add(newuser)
+        self.index.setnames()
         newuser.save()
         self.save()
         logging.warn("%s added to user database - %s" % (name, ", ".join(perms)))
@@ -373,10 +469,12 @@ class Users(Persist):
         name = name.lower()
         user = self.byname(name)
         if not user:
-            user = self.users[name] = JsonUser(name=name)
+            user = JsonUser(name=name)
         user.data.userhosts.append(userhost)
         user.save()
+        self.index.add(user)
         self.data.names[userhost] = name
+        self.index.setnames()
         self.save()
         return 1
 
@@ -416,10 +514,11 @@ class Users(Persist):
 
     def addpermall(self, perm):
         """add permission to all users."""
-        for name in self.data.names:
-            user = JsonUser(name.lower())
-            user.data.perms.append(perm.upper())
-            user.save()
+        for name in set(self.data.names.values()):
+            user = self.byname(name)
+            if user:
+                user.data.perms.append(perm.upper())
+                user.save()
 
     # Delete functions
 
@@ -466,7 +565,7 @@ class Users(Persist):
         """delete user with name."""
         try:
             name = name.lower()
-            user = JsonUser(name)
+            user = self.index.get(stripname(name)) or JsonUser(name)
             logging.warn("deleting %s - %s" % (name, user))
             user.data.deleted = True
             user.save()
@@ -476,6 +575,8 @@ class Users(Persist):
                         del self.data.names[userhost]
                     except KeyError:
                         logging.warn("can't delete %s from names cache" % userhost)
+            self.index.add(user)
+            self.index.setnames()
             self.save()
             return True
         except NoSuchUser:
@@ -490,6 +591,7 @@ class Users(Persist):
                 user.save()
             try:
                 del self.data.names[userhost]
+                self.index.setnames()
                 self.save()
             except KeyError:
                 pass
@@ -7,10 +7,14 @@
 # jsb imports
 
 import copy
+import heapq
+import itertools
 import logging
+import threading
 import time
 import uuid
 
+from jsb.lib.callbacks import callbacks
 from jsb.lib.runner import waitrunner
 from jsb.utils.exception import handle_exception
 from jsb.utils.trace import whichmodule
@@ -21,6 +25,7 @@ from jsb.utils.trace import whichmodule
 # defines
 
 cpy = copy.deepcopy
+waittimeout = 300
 
 # Wait class
 
@@ -33,7 +38,14 @@ class Wait(object):
     """
 
     def __init__(
-        self, cbtypes, cbs=None, userhosts=None, modname=None, event=None, queue=None
+        self,
+        cbtypes,
+        cbs=None,
+        userhosts=None,
+        modname=None,
+        event=None,
+        queue=None,
+        timeout=None,
     ):
         self.created = time.time()
         if type(cbtypes) != list:
@@ -41,7 +53,11 @@ class Wait(object):
                 cbtypes,
             ]
         self.cbtypes = cbtypes
-        self.userhosts = userhosts
+        if userhosts and type(userhosts) != list:
+            userhosts = [
+                userhosts,
+            ]
+        self.userhosts = userhosts and set(userhosts) or None
         if cbs and type(cbs) != list:
             cbs = [
                 cbs,
@@ -49,7 +65,10 @@ class Wait(object):
         self.cbs = cbs
         self.modname = modname
         self.origevent = event
+        self.channel = event and event.channel or None
         self.queue = queue
+        self.expires = self.created + (timeout or waittimeout)
+        self.key = None
 
     def check(self, bot, event):
         """check whether event matches this wait object. if so call callbacks."""
@@ -57,14 +76,9 @@ class Wait(object):
         logging.debug("waiter - checking for %s - %s" % (target, self.cbtypes))
         if target not in self.cbtypes:
             return
-        if (
-            event.channel
-            and self.origevent
-            and not event.channel == self.origevent.channel
-        ):
+        if event.channel and self.channel and not event.channel == self.channel:
             logging.warn(
-                "waiter - %s and %s dont match"
-                % (event.channel, self.origevent.channel)
+                "waiter - %s and %s dont match" % (event.channel, self.channel)
             )
             return
         if self.userhosts and event.userhost and event.userhost not in self.userhosts:
@@ -94,61 +108,158 @@ class Wait(object):
 
 class Waiter(object):
 
-    """list of wait object to match."""
+    """
+    wait objects indexed on cbtype and channel, so an event only visits the
+    waiters that can match it. every wait has an expiry time, expired waits
+    are popped from a heap when events come in and on TICK60.
+
+    """
 
     def __init__(self):
         self.waiters = {}
+        self.index = {}
+        self.expiry = []
+        self.seq = itertools.count()
+        self.lock = threading.RLock()
+        self.expired = 0
 
     def size(self):
         return len(self.waiters)
 
-    def register(self, cbtypes, cbs=None, userhosts=None, event=None, queue=None):
+    def register(
+        self, cbtypes, cbs=None, userhosts=None, event=None, queue=None, timeout=None
+    ):
         """add a wait object to the waiters dict."""
         logging.warn(
             "waiter - registering wait object: %s - %s" % (str(cbtypes), str(userhosts))
         )
         key = str(uuid.uuid4())
-        self.waiters[key] = Wait(
-            cbtypes, cbs, userhosts, modname=whichmodule(), event=event, queue=queue
+        wait = Wait(
+            cbtypes,
+            cbs,
+            userhosts,
+            modname=whichmodule(),
+            event=event,
+            queue=queue,
+            timeout=timeout,
         )
+        wait.key = key
+        with self.lock:
+            self.waiters[key] = wait
+            for cbtype in wait.cbtypes:
+                self.index.setdefault(cbtype, {}).setdefault(wait.channel, {})[
+                    key
+                ] = wait
+            heapq.heappush(self.expiry, (wait.expires, next(self.seq), key))
         return key
 
     def ready(self, key):
-        try:
-            del self.waiters[key]
-        except KeyError:
-            logging.warn("wait - %s key is not in waiters" % key)
+        with self.lock:
+            try:
+                wait = self.waiters.pop(key)
+            except KeyError:
+                logging.warn("wait - %s key is not in waiters" % key)
+                return
+            self.unindex(wait)
+            if len(self.expiry) > 2 * len(self.waiters) + 100:
+                self.expiry = [
+                    (w.expires, next(self.seq), w.key) for w in self.waiters.values()
+                ]
+                heapq.heapify(self.expiry)
+
+    def unindex(self, wait):
+        """remove wait from the cbtype/channel index."""
+        for cbtype in wait.cbtypes:
+            channels = self.index.get(cbtype)
+            if not channels:
+                continue
+            bucket = channels.get(wait.channel)
+            if bucket is None:
+                continue
+            bucket.pop(wait.key, None)
+            if not bucket:
+                del channels[wait.channel]
+                if not channels:
+                    del self.index[cbtype]
+
+    def candidates(self, event):
+        """return the wait objects that can match event."""
+        channels = self.index.get(event.cmnd or event.cbtype)
+        if not channels:
+            return []
+        if not event.channel:
+            return [w for bucket in channels.values() for w in bucket.values()]
+        result = list(channels.get(None, {}).values())
+        if event.channel in channels:
+            result.extend(channels[event.channel].values())
+        return result
 
     def check(self, bot, event):
-        """scan waiters for possible wait object that match."""
+        """run the wait objects that match event, returns the matches."""
+        if self.expiry and self.expiry[0][0] < time.time():
+            self.expire()
+        if not self.index:
+            return []
+        with self.lock:
+            candidates = self.candidates(event)
         matches = []
-        for wait in list(self.waiters.values()):
-            result = wait.check(bot, event)
-            if not wait.cbtypes:
+        for wait in candidates:
+            if wait.check(bot, event):
                 matches.append(wait)
-        if matches:
-            self.delete(matches)
         return matches
 
+    def expire(self, now=None):
+        """drop the wait objects whose expiry time has passed."""
+        now = now or time.time()
+        with self.lock:
+            while self.expiry and self.expiry[0][0] < now:
+                expires, seq, key = heapq.heappop(self.expiry)
+                wait = self.waiters.pop(key, None)
+                if not wait:
+                    continue
+                logging.warn("waiter - %s from %s expired" % (key, wait.modname))
+                self.unindex(wait)
+                self.expired += 1
+            if not self.waiters:
+                self.expiry = []
+
     def delete(self, removed):
-        """delete a list of wait items from the waiters dict."""
+        """delete a list of wait items (or their keys) from the waiters dict."""
         logging.debug("waiter - removing from waiters: %s" % str(removed))
-        for w in removed:
-            try:
-                del self.waiters[w]
-            except KeyError:
-                pass
+        with self.lock:
+            for w in removed:
+                wait = self.waiters.pop(getattr(w, "key", w), None)
+                if wait:
+                    self.unindex(wait)
 
     def remove(self, modname):
         """remove all waiter registered by modname."""
-        removed = []
-        for wait in list(self.waiters.values()):
-            if wait.modname == modname:
-                removed.append(wait)
-        if removed:
-            self.delete(removed)
+        with self.lock:
+            removed = [w for w in self.waiters.values() if w.modname == modname]
+            if removed:
+                self.delete(removed)
+
+    def status(self):
+        """return number of waiters per cbtype and expiry statistics."""
+        with self.lock:
+            return {
+                "waiters": len(self.waiters),
+                "cbtypes": dict(
+                    (cbtype, sum([len(b) for b in channels.values()]))
+                    for cbtype, channels in self.index.items()
+                ),
+                "heap": len(self.expiry),
+                "expired": self.expired,
+            }
 
 
 # the global waiter object
 
 waiter = Waiter()
+
+
+def waiterexpire(bot, event):
+    waiter.expire()
+
+
+callbacks.add("TICK60", waiterexpire)
@@ -26,7 +26,7 @@ def handle_feedback(bot, event):
 
     """
     if not event.rest and event.inqueue:
-        payload = waitforqueue(event.inqueue, 2000)
+        payload = waitforqueue(event.inqueue, 200)
     else:
         payload = event.rest
     fleet = getfleet()
@@ -20,6 +20,7 @@ from jsb.lib.container import Container
 from jsb.lib.errors import NoProperDigest
 from jsb.lib.eventbase import EventBase
 from jsb.lib.examples import examples
+from jsb.lib.fanout import Message, fanout
 from jsb.lib.fleet import getfleet
 from jsb.lib.persist import PlugPersist
 from jsb.plugs.common.twitter import postmsg
@@ -39,7 +40,18 @@ from jsb.utils.locking import locked
 
 # defines
 
-forward = PlugPersist("forward-core")
+
+class ForwardPersist(PlugPersist):
+
+    """forward data, saving it rebuilds the forward routes on next use."""
+
+    def save(self):
+        """save the data and drop the forward routing table."""
+        PlugPersist.save(self)
+        fanout.invalidate("forward")
+
+
+forward = ForwardPersist("forward-core")
 if not forward.data.allowin:
     forward.data.allowin = []
 if not forward.data.channels:
@@ -68,11 +80,34 @@ def forwardoutpre(bot, event):
     return False
 
 
+# routing table of forward
+
+
+def forwardroutes():
+    """build the forward routing table, invalid JIDs are left out."""
+    table = {}
+    for channel, jids in forward.data.channels.items():
+        routes = []
+        for jid in jids:
+            if not "@" in jid:
+                logging.error("forward - %s is not a valid JID" % jid)
+                continue
+            routes.append(jid)
+        if routes:
+            table[channel.lower()] = routes
+    return table
+
+
+fanout.register("forward", forwardroutes)
+
 # forward-callback
 
 
 def forwardoutcb(bot, event):
     """forward callback."""
+    jids = fanout.targets("forward", event.channel.lower())
+    if not jids:
+        return
     e = cpy(event)
     logging.debug("forward - cbtype is %s - %s" % (event.cbtype, event.how))
     e.forwarded = True
@@ -82,30 +117,36 @@ def forwardoutcb(bot, event):
         event.bind(bot)
     if event.chan:
         e.allowwatch = event.chan.data.allowwatch
-    fleet = getfleet()
-    for jid in forward.data.channels[event.channel.lower()]:
-        if not "@" in jid:
-            logging.error("forward - %s is not a valid JID" % jid)
-            continue
+    message = Message("forward", event.channel.lower(), e.txt, e)
+    outbot = None
+    container = None
+    sent = 0
+    for jid in jids:
         logging.info("forward - sending to %s" % jid)
         if jid == "twitter":
             try:
                 postmsg(forward.data.outs[jid], e.txt)
+                sent += 1
             except Exception as ex:
                 handle_exception()
             continue
-        outbot = fleet.getfirstjabber(bot.isgae)
-        if not outbot and bot.isgae:
-            outbot = fleet.makebot("xmpp", "forwardbot")
-        if outbot:
+        if not container:
+            fleet = getfleet()
+            outbot = fleet.getfirstjabber(bot.isgae)
+            if not outbot and bot.isgae:
+                outbot = fleet.makebot("xmpp", "forwardbot")
+            if not outbot:
+                logging.info("forward - no xmpp bot found in fleet".upper())
+                break
             e.source = outbot.cfg.user
-            txt = outbot.normalize(e.tojson())
-            txt = stripcolor(txt)
-            # txt = e.tojson()
-            container = Container(outbot.cfg.user, txt)
-            outbot.outnocb(jid, container.tojson())
-        else:
-            logging.info("forward - no xmpp bot found in fleet".upper())
+            txt = stripcolor(outbot.normalize(e.tojson()))
+            container = Container(outbot.cfg.user, txt).tojson()
+        try:
+            outbot.outnocb(jid, container)
+            sent += 1
+        except Exception as ex:
+            handle_exception()
+    fanout.record(message, sent)
 
 
 first_callbacks.add("BLIP_SUBMITTED", forwardoutcb, forwardoutpre)
@@ -13,10 +13,9 @@ from jsb.lib.callbacks import first_callbacks
 from jsb.lib.commands import cmnds
 from jsb.lib.errors import NoSuchWave
 from jsb.lib.examples import examples
+from jsb.lib.fanout import Message, fanout
 from jsb.lib.fleet import getfleet
 from jsb.lib.persist import PlugPersist
-from jsb.utils.exception import handle_exception
-from jsb.utils.generic import stripcolor
 
 # basic imports
 
@@ -26,8 +25,19 @@ from jsb.utils.generic import stripcolor
 # through object.data. When data changes call object.save()
 # see jsb/persist/persist.py
 
-block = PlugPersist("block")
-relay = PlugPersist("relay")
+
+class RelayPersist(PlugPersist):
+
+    """relay or block data, saving it rebuilds the relay routes on next use."""
+
+    def save(self):
+        """save the data and drop the relay routing table."""
+        PlugPersist.save(self)
+        fanout.invalidate("relay")
+
+
+block = RelayPersist("block")
+relay = RelayPersist("relay")
 
 # CALLBACKS
 
@@ -78,52 +88,45 @@ def relayprecondition(bot, event):
 def relaycallback(bot, event):
     """this is the callbacks that handles the responses to questions."""
     # determine where the event came from
-    # event.isrelayed = True
+    origin = str((bot.cfg.name, event.channel))
+    targets = fanout.targets("relay", origin)
+    if not targets:
+        return
     e = cpy(event)
-    origin = str((bot.cfg.name, e.channel))
     e.isrelayed = True
     e.headlines = True
-    try:
-        # loop over relays for origin
-        for botname, type, target in relay.data[origin]:
+    if e.nick == bot.cfg.nick:
+        txt = "[!] %s" % e.txt
+    else:
+        txt = "[%s] %s" % (e.nick, e.txt)
+    fanout.deliver(Message("relay", origin, txt, e), targets, "normal")
+
+
+# routing table of the relay .. loops and blocked targets are left out
+
+
+def relayroutes():
+    """build the relay routing table from the relay and block data."""
+    table = {}
+    for origin, targets in relay.data.items():
+        blocked = block.data.get(origin) or []
+        routes = []
+        for item in targets:
             try:
-                logging.debug("trying relay of %s to (%s,%s)" % (origin, type, target))
-                # if target == origin: continue
-                # tests to prevent looping
-                if origin == (botname, target):
-                    continue
-                # check whether relay is blocked
-                if origin in block.data:
-                    if [botname, type, target] in block.data[origin]:
-                        continue
-                # retrieve the bot from fleet (based on type)
-                fleet = getfleet()
-                outbot = fleet.byname(botname)
-                if not outbot:
-                    outbot = fleet.makebot(type, botname)
-                if outbot:
-                    logging.info(
-                        "outbot found - %s - %s" % (outbot.cfg.name, outbot.type)
-                    )
-                    # we got bot .. use it to send the relayed message
-                    if e.nick == bot.cfg.nick:
-                        txt = "[!] %s" % e.txt
-                    else:
-                        txt = "[%s] %s" % (e.nick, e.txt)
-                    if event:
-                        t = "[%s]" % outbot.cfg.nick
-                    logging.debug("sending to %s (%s)" % (target, outbot.cfg.name))
-                    txt = outbot.normalize(txt)
-                    txt = stripcolor(txt)
-                    outbot.outnocb(target, txt, "normal", event=e)
-                else:
-                    logging.info(
-                        "can't find bot for (%s,%s,%s)" % (botname, type, target)
-                    )
-            except Exception as ex:
-                handle_exception()
-    except KeyError:
-        pass
+                botname, type, target = item
+            except ValueError:
+                continue
+            if origin == str((botname, target)):
+                continue
+            if [botname, type, target] in blocked:
+                continue
+            routes.append((botname, type, target))
+        if routes:
+            table[origin] = routes
+    return table
+
+
+fanout.register("relay", relayroutes)
 
 
 # MORE CORE BUSINESS
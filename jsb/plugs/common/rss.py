@@ -23,10 +23,11 @@ from jsb.lib.channelbase import ChannelBase
 # jsb imports
 from jsb.lib.commands import cmnds
 from jsb.lib.datadir import getdatadir
-from jsb.lib.errors import NameNotSet
+from jsb.lib.errors import NameNotSet, URLNotEnabled
 from jsb.lib.examples import examples
 from jsb.lib.fleet import getfleet
 from jsb.lib.persist import Persist, PlugPersist
+from jsb.lib.persistconfig import PersistConfig
 from jsb.lib.tasks import taskmanager
 from jsb.lib.threads import start_new_thread
 from jsb.utils.exception import handle_exception
@@ -35,7 +36,7 @@ from jsb.utils.lazydict import LazyDict
 from jsb.utils.pdod import Pdod
 from jsb.utils.pdol import Pdol
 from jsb.utils.statdict import StatDict
-from jsb.utils.url import geturl2, useragent
+from jsb.utils.url import HTTPPool, geturl2, useragent
 
 # google imports
 
@@ -58,12 +59,18 @@ except ImportError:
 
 # basic imports
 
+import base64
 import copy
 import hashlib
+import http.client
 import logging
 import os
+import random
 import re
+import threading
 import time
+import urllib.parse
+from collections import OrderedDict, deque
 
 # exceptions
 
@@ -116,6 +123,12 @@ possiblemarkup = {
     "nofeedname": "if you don't want the feedname shown",
 }
 
+# plug config
+
+cfg = PersistConfig()
+cfg.define("pollworkers", 5)
+cfg.define("pollperhost", 2)
+
 ## global data
 
 lastpoll = PlugPersist("lastpoll")
@@ -174,6 +187,83 @@ def strippassword(url):
     return url
 
 
+# SeenSet class
+
+
+class SeenSet(object):
+
+    """ordered set of item digests with O(1) lookup and FIFO eviction of the oldest."""
+
+    def __init__(self, length=200):
+        self.length = length
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, digest):
+        return digest in self.items
+
+    def add(self, digest, length=None):
+        """add a digest, return True if it wasn't seen yet."""
+        if digest in self.items:
+            return False
+        self.items[digest] = None
+        self.length = length or self.length
+        while len(self.items) > self.length:
+            self.items.popitem(last=False)
+        return True
+
+    def dump(self):
+        """return the digests, oldest first, as one base64 string."""
+        return base64.b64encode(b"".join(self.items)).decode()
+
+    def load(self, txt):
+        """load digests as dumped by dump()."""
+        raw = base64.b64decode(txt)
+        for i in range(0, len(raw), 16):
+            self.add(raw[i : i + 16])
+        return self
+
+    def loadlist(self, seen):
+        """load the old list of hex digests, newest first."""
+        for digest in reversed(seen):
+            try:
+                self.add(bytes.fromhex(digest))
+            except (ValueError, TypeError):
+                continue
+        return self
+
+
+seenindex = {}
+
+
+def getseen(data):
+    """return the SeenSet of a feed, converting the old seen list if needed."""
+    name = data.name
+    if name not in seenindex:
+        seen = SeenSet(data.length or 200)
+        if data.seenb64:
+            seen.load(data.seenb64)
+        elif data.seen:
+            logging.warn("%s - converting %s seen items" % (name, len(data.seen)))
+            seen.loadlist(data.seen)
+        seenindex[name] = seen
+    return seenindex[name]
+
+
+def itemdigest(data, itemslist):
+    """return the md5 digest of the itemslist values of a feed item."""
+    d = {}
+    for item in itemslist:
+        try:
+            d[item] = data[item]
+        except (KeyError, TypeError):
+            continue
+    # TODO: add FORMD normalization
+    return hashlib.md5(str(d).encode()).digest()
+
+
 # Feed class
 
 
@@ -210,7 +300,7 @@ class Feed(Persist):
             self.data["url"] = self.data.url or str(url)
             self.data["owner"] = self.data.owner or str(owner)
             self.data["result"] = []
-            self.data["seen"] = self.data.seen or []
+            self.seen = getseen(self.data)
             self.data["watchchannels"] = self.data.watchchannels or list(watchchannels)
             self.data["running"] = self.data.running or running
             self.itemslists = Pdol(filebase + "-itemslists")
@@ -219,28 +309,10 @@ class Feed(Persist):
             raise NameNotSet()
 
     def checkseen(self, data, itemslist=["title", "link"]):
-        d = {}
-        for item in itemslist:
-            try:
-                d[item] = data[item]
-            except (KeyError, TypeError):
-                continue
-        # TODO: add FORMD normalization
-        digest = hashlib.md5(str(d).encode()).hexdigest()
-        return digest in self.data.seen
+        return itemdigest(data, itemslist) in self.seen
 
     def setseen(self, data, itemslist=["title", "link"], length=200):
-        d = {}
-        got = False
-        for item in itemslist:
-            d[item] = data[item]
-        # TODO: add formD normalization
-        digest = hashlib.md5(str(d).encode()).hexdigest()
-        if digest not in self.data.seen:
-            self.data.seen.insert(0, digest)
-            got = True
-        self.data.seen = self.data.seen[: self.data.length]
-        return got
+        return self.seen.add(itemdigest(data, itemslist), self.data.length)
 
     def ownercheck(self, userhost):
         """check is userhost is the owner of the feed."""
@@ -252,6 +324,9 @@ class Feed(Persist):
 
     def save(self, coreonly=False):
         """save rss data."""
+        self.data["seenb64"] = self.seen.dump()
+        if "seen" in self.data:
+            del self.data["seen"]
         Persist.save(self)
         if not coreonly:
             self.itemslists.save()
@@ -282,6 +357,7 @@ class Feed(Persist):
             etag = etags.data[name]
         else:
             etag = None
+        modified = lastmodified.data.get(name) or None
         if data:
             result = feedparser.parse(data.content, etag=etag)
             try:
@@ -291,7 +367,9 @@ class Feed(Persist):
         else:
             url = self.data["url"]
             logging.info("fetching %s" % strippassword(url))
-            result = feedparser.parse(url, agent=useragent(), etag=etag)
+            result = feedparser.parse(
+                url, agent=useragent(), etag=etag, modified=modified
+            )
             try:
                 status = result.status
             except AttributeError:
@@ -308,6 +386,7 @@ class Feed(Persist):
                 etags.sync()
             except KeyError:
                 etag = None
+            modified = data.headers.get("last-modified")
         else:
             try:
                 etag = etags.data[name] = result.etag
@@ -315,6 +394,10 @@ class Feed(Persist):
                 etags.sync()
             except (AttributeError, KeyError):
                 etag = None
+            modified = result.get("modified")
+        if modified and name:
+            lastmodified.data[name] = modified
+            lastmodified.sync()
         if not name in urls.data:
             urls.data[name] = self.data.url
             urls.save()
@@ -942,6 +1025,7 @@ class Rsswatcher(Rssdict):
 watcher = Rsswatcher("rss")
 urls = PlugPersist("urls")
 etags = PlugPersist("etags")
+lastmodified = PlugPersist("lastmodified")
 
 assert watcher
 
@@ -971,6 +1055,8 @@ def dosync(feedname):
 
 # shouldpoll function
 
+jitter = {}
+
 
 def shouldpoll(name, curtime):
     """check whether a new poll is needed."""
@@ -990,7 +1076,9 @@ def shouldpoll(name, curtime):
         "pollcheck - %s - %s - remaining %s"
         % (name, time.ctime(lp), (lp + st) - curtime)
     )
+    st *= jitter.setdefault(name, random.uniform(0.9, 1.1))
     if curtime - lp > st:
+        del jitter[name]
         return True
 
 
@@ -1093,6 +1181,152 @@ def doperiodicalGAE(*args, **kwargs):
         urls.save()
 
 
+# FeedPoller class
+
+
+class FeedPoller(object):
+
+    """poll due feeds on a bounded pool of workers with a per host limit."""
+
+    def __init__(self, workers=5, perhost=2):
+        self.workers = workers
+        self.perhost = perhost
+        self.pending = deque()
+        self.queued = {}
+        self.hosts = StatDict()
+        self.hostnames = {}
+        self.threads = []
+        self.cond = threading.Condition()
+        self.http = HTTPPool(perhost)
+        self.sweep = StatDict(start=time.time())
+        self.lastsweep = None
+
+    def newsweep(self):
+        """start a new sweep, keep the statistics of the previous one."""
+        with self.cond:
+            if self.sweep.feeds:
+                self.lastsweep = self.sweep
+            self.sweep = StatDict(start=time.time())
+            self.hostnames = {}
+
+    def submit(self, name):
+        """queue a feed for polling."""
+        with self.cond:
+            if name in self.queued:
+                return False
+            self.queued[name] = time.time()
+            self.pending.append(name)
+            self.sweep.upitem("feeds")
+            if len(self.threads) < self.workers:
+                self.threads.append(start_new_thread(self._loop, ()))
+            self.cond.notify()
+        return True
+
+    def gethost(self, name):
+        """return the host of the url of feed name, looked up once per sweep."""
+        try:
+            return self.hostnames[name]
+        except KeyError:
+            pass
+        feed = watcher.feeds.get(name) or Feed(name)
+        try:
+            host = urllib.parse.urlsplit(feed.data.url).hostname or name
+        except (ValueError, AttributeError):
+            host = name
+        self.hostnames[name] = host
+        return host
+
+    def take(self):
+        """return the first pending feed whose host has room, None when idle too long."""
+        with self.cond:
+            while True:
+                for name in self.pending:
+                    host = self.gethost(name)
+                    if self.hosts.get(host, 0) < self.perhost:
+                        self.pending.remove(name)
+                        self.hosts.upitem(host)
+                        return (name, host)
+                if not self.cond.wait(120) and not self.pending:
+                    return (None, None)
+
+    def _loop(self):
+        while True:
+            name, host = self.take()
+            if not name:
+                break
+            try:
+                self.poll(name)
+            except Exception as ex:
+                handle_exception()
+            finally:
+                with self.cond:
+                    self.hosts.downitem(host)
+                    self.queued.pop(name, None)
+                    self.cond.notify_all()
+        with self.cond:
+            try:
+                self.threads.remove(threading.current_thread())
+            except ValueError:
+                pass
+
+    def poll(self, name):
+        """fetch a feed with a conditional GET and deliver new items."""
+        feed = watcher.byname(name)
+        if not feed or feed.data.stoprunning or not feed.data.running:
+            return
+        headers = {}
+        if etags.data.get(name):
+            headers["If-None-Match"] = etags.data[name]
+        if lastmodified.data.get(name):
+            headers["If-Modified-Since"] = lastmodified.data[name]
+        sweep = self.sweep
+        start = time.time()
+        try:
+            data = self.http.fetch(feed.data.url, headers)
+        except (OSError, http.client.HTTPException, URLNotEnabled) as ex:
+            logging.warn("%s - fetch error: %s" % (name, str(ex)))
+            sweep.upitem("errors")
+            return
+        latency = time.time() - start
+        sweep.upitem("fetched")
+        sweep.upitem("latency", latency)
+        if latency > (sweep.maxlatency or 0):
+            sweep.maxlatency = latency
+        if data.status_code == 304:
+            sweep.upitem("notmodified")
+            return
+        if data.status_code != 200:
+            logging.warn("%s - fetch returned status %s" % (name, data.status_code))
+            sweep.upitem("errors")
+            return
+        entries = feed.fetchdata(data)
+        if entries:
+            result = feed.check(entries)
+            if result:
+                feed.deliver(result)
+
+    def status(self, sweep=None):
+        """return statistics of a sweep."""
+        sweep = sweep or self.sweep
+        if not sweep:
+            return "no sweep done yet"
+        fetched = sweep.fetched or 0
+        return (
+            "%s - %s feeds - %s fetched - %s errors - %.1f%% not modified (304) - latency avg %.3f max %.3f sec"
+            % (
+                time.ctime(sweep.start),
+                sweep.feeds or 0,
+                fetched,
+                sweep.errors or 0,
+                fetched and 100.0 * (sweep.notmodified or 0) / fetched or 0,
+                fetched and (sweep.latency or 0) / fetched or 0,
+                sweep.maxlatency or 0,
+            )
+        )
+
+
+poller = FeedPoller(cfg.get("pollworkers") or 5, cfg.get("pollperhost") or 2)
+
 # doperiodical function
 
 
@@ -1100,23 +1334,22 @@ def doperiodical(*args, **kwargs):
     """rss periodical function."""
     got = False
     curtime = time.time()
+    try:
+        from google.appengine.ext.deferred import defer
+    except ImportError:
+        defer = None
     for feed in watcher.data.names:
         if not watcher.shouldpoll(feed, curtime):
             continue
         lastpoll.data[feed] = curtime
+        if not got and not defer:
+            poller.newsweep()
         got = True
         logging.debug("periodical - launching %s" % feed)
-        try:
-            from google.appengine.ext.deferred import defer
-
+        if defer:
             defer(dosync, feed)
-        except ImportError:
-            try:
-                start_new_thread(dosync, (feed,))
-            except Exception as ex:
-                handle_exception()
-                return
-        time.sleep(2)
+        else:
+            poller.submit(feed)
     if got:
         lastpoll.save()
 
@@ -1139,6 +1372,7 @@ def init():
 def shutdown():
     """shutdown the rss plugin."""
     taskmanager.unload("rss")
+    poller.http.close()
 
 
 # size function
@@ -1942,6 +2176,22 @@ def handle_rssrunning(bot, ievent):
 cmnds.add("rss-running", handle_rssrunning, ["RSS", "OPER"])
 examples.add("rss-running", "rss-running .. get running rsswatchers", "rss-running")
 
+# rss-pollstats command
+
+
+def handle_rsspollstats(bot, ievent):
+    """no arguments - show fetch latency and 304 hit rate of the last feed sweeps."""
+    ievent.reply(
+        "current sweep: %s - workers: %s - pending: %s"
+        % (poller.status(), len(poller.threads), len(poller.pending))
+    )
+    if poller.lastsweep:
+        ievent.reply("previous sweep: %s" % poller.status(poller.lastsweep))
+
+
+cmnds.add("rss-pollstats", handle_rsspollstats, ["RSS", "OPER"])
+examples.add("rss-pollstats", "show statistics of the rss feed poller", "rss-pollstats")
+
 # rss-list command
 
 
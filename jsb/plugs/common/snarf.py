@@ -15,6 +15,7 @@ __depend__ = [
 
 # jsb imports
 
+import http.client
 import re
 import socket
 import urllib.error
@@ -28,7 +29,7 @@ from jsb.lib.persist import Persist, PlugPersist
 from jsb.lib.persistconfig import PersistConfig
 from jsb.lib.plugins import plugs as plugins
 from jsb.utils.exception import handle_exception
-from jsb.utils.url import decode_html_entities, get_encoding, geturl, geturl2
+from jsb.utils.url import geturl, urlmeta
 
 # basic imports
 
@@ -77,32 +78,13 @@ class SnarfException(Exception):
 
 
 def geturl_title(url):
-    """fetch title of url"""
-    try:
-        result = geturl2(url)
-    except urllib.error.HTTPError as ex:
-        logging.warn("HTTPError: %s" % str(ex))
-        return False
-    except urllib.error.URLError as ex:
-        logging.warn("URLError %s" % str(ex))
-        return False
-    except IOError as ex:
-        try:
-            errno = ex[0]
-        except IndexError:
-            handle_exception()
-            return
-        return False
-    if not result:
-        return False
-    test_title = re_html_title.search(result)
-    if test_title:
-        # try to find an encoding and standardize it to utf-8
-        encoding = get_encoding(result)
-        title = test_title.group(1).decode(encoding, "replace").replace("\n", " ")
-        title = title.strip()
-        return decode_html_entities(title)
-    return False
+    """fetch title of url, the page is shared with other plugins through the url metadata cache."""
+    meta = urlmeta.lookup(url)
+    if meta.status >= 400:
+        raise SnarfException("HTTP error %s" % meta.status)
+    if meta.contenttype and meta.contenttype not in pcfg.get("allow"):
+        raise SnarfException("Content-Type %s is not allowed" % meta.contenttype)
+    return meta.title or False
 
 
 # geturl_validate function
@@ -140,14 +122,6 @@ def valid_url(url):
     if not re_url_match.match(url):
         return False
     parts = urllib.parse.urlparse(url)
-    # do a HEAD request to get the content-type
-    request = urllib.request.Request(url)
-    request.get_method = lambda: "HEAD"
-    content = urllib.request.urlopen(request)
-    if content.headers["content-type"]:
-        type = content.headers["content-type"].split(";", 1)[0].strip()
-        if type not in pcfg.get("allow"):
-            raise SnarfException("Content-Type %s is not allowed" % type)
     cleanurl = "%s://%s" % (parts[0], parts[1])
     if parts[2]:
         cleanurl = "%s%s" % (cleanurl, parts[2])
@@ -174,31 +148,21 @@ def handle_snarf(bot, ievent, direct=True):
     if not url:
         ievent.missing("<url>")
         return
-    try:
-        url = valid_url(url)
-    except KeyError:
-        ievent.reply("can't detect content type")
-        return
-    except SnarfException as e:
-        if direct:
-            ievent.reply("unable to snarf: %s" % str(e))
-        return
-    except urllib.error.HTTPError as e:
-        ievent.reply("unable to snarf: %s" % str(e))
-        return
-    except urllib.error.URLError as ex:
-        ievent.reply("unable to snarf: %s" % str(ex))
-        return
+    url = valid_url(url)
     if not url:
         ievent.reply("invalid url")
         return
     try:
         title = geturl_title(url)
+    except SnarfException as e:
+        if direct:
+            ievent.reply("unable to snarf: %s" % str(e))
+        return
     except socket.timeout:
         ievent.reply("%s socket timeout" % url)
         return
-    except urllib.error.HTTPError as e:
-        ievent.reply("error: %s" % e)
+    except (http.client.HTTPException, OSError) as e:
+        ievent.reply("unable to snarf: %s" % str(e))
         return
     if title:
         host = urllib.parse.urlparse(url)[1]
@@ -279,11 +243,7 @@ def handle_validate(bot, ievent):
     if not url:
         ievent.missing("<url>")
         return
-    try:
-        url = valid_url(url)
-    except urllib.error.HTTPError as e:
-        ievent.reply("error: %s" % e)
-        return
+    url = valid_url(url)
     if not url:
         ievent.reply("invalid or bad URL")
         return
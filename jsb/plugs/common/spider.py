@@ -13,9 +13,11 @@
 """
 
 import logging
+import threading
 import time
+from collections import deque
 
-__version__ = "0.2"
+__version__ = "0.3"
 __copyright__ = "CopyRight (C) 2008-2011 by James Mills"
 __license__ = "MIT"
 __author__ = "James Mills"
@@ -27,14 +29,13 @@ __coauthor__ = "adapted for JSONBOT by Bart Thate <bthate@gmail.com>"
 from jsb.imports import getBeautifulSoup
 from jsb.lib.callbacks import callbacks
 from jsb.lib.commands import cmnds
-from jsb.lib.datadir import getdatadir
 from jsb.lib.examples import examples
-from jsb.lib.persist import PersistCollection
-from jsb.lib.threadloop import ThreadLoop
+from jsb.lib.persist import PlugPersist
+from jsb.lib.persistconfig import PersistConfig
+from jsb.lib.threads import start_new_thread
 from jsb.utils.exception import handle_exception
-from jsb.utils.generic import waitforqueue
 from jsb.utils.name import stripname
-from jsb.utils.url import Url, geturl2, striphtml
+from jsb.utils.url import HTTPPool, Url, striphtml
 from jsb.utils.urldata import UrlData
 
 soup = getBeautifulSoup()
@@ -44,67 +45,229 @@ soup = getBeautifulSoup()
 
 # defines
 
+cfg = PersistConfig()
+cfg.define("workers", 4)
+cfg.define("delay", 2)
+cfg.define("batch", 20)
+cfg.define("maxerrors", 10)
+
 running = []
 
 # Spider class
 
 
-class Spider(ThreadLoop):
-    def __init__(self, url, skip=True):
+class Spider(object):
+
+    """
+    crawl a site with a pool of workers, requests to the same host are at
+    least delay seconds apart. crawl state is saved so a stopped crawl can
+    be resumed, pages seen on an earlier crawl are fetched conditionally.
+
+    """
+
+    def __init__(self, url, workers=4, delay=2, batch=20, maxerrors=10):
         self.url = Url(url)
-        self.errors = []
-        self.urls = []
-        self.followed = []
-        self.skip = skip
-        ThreadLoop.__init__(self)
+        self.workers = workers
+        self.delay = delay
+        self.batch = batch
+        self.maxerrors = maxerrors
+        self.state = PlugPersist("crawl-" + stripname(self.url.base))
+        self.state.data.frontier = self.state.data.frontier or []
+        self.state.data.visited = self.state.data.visited or []
+        self.state.data.errors = self.state.data.errors or []
+        self.state.data.validators = self.state.data.validators or {}
+        self.frontier = {}
+        self.togo = 0
+        self.alive = 0
+        self.visited = set(self.state.data.visited)
+        self.errors = set(self.state.data.errors)
+        self.queued = set()
+        self.hostnext = {}
+        self.pages = []
+        self.busy = 0
+        self.cond = threading.Condition()
+        self.http = HTTPPool(maxperhost=1)
+        self.stopped = False
+        self.event = None
         self.sTime = time.time()
-        self.eTime = 0
-        self.tTime = 0
+        self.stats = {"fetched": 0, "unchanged": 0, "saved": 0, "errors": 0}
 
-    def handle(self, event, url, depth, speed=5):
-        if depth < 0:
-            return
-        if not self.url.base in url:
-            logging.warn("skipping %s (%s)" % (url, self.url.base))
+    def start(self, event, url, depth):
+        """resume an unfinished crawl or start a new one on url."""
+        self.event = event
+        with self.cond:
+            if self.state.data.frontier:
+                for item, itemdepth in self.state.data.frontier:
+                    self.add(item, itemdepth)
+            else:
+                self.visited = set()
+                self.errors = set()
+                self.add(url, depth)
+        if self.state.data.frontier:
+            event.reply(
+                "resuming crawl of %s with %s urls to go" % (self.url.base, self.togo)
+            )
+        threads = []
+        self.alive = self.workers
+        for i in range(self.workers):
+            threads.append(start_new_thread(self._loop, ()))
+        return threads
+
+    def stop(self):
+        """stop the crawl, the frontier is saved for a resume."""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def add(self, url, depth):
+        """add an url to the frontier."""
+        if depth < 0 or self.url.base not in url:
             return
-        if url in self.errors:
-            logging.warn("skipping %s" % url)
+        if url in self.visited or url in self.errors or url in self.queued:
             return
-        urls = []
-        linknr = 0
-        follownr = 0
-        n = 0
-        try:
-            if url not in self.urls:
-                self.urls.append(url)
-                page = Url(url)
-                time.sleep(10 - speed)
-                content = page.fetch()
-                event.reply(
-                    "fetched %s - %s - %s" % (url, len(content), content.status)
+        self.queued.add(url)
+        self.frontier.setdefault(Url(url).root, deque()).append((url, depth))
+        self.togo += 1
+        self.cond.notify_all()
+
+    def take(self):
+        """return the next (url, depth) whose host may be fetched, None when done."""
+        with self.cond:
+            while not self.stopped:
+                now = time.time()
+                wait = None
+                for host, urls in list(self.frontier.items()):
+                    ready = self.hostnext.get(host, 0)
+                    if ready <= now:
+                        url, depth = urls.popleft()
+                        if not urls:
+                            del self.frontier[host]
+                        self.queued.discard(url)
+                        self.togo -= 1
+                        self.hostnext[host] = now + self.delay
+                        self.busy += 1
+                        return (url, depth)
+                    if wait is None or ready - now < wait:
+                        wait = ready - now
+                if not self.frontier and not self.busy:
+                    return None
+                self.cond.wait(wait)
+
+    def fetch(self, url):
+        """fetch url, using stored validators for a conditional request."""
+        headers = {}
+        validators = self.state.data.validators.get(url) or {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified"):
+            headers["If-Modified-Since"] = validators["modified"]
+        return self.http.fetch(url, headers)
+
+    def handle(self, url, depth):
+        """fetch a page, store its text and add its links to the frontier."""
+        response = self.fetch(url)
+        validators = self.state.data.validators.get(url) or {}
+        if response.status_code == 304:
+            self.stats["unchanged"] += 1
+            return validators.get("links", [])
+        if response.status_code != 200:
+            raise Exception("status %s" % response.status_code)
+        charset = response.headers.get_content_charset() or "utf-8"
+        page = Url(response.url)
+        page.html = response.content.decode(charset, "replace")
+        links = page.geturls()
+        self.stats["fetched"] += 1
+        with self.cond:
+            self.pages.append((url, striphtml(page.html)))
+            self.state.data.validators[url] = {
+                "etag": response.headers.get("etag"),
+                "modified": response.headers.get("last-modified"),
+                "links": links,
+            }
+        return links
+
+    def flush(self):
+        """save the batch of fetched pages and the crawl state."""
+        with self.cond:
+            pages, self.pages = self.pages, []
+            self.state.data.frontier = [
+                item for urls in self.frontier.values() for item in urls
+            ]
+            self.state.data.visited = list(self.visited)
+            self.state.data.errors = list(self.errors)
+        for url, txt in pages:
+            try:
+                urldata = UrlData(url)
+                if txt and urldata.data.txt != txt:
+                    urldata.data.txt = txt
+                    urldata.save()
+                    self.stats["saved"] += 1
+            except Exception as ex:
+                handle_exception()
+        self.state.save()
+        if pages and self.event:
+            self.event.reply("%s - %s" % (self.url.base, self.status()))
+
+    def _loop(self):
+        while 1:
+            item = self.take()
+            if not item:
+                break
+            url, depth = item
+            links = []
+            try:
+                links = self.handle(url, depth)
+            except Exception as ex:
+                logging.warn("ERROR: Can't process url '%s' (%s)" % (url, ex))
+                with self.cond:
+                    self.errors.add(url)
+                    self.stats["errors"] += 1
+                    if len(self.errors) > self.maxerrors:
+                        self.stopped = True
+            with self.cond:
+                self.visited.add(url)
+                self.busy -= 1
+                for link in links:
+                    self.add(link, depth - 1)
+                full = len(self.pages) >= self.batch
+                self.cond.notify_all()
+            if full:
+                self.flush()
+        with self.cond:
+            self.alive -= 1
+            if self.alive:
+                return
+        if self in running:
+            running.remove(self)
+        self.flush()
+        self.http.close()
+        if self.event:
+            self.event.reply(
+                "crawl of %s %s after %.1f seconds - %s"
+                % (
+                    self.url.base,
+                    self.stopped and "stopped" or "finished",
+                    time.time() - self.sTime,
+                    self.status(),
                 )
-                try:
-                    urldata = UrlData(url, striphtml(content))
-                    if urldata.data.txt:
-                        urldata.save()
-                except Exception as ex:
-                    handle_exception()
-                for p in page.geturls():
-                    if not p in self.errors:
-                        self.put(6, event, p, depth - 1, speed - 1)
-            if not self.queue.qsize():
-                self.stop()
-        except Exception as e:
-            logging.warn("ERROR: Can't process url '%s' (%s)" % (url, e))
-            self.errors.append(url)
-            handle_exception()
-            if len(self.errors) > 10:
-                self.stop()
+            )
+
+    def status(self):
+        """return crawl statistics."""
+        return "%s fetched, %s unchanged, %s saved, %s errors, %s to go" % (
+            self.stats["fetched"],
+            self.stats["unchanged"],
+            self.stats["saved"],
+            self.stats["errors"],
+            self.togo,
+        )
 
 
 def handle_spider(bot, event):
+    """arguments: <url> [<depth>] - crawl a site, an unfinished crawl of the same site is resumed."""
     if not event.args:
         event.missing("<url> [<depth>]")
+        return
     url = event.args[0]
     try:
         depth = int(event.args[1])
@@ -113,14 +276,23 @@ def handle_spider(bot, event):
         return
     except IndexError:
         depth = 3
-    spider = Spider(url)
-    if not spider in running:
-        running.append(spider)
-    thr = spider.start()
+    spider = Spider(
+        url,
+        cfg.get("workers"),
+        cfg.get("delay"),
+        cfg.get("batch"),
+        cfg.get("maxerrors"),
+    )
+    for other in running:
+        if other.url.base == spider.url.base:
+            event.reply("%s is already being crawled" % spider.url.base)
+            return
+    running.append(spider)
     event.reply("calling fetcher on %s" % time.ctime(spider.sTime))
-    spider.put(5, event, url, depth, 9)
+    threads = spider.start(event, url, depth)
     if bot.isgae:
-        thr.join()
+        for thr in threads:
+            thr.join()
 
 
 cmnds.add("spider", handle_spider, "OPER", threaded="backend")
@@ -138,3 +310,19 @@ def handle_spiderstop(bot, event):
 
 cmnds.add("spider-stop", handle_spiderstop, "OPER")
 examples.add("spider-stop", "stop running spiders", "spider-stop")
+
+
+def handle_spiderstatus(bot, event):
+    """no arguments - show the progress of running crawls."""
+    if not running:
+        event.reply("no spiders running")
+        return
+    event.reply(
+        "running spiders: ",
+        ["%s: %s" % (spider.url.base, spider.status()) for spider in running],
+        dot=" - ",
+    )
+
+
+cmnds.add("spider-status", handle_spiderstatus, "OPER")
+examples.add("spider-status", "show progress of running spiders", "spider-status")
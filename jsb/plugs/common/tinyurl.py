@@ -21,15 +21,7 @@ from jsb.lib.commands import cmnds
 from jsb.lib.examples import examples
 from jsb.lib.persistconfig import PersistConfig
 from jsb.utils.exception import handle_exception
-from jsb.utils.url import striphtml, useragent
-
-# google imports
-
-try:
-    import waveapi
-    from google.appengine.api.memcache import get, set
-except ImportError:
-    from jsb.lib.cache import get, set
+from jsb.utils.url import striphtml, urlmeta, useragent
 
 # plug config
 
@@ -90,12 +82,8 @@ def privmsgcb(bot, ievent):
 # callbacks.add('PRIVMSG', privmsgcb, precb)
 
 
-def get_tinyurl(url):
-    """grab a tinyurl."""
-    res = get(url, namespace="tinyurl")
-    logging.debug("tinyurl - cache - %s" % str(res))
-    if res and res[0] == "[":
-        return json.loads(res)
+def maketinyurl(url):
+    """ask tinyurl.com for the tinyurls of url."""
     postarray = [
         ("submit", "submit"),
         ("url", url),
@@ -104,16 +92,16 @@ def get_tinyurl(url):
     req = urllib.request.Request(url=plugcfg.url, data=postdata.encode())
     req.add_header("User-agent", useragent())
     try:
-        res = urllib.request.urlopen(req).readlines()
-    except urllib.error.URLError as e:
-        logging.warn("tinyurl - %s - URLError: %s" % (url, str(e)))
-        return
+        res = urllib.request.urlopen(req, timeout=10).readlines()
     except urllib.error.HTTPError as e:
         logging.warn("tinyurl - %s - HTTP error: %s" % (url, str(e)))
         return
+    except urllib.error.URLError as e:
+        logging.warn("tinyurl - %s - URLError: %s" % (url, str(e)))
+        return
     except Exception as ex:
         if "DownloadError" in str(ex):
-            logging.warn("tinyurl - %s - DownloadError: %s" % (url, str(e)))
+            logging.warn("tinyurl - %s - DownloadError: %s" % (url, str(ex)))
         else:
             handle_exception()
         return
@@ -124,8 +112,15 @@ def get_tinyurl(url):
             urls.append(striphtml(line.strip()).split("[Open")[0])
     if len(urls) == 3:
         urls.pop(0)
-    set(url, json.dumps(urls), namespace="tinyurl")
-    return urls
+    return urls or None
+
+
+urlmeta.shortener = maketinyurl
+
+
+def get_tinyurl(url):
+    """grab a tinyurl, shared with other plugins through the url metadata cache."""
+    return urlmeta.shorten(url)
 
 
 # tinyurl command
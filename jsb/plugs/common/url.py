@@ -7,11 +7,17 @@
 # jsb imports
 
 import logging
+import os
 import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
 
 from jsb.lib.callbacks import callbacks
 from jsb.lib.commands import cmnds
 from jsb.lib.examples import examples
+from jsb.lib.persistconfig import PersistConfig
 from jsb.lib.persiststate import PlugState
 from jsb.utils.exception import handle_exception
 
@@ -21,33 +27,219 @@ from jsb.utils.exception import handle_exception
 # defines
 
 re_url_match = re.compile("((?:http|https)://\S+)")
+re_token = re.compile("[a-z0-9]+")
 state = None
+urllog = None
 initdone = False
 
+cfg = PersistConfig()
+cfg.define("maxperchannel", 5000)
+
+# UrlLog class
+
+
+def gethost(url):
+    """return the host part of an url."""
+    return url.split("://", 1)[-1].split("/", 1)[0].split("@")[-1].split(":")[0].lower()
+
+
+class UrlLog(object):
+
+    """
+    append only log of urls with an in memory index. every url is stored
+    once per channel, channels keep their last maxperchannel urls.
+
+    """
+
+    def __init__(self, fn, maxperchannel=5000):
+        self.fn = fn
+        self.maxperchannel = maxperchannel
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.seq = 0
+        self.entries = {}
+        self.channels = {}
+        self.seen = {}
+        self.tokens = {}
+        self.sortedtokens = []
+        self.hosts = {}
+        self.dead = 0
+
+    def load(self):
+        """read the log and build the index."""
+        with self.lock:
+            self.reset()
+            try:
+                logfile = open(self.fn, "r", errors="replace")
+            except IOError:
+                return 0
+            with logfile:
+                for line in logfile:
+                    try:
+                        added, botname, channel, url = line.rstrip("\n").split("\t")
+                        self.index(float(added), botname, channel, url)
+                    except ValueError:
+                        continue
+            if self.dead > len(self.entries):
+                self.compact()
+            return len(self.entries)
+
+    def index(self, added, botname, channel, url):
+        """add an url to the index, returns False if the channel already has it."""
+        key = (botname, channel)
+        seen = self.seen.setdefault(key, {})
+        if url in seen:
+            return False
+        self.seq += 1
+        seq = self.seq
+        self.entries[seq] = (added, botname, channel, url)
+        seen[url] = seq
+        self.channels.setdefault(key, deque()).append(seq)
+        for token in frozenset(re_token.findall(url.lower())):
+            if token not in self.tokens:
+                self.tokens[token] = []
+                insort(self.sortedtokens, token)
+            self.tokens[token].append(seq)
+        self.hosts.setdefault(gethost(url), []).append(seq)
+        channel = self.channels[key]
+        while len(channel) > self.maxperchannel:
+            old = channel.popleft()
+            del seen[self.entries.pop(old)[3]]
+            self.dead += 1
+        return True
+
+    def add(self, botname, channel, url):
+        """add an url, it is appended to the log when it is new for the channel."""
+        with self.lock:
+            added = time.time()
+            if not self.index(added, botname, channel, url):
+                return False
+            path = os.path.dirname(self.fn)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            with open(self.fn, "a") as logfile:
+                logfile.write("%s\t%s\t%s\t%s\n" % (added, botname, channel, url))
+            if self.dead > max(len(self.entries), 1000):
+                self.compact()
+            return True
+
+    def compact(self):
+        """rewrite the log with only the urls that are kept and rebuild the index."""
+        with self.lock:
+            entries = [self.entries[seq] for seq in sorted(self.entries)]
+            tmp = self.fn + ".tmp"
+            with open(tmp, "w") as logfile:
+                for entry in entries:
+                    logfile.write("%s\t%s\t%s\t%s\n" % entry)
+            os.replace(tmp, self.fn)
+            self.reset()
+            for entry in entries:
+                self.index(*entry)
+            logging.warn("compacted %s to %s urls" % (self.fn, len(entries)))
+
+    def postings(self, term):
+        """return the sequence numbers of urls with a word starting with term."""
+        if term.startswith("host:"):
+            host = term[5:].lower()
+            result = []
+            for name, seqs in self.hosts.items():
+                if name == host or name.endswith("." + host):
+                    result.extend(seqs)
+            return result
+        words = re_token.findall(term.lower())
+        if not words:
+            return None
+        result = None
+        for word in words:
+            found = []
+            i = bisect_left(self.sortedtokens, word)
+            while i < len(self.sortedtokens) and self.sortedtokens[i].startswith(word):
+                found.extend(self.tokens[self.sortedtokens[i]])
+                i += 1
+            found = frozenset(found)
+            result = found if result is None else result & found
+        return result
+
+    def search(self, what, botname=None, channel=None):
+        """return urls matching all words of what, optionally of one channel."""
+        with self.lock:
+            terms = what.split()
+            result = None
+            for term in terms:
+                found = self.postings(term)
+                if found is None:
+                    continue
+                found = frozenset(found)
+                result = found if result is None else result & found
+            if result is None:
+                result = self.entries.keys()
+            urls = []
+            for seq in sorted(result):
+                entry = self.entries.get(seq)
+                if not entry:
+                    continue
+                if botname and (entry[1], entry[2]) != (botname, channel):
+                    continue
+                url = entry[3]
+                for term in terms:
+                    if not term.startswith("host:") and term.lower() not in url.lower():
+                        break
+                else:
+                    urls.append(url)
+            return urls
+
+    def tail(self, botname, channel, nr=5):
+        """return the last nr urls of a channel."""
+        with self.lock:
+            seqs = self.channels.get((botname, channel), ())
+            return [self.entries[seq][3] for seq in list(seqs)[-nr:]]
+
+    def size(self):
+        return len(self.entries)
+
+
 # init function
 
 
 def init():
     global state
+    global urllog
     global initdone
     state = PlugState()
     state.define("urls", {})
+    urllog = UrlLog(
+        os.path.dirname(state.fn) + os.sep + "urls.log", cfg.get("maxperchannel")
+    )
+    urllog.load()
+    if state["urls"]:
+        migrate()
     initdone = True
     return 1
 
 
+def migrate():
+    """move the urls of the old state file into the url log."""
+    nr = 0
+    for botname, channels in state["urls"].items():
+        for channel, urls in channels.items():
+            for url in urls:
+                if urllog.add(botname, channel, url):
+                    nr += 1
+    state["urls"] = {}
+    state.save()
+    logging.warn("migrated %s urls to %s" % (nr, urllog.fn))
+
+
 # size function
 
 
 def size():
     """show number of urls."""
-    s = 0
     if not initdone:
-        return s
-    for i in list(state["urls"].values()):
-        for j in list(i.values()):
-            s += len(j)
-    return s
+        return 0
+    return urllog.size()
 
 
 # search function
@@ -56,18 +248,9 @@ def size():
 def search(what, queue):
     """search the url database."""
     global initdone
-    result = []
     if not initdone:
-        return result
-    try:
-        for i in list(state["urls"].values()):
-            for urls in list(i.values()):
-                for url in urls:
-                    if what in url:
-                        result.append(url)
-    except KeyError:
-        pass
-    for url in result:
+        return []
+    for url in urllog.search(what):
         queue.put_nowait(url)
 
 
@@ -75,9 +258,12 @@ def search(what, queue):
 
 
 def latest(bot, event):
-    if not state:
+    if not urllog:
+        return ""
+    try:
+        return urllog.tail(bot.cfg.name, event.channel, 1)[0]
+    except IndexError:
         return ""
-    return state.data.urls[bot.cfg.name][event.channel][-1]
 
 
 # url callbacks
@@ -88,19 +274,13 @@ def urlpre(bot, ievent):
 
 
 def urlcb(bot, ievent):
-    if not state:
+    if not urllog:
         return
     try:
         test_urls = re_url_match.findall(ievent.txt)
         for i in test_urls:
-            if bot.cfg.name not in state["urls"]:
-                state["urls"][bot.cfg.name] = {}
-            if ievent.channel not in state["urls"][bot.cfg.name]:
-                state["urls"][bot.cfg.name][ievent.channel] = []
-            if not i in state["urls"][bot.cfg.name][ievent.channel]:
-                state["urls"][bot.cfg.name][ievent.channel].append(i)
-        state.save()
-        logging.warn("added url from %s" % ievent.auth)
+            if urllog.add(bot.cfg.name, ievent.channel, i):
+                logging.warn("added url from %s" % ievent.auth)
     except Exception as ex:
         handle_exception()
 
@@ -114,24 +294,14 @@ callbacks.add("TORNADO", urlcb, urlpre, threaded=True)
 
 
 def handle_urlsearch(bot, ievent):
-    """arguments: <searchtxt> - search the per channel url database for a search term."""
-    if not state:
-        ievent.reply("rss state not initialized")
+    """arguments: <searchtxt> - search the per channel url database for a search term, use host:<domain> to search on host."""
+    if not urllog:
+        ievent.reply("url log not initialized")
         return
     if not ievent.rest:
         ievent.missing("<searchtxt>")
         return
-    result = []
-    try:
-        for i in state["urls"][bot.cfg.name][ievent.channel]:
-            if ievent.rest in i:
-                result.append(i)
-    except KeyError:
-        ievent.reply("no urls known for channel %s" % ievent.channel)
-        return
-    except Exception as ex:
-        ievent.reply(str(ex))
-        return
+    result = urllog.search(ievent.rest, bot.cfg.name, ievent.channel)
     if result:
         ievent.reply("results matching %s: " % ievent.rest, result)
     else:
@@ -140,29 +310,24 @@ def handle_urlsearch(bot, ievent):
 
 
 cmnds.add("url-search", handle_urlsearch, ["OPER", "USER", "GUEST"])
-examples.add("url-search", "search matching url entries", "url-search jsonbot")
+examples.add(
+    "url-search",
+    "search matching url entries",
+    "1) url-search jsonbot 2) url-search host:github.com jsonbot",
+)
 
 # url-searchall command
 
 
 def handle_urlsearchall(bot, ievent):
     """arguments: <searchtxt> - search all urls."""
-    if not state:
-        ievent.reply("rss state not initialized")
+    if not urllog:
+        ievent.reply("url log not initialized")
         return
     if not ievent.rest:
         ievent.missing("<searchtxt>")
         return
-    result = []
-    try:
-        for i in list(state["urls"].values()):
-            for urls in list(i.values()):
-                for url in urls:
-                    if ievent.rest in url:
-                        result.append(url)
-    except Exception as ex:
-        ievent.reply(str(ex))
-        return
+    result = urllog.search(ievent.rest)
     if result:
         ievent.reply("results matching %s: " % ievent.rest, result)
     else:
@@ -194,14 +359,11 @@ def handle_urltail(bot, ievent):
             lines = int(ievent.rest)
         except:
             lines = 5
-    try:
-        ievent.reply(
-            "last %s urls: " % lines,
-            state["urls"][bot.cfg.name][ievent.channel][-lines:],
-        )
-    except KeyError:
+    result = urllog and urllog.tail(bot.cfg.name, ievent.channel, lines)
+    if not result:
         ievent.reply("no urls known for channel %s" % ievent.channel)
         return
+    ievent.reply("last %s urls: " % lines, result)
 
 
 cmnds.add("url-tail", handle_urltail, ["OPER", "USER", "GUEST"])
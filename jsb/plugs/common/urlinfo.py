@@ -22,6 +22,7 @@ __license__ = "BSD"
 
 import logging
 import re
+import threading
 import urllib.parse
 import xmlrpc.client
 
@@ -31,6 +32,7 @@ from jsb.lib.examples import examples
 from jsb.lib.persist import PlugPersist
 from jsb.plugs.common.tinyurl import get_tinyurl
 from jsb.utils.exception import handle_exception
+from jsb.utils.url import urlmeta
 
 # basic import
 
@@ -38,6 +40,8 @@ from jsb.utils.exception import handle_exception
 # defines
 
 cfg = PlugPersist("urlinfo", {})
+xmlrpcurl = "http://whatisthisfile.appspot.com/xmlrpc"
+proxies = threading.local()
 
 # sanitize function
 
@@ -92,6 +96,19 @@ def getUrls(text):
     return urls
 
 
+# whatis function
+
+
+def whatis(url):
+    """ask whatisthisfile about url, the XMLRPC proxy is reused per thread."""
+    try:
+        server = proxies.server
+    except AttributeError:
+        server = proxies.server = xmlrpc.client.ServerProxy(xmlrpcurl)
+    logging.info("urlinfo - XMLRPC query: %s" % url)
+    return server.app.query(url)
+
+
 # getUrlInfo function
 
 
@@ -105,19 +122,18 @@ def getUrlInfo(text):
         for i in urls:
             o = ""
             try:
-                server = xmlrpc.client.ServerProxy(
-                    "http://whatisthisfile.appspot.com/xmlrpc"
-                )
-                logging.info("urlinfo - XMLRPC query: %s" % i)
-                urlinfo = server.app.query(i)
-                if "html" in urlinfo:
-                    if "title" in urlinfo["html"]:
-                        o += 'Title: "%s" ' % urlinfo["html"]["title"].strip()
-                elif "image" in urlinfo:
-                    o += "Image: %dx%d " % (
-                        urlinfo["image"]["width"],
-                        urlinfo["image"]["height"],
-                    )
+                meta = urlmeta.lookup(i)
+                if meta.title:
+                    o += 'Title: "%s" ' % meta.title
+                elif meta.contenttype.startswith("image/"):
+                    urlinfo = urlmeta.cached("whatis", i, whatis)
+                    if "image" in urlinfo:
+                        o += "Image: %dx%d " % (
+                            urlinfo["image"]["width"],
+                            urlinfo["image"]["height"],
+                        )
+                if meta.final != i:
+                    o += "Redirect: %s " % meta.final
                 if not o:
                     continue
                 if len(o):
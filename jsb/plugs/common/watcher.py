@@ -12,13 +12,10 @@ import logging
 from jsb.lib.callbacks import (callbacks, first_callbacks, last_callbacks,
                                remote_callbacks)
 from jsb.lib.commands import cmnds
-from jsb.lib.eventbase import EventBase
 from jsb.lib.examples import examples
-from jsb.lib.fleet import getfleet
+from jsb.lib.fanout import Message, fanout
 from jsb.lib.persist import PlugPersist
-from jsb.utils.exception import handle_exception
 from jsb.utils.format import formatevent
-from jsb.utils.generic import stripcolor
 from jsb.utils.locking import locked
 
 # plugin imports
@@ -44,6 +41,11 @@ class Watched(PlugPersist):
         self.data.whitelist = self.data.whitelist or []
         self.data.descriptions = self.data.descriptions or {}
 
+    def save(self):
+        """save the subscriptions and rebuild the routing table on next use."""
+        PlugPersist.save(self)
+        fanout.invalidate("watcher")
+
     def subscribe(self, botname, type, channel, jid):
         """subscrive a jid to a channel."""
         channel = channel.lower()
@@ -118,29 +120,20 @@ class Watched(PlugPersist):
 
 watched = Watched("channels")
 
-# functions
+# routing table of the watcher
 
-bots = {}
 
+def watchroutes():
+    """build the watcher routing table from the subscriptions."""
+    table = {}
+    for channel, subscribers in watched.data.channels.items():
+        routes = [tuple(item) for item in subscribers if len(item) == 3]
+        if routes:
+            table[channel] = routes
+    return table
 
-def writeout(botname, type, channel, txt, eventjson):
-    """output the watched event to the channel."""
-    event = EventBase().load(eventjson)
-    global bots
-    watchbot = None
-    if botname in bots:
-        watchbot = bots[botname]
-    if not watchbot:
-        watchbot = getfleet().byname(botname)
-    if not watchbot:
-        watchbot = getfleet().makebot(type, botname)
-    if watchbot:
-        if not botname in bots:
-            bots[botname] = watchbot
-        txt = watchbot.normalize(txt)
-        txt = stripcolor(txt)
-        watchbot.outnocb(channel, txt, event=event)
 
+fanout.register("watcher", watchroutes)
 
 # callbacks
 
@@ -164,34 +157,32 @@ def prewatchcallback(bot, event):
 def watchcallback(bot, event):
     """the watcher callback, see if channels are followed and if so send data."""
     # if not event.allowwatch: logging.warn("watch - allowwatch is not set - ignoring %s" % event.userhost) ; return
-    subscribers = watched.subscribers(event.channel)
-    watched.data.descriptions[event.channel.lower()] = event.title
+    origin = event.channel.lower()
+    subscribers = fanout.targets("watcher", origin)
+    watched.data.descriptions[origin] = event.title
     logging.info("watcher - %s - %s" % (event.channel, str(subscribers)))
-    for item in subscribers:
-        try:
-            try:
-                (botname, type, channel) = item
-            except ValueError:
-                continue
-            if not event.allowatch:
-                pass
-            elif channel not in event.allowwatch:
+    if event.allowwatch:
+        allowed = []
+        for item in subscribers:
+            if item[2] not in event.allowwatch:
                 logging.warn(
-                    "watcher - allowwatch denied %s - %s" % (channel, event.allowwatch)
+                    "watcher - allowwatch denied %s - %s" % (item[2], event.allowwatch)
                 )
                 continue
-            m = formatevent(bot, event, subscribers, True)
-            if event.cbtype in ["OUTPUT", "JOIN", "PART", "QUIT", "NICK"]:
-                txt = "[!] %s" % m.txt
-            else:
-                txt = "[%s] %s" % (m.nick or event.nick or event.auth, m.txt)
-            if txt.count("] [") > 2:
-                logging.debug("watcher - %s - skipping %s" % (type, txt))
-                continue
-            logging.warn("watcher - forwarding to %s" % channel)
-            writeout(botname, type, channel, txt, event.tojson())
-        except Exception as ex:
-            handle_exception()
+            allowed.append(item)
+        subscribers = allowed
+    if not subscribers:
+        return
+    m = formatevent(bot, event, subscribers, True)
+    if event.cbtype in ["OUTPUT", "JOIN", "PART", "QUIT", "NICK"]:
+        txt = "[!] %s" % m.txt
+    else:
+        txt = "[%s] %s" % (m.nick or event.nick or event.auth, m.txt)
+    if txt.count("] [") > 2:
+        logging.debug("watcher - skipping %s" % txt)
+        return
+    logging.warn("watcher - forwarding to %s" % str(subscribers))
+    fanout.deliver(Message("watcher", origin, txt, cpy(event)), subscribers)
 
 
 first_callbacks.add("BLIP_SUBMITTED", watchcallback, prewatchcallback)
@@ -59,6 +59,23 @@ def handle_adminboot(bot, ievent):
 cmnds.add("admin-boot", handle_adminboot, "OPER")
 examples.add("admin-boot", "initialize the bot", "admin-boot")
 
+# admin-boottimes command
+
+
+def handle_adminboottimes(bot, ievent):
+    """no arguments - show where time went during the last boot."""
+    from jsb.lib.boot import bootreport
+
+    ievent.reply("boot times: ", bootreport())
+
+
+cmnds.add("admin-boottimes", handle_adminboottimes, "OPER")
+examples.add(
+    "admin-boottimes",
+    "show time spent in the boot phases and the slowest plugin imports",
+    "admin-boottimes",
+)
+
 # admin-bootthreaded command
 
 
@@ -375,6 +392,31 @@ examples.add(
     "admin-mc", "bots interdace to memcached", "1) admin-mc stats 2) admin-mc flushall"
 )
 
+# admin-cache command
+
+
+def handle_admincache(bot, event):
+    """arguments: [stats|namespaces|expire] - show statistics of the bot's memory cache."""
+    from jsb.lib.cache import cache
+
+    if not event.rest or event.rest == "stats":
+        event.reply("cache stats: ", cache.status())
+    elif event.rest == "namespaces":
+        event.reply("cache namespaces: ", cache.namespaces())
+    elif event.rest == "expire":
+        cache.expire()
+        event.done()
+    else:
+        event.reply("choose one of stats, namespaces, expire")
+
+
+cmnds.add("admin-cache", handle_admincache, "OPER")
+examples.add(
+    "admin-cache",
+    "show statistics of the bot's memory cache",
+    "1) admin-cache 2) admin-cache namespaces 3) admin-cache expire",
+)
+
 # admin-floodcontrol command
 
 
@@ -564,6 +564,116 @@ def handle_running(bot, event):
 cmnds.add("running", handle_running, ["USER", "GUEST"])
 examples.add("running", "show running tasks", "running")
 
+# runners command
+
+
+def handle_runners(bot, event):
+    """arguments: [<pool>] - show queue depth and per plugin wait/run times of the runner pools."""
+    from jsb.lib.runner import apirunner, callbackrunner, waitrunner
+
+    pools = [cmndrunner, callbackrunner, longrunner, waitrunner, apirunner]
+    if event.rest:
+        pools = [p for p in pools if p.name == event.rest]
+        if not pools:
+            event.reply("no %s pool" % event.rest)
+            return
+    for runners in pools:
+        if not runners.pool:
+            event.reply("%s: not in pool mode - %s" % (runners.name, runners.size()))
+            continue
+        event.reply(
+            "%s: queue %s - workers %s (%s idle) - "
+            % (
+                runners.name,
+                runners.queue.qsize(),
+                len(runners.runners),
+                runners.idlers,
+            ),
+            runners.report() or ["no jobs yet"],
+        )
+
+
+cmnds.add("runners", handle_runners, ["OPER"])
+examples.add("runners", "show runner pool statistics", "1) runners 2) runners default")
+
+# callbacks command
+
+
+def handle_callbacks(bot, event):
+    """arguments: [<plugname>] - show how often callbacks fired and the time spent dispatching them."""
+    from jsb.lib.callbacks import (
+        api_callbacks,
+        callbacks,
+        first_callbacks,
+        last_callbacks,
+        remote_callbacks,
+    )
+
+    result = []
+    for name, cbs in [
+        ("first", first_callbacks),
+        ("callbacks", callbacks),
+        ("last", last_callbacks),
+        ("remote", remote_callbacks),
+        ("api", api_callbacks),
+    ]:
+        for line in cbs.report():
+            if not event.rest or line.startswith(event.rest + "."):
+                result.append("%s - %s" % (name, line))
+    event.reply("callback statistics: ", result or ["no callbacks fired yet"])
+
+
+cmnds.add("callbacks", handle_callbacks, ["OPER"])
+examples.add("callbacks", "show callback statistics", "1) callbacks 2) callbacks seen")
+
+# periodical command
+
+
+def handle_periodical(bot, event):
+    """arguments: [<plugname>] - show lateness, run time and failures of periodical jobs."""
+    from jsb.lib.periodical import periodical
+
+    result = [
+        line
+        for line in periodical.status()
+        if not event.rest or event.rest in line.split(" - ")[0]
+    ]
+    event.reply("periodical jobs: ", result or ["no jobs scheduled"])
+
+
+cmnds.add("periodical", handle_periodical, ["OPER"])
+examples.add(
+    "periodical", "show periodical job statistics", "1) periodical 2) periodical rss"
+)
+
+# binds command
+
+
+def handle_binds(bot, event):
+    """no arguments - show time spent binding events to their channel and user, per event type."""
+    from jsb.lib.channelbase import channels
+    from jsb.lib.eventbase import bindreport
+
+    event.reply("channel registry: ", channels.status())
+    event.reply("bind statistics: ", bindreport() or ["no binds yet"])
+
+
+cmnds.add("binds", handle_binds, ["OPER"])
+examples.add("binds", "show bind statistics", "binds")
+
+# fanout command
+
+
+def handle_fanout(bot, event):
+    """no arguments - show relay, forward and watcher fan out statistics."""
+    from jsb.lib.fanout import fanout
+
+    event.reply("fan out statistics: ", fanout.report() or ["nothing fanned out yet"])
+
+
+cmnds.add("fanout", handle_fanout, ["OPER"])
+examples.add("fanout", "show fan out statistics", "fanout")
+
 # descriptions command
 
 
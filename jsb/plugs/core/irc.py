@@ -172,6 +172,22 @@ def handle_say(bot, ievent):
 cmnds.add("say", handle_say, ["SAY", "OPER"], speed=1)
 examples.add("say", "send txt to channel/user", "say #test good morning")
 
+# outputstats command
+
+
+def handle_outputstats(bot, ievent):
+    """no arguments - show queue depth and time in queue of the output scheduler."""
+    if bot.type != "irc":
+        ievent.reply("outputstats only works on irc bots")
+        return
+    ievent.reply("output of %s: " % bot.cfg.name, bot.scheduler.status())
+
+
+cmnds.add("outputstats", handle_outputstats, "OPER")
+examples.add(
+    "outputstats", "show statistics of the irc output scheduler", "outputstats"
+)
+
 # server command
 
 
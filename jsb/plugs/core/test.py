@@ -366,3 +366,253 @@ cmnds.add(
         "OPER",
     ],
 )
+
+# test-waitqueue command
+
+
+def pollwait(queue, timeout=10000):
+    """the old polling wait, used as reference in test-waitqueue."""
+    counter = 0
+    while not len(queue) and counter <= timeout:
+        time.sleep(0.001)
+        counter += 10
+    return queue
+
+
+def benchwait(makequeue, waitfunc, nr=20, delay=0.01):
+    """let a thread append to a queue after delay seconds, return (latency, cputime) in ms."""
+    latency = cputime = 0.0
+    for i in range(nr):
+        queue = makequeue()
+        stamp = []
+
+        def producer():
+            time.sleep(delay)
+            stamp.append(time.time())
+            queue.append(i)
+
+        thread = start_new_thread(producer, ())
+        cpu = time.thread_time()
+        waitfunc(queue)
+        cputime += time.thread_time() - cpu
+        latency += time.time() - stamp[0]
+        thread.join()
+    return (1000 * latency / nr, 1000 * cputime / nr)
+
+
+def handle_testwaitqueue(bot, event):
+    """arguments: [<nr>] - compare wake-up latency and cpu time of polling and WaitQueue."""
+    from collections import deque
+
+    from jsb.utils.waitqueue import WaitQueue
+
+    try:
+        nr = int(event.args[0])
+    except (IndexError, ValueError):
+        nr = 20
+    poll = benchwait(deque, pollwait, nr)
+    notify = benchwait(WaitQueue, waitforqueue, nr)
+    event.reply(
+        "%s waits - polling: %.3f ms latency %.3f ms cpu - waitqueue: %.3f ms latency %.3f ms cpu"
+        % (nr, poll[0], poll[1], notify[0], notify[1])
+    )
+
+
+cmnds.add("test-waitqueue", handle_testwaitqueue, "TEST", threaded=True)
+examples.add(
+    "test-waitqueue",
+    "benchmark waiting on a polled deque versus a WaitQueue",
+    "1) test-waitqueue 2) test-waitqueue 100",
+)
+
+# test-events command
+
+sampletraffic = [
+    "PING :irc.example.net",
+    ":dunker!dunk@jsonbot.org PRIVMSG #jsonbot :anyone tried the new release?",
+    ":bart!bart@example.com JOIN :#jsonbot",
+    ":irc.example.net 353 jsb = #jsonbot :@dunker bart jsb",
+    ":bart!bart@example.com PRIVMSG #jsonbot :;version",
+    ":dunker!dunk@jsonbot.org NOTICE jsb :hi there",
+    ":bart!bart@example.com MODE #jsonbot +o dunker",
+    ":dunker!dunk@jsonbot.org PRIVMSG #jsonbot :works fine here",
+    ":bart!bart@example.com PART #jsonbot :later",
+    ":guest!~guest@10.0.0.1 QUIT :Ping timeout: 240 seconds",
+]
+
+
+def replayevents(bot, eventclass, lines, nr):
+    """parse and copy lines like the bot does, return (events per second, bytes per event)."""
+    import tracemalloc
+
+    starttime = time.time()
+    for i in range(nr):
+        event = eventclass()
+        event.parse(bot, lines[i % len(lines)])
+        cpy(event).ready()
+    persec = nr / (time.time() - starttime)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    events = []
+    for i in range(min(nr, 1000)):
+        event = eventclass()
+        event.parse(bot, lines[i % len(lines)])
+        events.append(event)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return (persec, used / len(events))
+
+
+def handle_testevents(bot, event):
+    """arguments: [<nr>] [<rawlog>] - replay irc traffic through eager and lazy events, show events per second and bytes per event."""
+    from jsb.drivers.irc.ircevent import IrcEvent
+    from jsb.utils.lazydict import LazyDict
+
+    class EagerEvent(IrcEvent):
+
+        """irc event that makes its queues up front and uses the plain lazydict attribute access, like events used to."""
+
+        __slots__ = ()
+        __getattr__ = LazyDict.__getattr__
+        __setattr__ = LazyDict.__setattr__
+
+        def __init__(self, input={}, bot=None):
+            IrcEvent.__init__(self, input, bot)
+            self.setup()
+
+        def __deepcopy__(self, bla):
+            return EagerEvent().copyin(self)
+
+    try:
+        nr = int(event.args[0])
+    except (IndexError, ValueError):
+        nr = 10000
+    lines = sampletraffic
+    if len(event.args) > 1:
+        try:
+            lines = [l for l in open(event.args[1]).read().splitlines() if l.strip()]
+        except IOError as ex:
+            event.reply("can't read %s: %s" % (event.args[1], str(ex)))
+            return
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        eager = replayevents(bot, EagerEvent, lines, nr)
+        lazy = replayevents(bot, IrcEvent, lines, nr)
+    finally:
+        logger.setLevel(level)
+    event.reply(
+        "%s events - eager: %d/sec %d bytes - lazy: %d/sec %d bytes"
+        % (nr, eager[0], eager[1], lazy[0], lazy[1])
+    )
+
+
+cmnds.add("test-events", handle_testevents, "TEST", threaded=True)
+examples.add(
+    "test-events",
+    "benchmark creating events under replayed irc traffic",
+    "1) test-events 2) test-events 100000 3) test-events 10000 /tmp/raw.log",
+)
+
+# test-fish command
+
+
+def benchfish(encrypt, decrypt, lines, nr):
+    """encrypt and decrypt nr lines, return messages per second."""
+    starttime = time.time()
+    for i in range(nr):
+        txt = lines[i % len(lines)]
+        assert decrypt(encrypt(txt)) == txt
+    return nr / (time.time() - starttime)
+
+
+def handle_testfish(bot, event):
+    """arguments: [<nr>] - encrypt and decrypt lines with FiSH, with a new and with a cached cipher per message."""
+    try:
+        import jsb.plugs.socket.fish as fish
+    except ImportError as ex:
+        event.reply("can't load the fish plugin: %s" % str(ex))
+        return
+    try:
+        nr = int(event.args[0])
+    except (IndexError, ValueError):
+        nr = 10000
+    key = "tfu4Qysoy56OYeckat1HpJWzi+tJVx/cm+Svzb6eunQ"
+    lines = [l.split(" :", 1)[-1] for l in sampletraffic]
+    fresh = benchfish(
+        lambda txt: fish.blowcrypt_pack(txt, fish.Blowfish(key)),
+        lambda txt: fish.blowcrypt_unpack(txt, fish.Blowfish(key)),
+        lines,
+        nr,
+    )
+    cached = benchfish(
+        lambda txt: fish.encrypt(key, txt),
+        lambda txt: fish.decrypt(key, txt),
+        lines,
+        nr,
+    )
+    cbc = fish.BlowfishCBC(key)
+    mircryption = benchfish(
+        lambda txt: fish.mircryption_cbc_pack(txt, cbc),
+        lambda txt: fish.mircryption_cbc_unpack(txt, cbc),
+        lines,
+        nr,
+    )
+    event.reply(
+        "%s messages - new cipher: %d/sec - cached cipher: %d/sec - mircryption cbc: %d/sec"
+        % (nr, fresh, cached, mircryption)
+    )
+
+
+cmnds.add("test-fish", handle_testfish, "TEST", threaded=True)
+examples.add(
+    "test-fish",
+    "benchmark FiSH encryption with new and cached cipher contexts",
+    "1) test-fish 2) test-fish 100000",
+)
+
+# test-chatlog command
+
+
+def handle_testchatlog(bot, event):
+    """no arguments - check that log lines of every chatlog format parse back to their nick and text."""
+    try:
+        import jsb.plugs.socket.chatlog as chatlog
+    except ImportError as ex:
+        event.reply("can't load the chatlog plugin: %s" % str(ex))
+        return
+    from datetime import datetime
+
+    from jsb.utils.format import formats
+    from jsb.utils.lazydict import LazyDict
+
+    messages = [
+        ("dunker", "<dunker> hello world"),
+        ("dunker", "* dunker waves"),
+        ("dunker", "-dunker- a notice"),
+        ("unknown", "dunker (dunker@host) has joined #dunkbots"),
+    ]
+    errors = []
+    for fmt in sorted(formats):
+        for nick, txt in messages:
+            m = LazyDict(
+                {"datetime": datetime.now(), "nick": nick, "txt": txt, "type": ""}
+            )
+            parsed = chatlog.parseline(chatlog.logline(m, fmt), fmt)
+            if not parsed or parsed[1] != nick or not txt.endswith(parsed[2]):
+                errors.append("%s: %s -> %s" % (fmt, txt, parsed))
+    if errors:
+        event.reply("chatlog parse errors: ", errors, dot=" || ")
+    else:
+        event.reply(
+            "%s formats - %s lines parsed back ok" % (len(formats), len(messages))
+        )
+
+
+cmnds.add("test-chatlog", handle_testchatlog, "TEST")
+examples.add(
+    "test-chatlog",
+    "check that chatlog lines of every format parse back to the right nick",
+    "test-chatlog",
+)
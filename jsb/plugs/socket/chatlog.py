@@ -9,7 +9,12 @@
 import _thread
 import logging
 import os
+import re
+import sys
+import threading
 import time
+from array import array
+from bisect import bisect_left, bisect_right
 
 from jsb.lib.callbacks import (callbacks, first_callbacks, last_callbacks,
                                remote_callbacks)
@@ -17,8 +22,9 @@ from jsb.lib.commands import cmnds
 from jsb.lib.datadir import getdatadir
 from jsb.lib.examples import examples
 from jsb.lib.persistconfig import PersistConfig
+from jsb.lib.threads import start_new_thread
 from jsb.utils.exception import handle_exception
-from jsb.utils.format import format_opt, formatevent
+from jsb.utils.format import format_opt, formatevent, formats
 from jsb.utils.lazydict import LazyDict
 from jsb.utils.locking import lockdec
 from jsb.utils.log import init
@@ -98,9 +104,15 @@ def initlog(d):
 format = "%(message)s"
 
 
-def timestr(dt):
+def logformat():
+    """return the configured log format, "log" when it is unknown."""
+    fmt = cfg.get("format")
+    return fmt in formats and fmt or "log"
+
+
+def timestr(dt, fmt="log"):
     """convert datatime object to a time string."""
-    return dt.strftime(format_opt("timestamp_format"))
+    return dt.strftime(format_opt("timestamp_format", fmt))
 
 
 # enablelogging function
@@ -157,25 +169,33 @@ def write(m):
     backend(m)
 
 
-def log_write(m):
-    if stopped:
-        return
-    logname = "%s_%s" % (m.botname, stripname(m.target))
-    timestamp = timestr(m.datetime)
-    m.type = m.type.upper()
-    line = "%(timestamp)s%(separator)s %(txt)s\n" % (
+def logline(m, fmt="log"):
+    """return the log line of message m in format fmt, parseline() reads it back."""
+    return "%(timestamp)s%(separator)s %(txt)s\n" % (
         {
-            "timestamp": timestamp,
-            "separator": format_opt("separator"),
+            "timestamp": timestr(m.datetime, fmt),
+            "separator": format_opt("separator", fmt),
             "nick": m.nick,
             "txt": m.txt,
-            "nick": m.nick,
             "type": m.type,
         }
     )
+
+
+def log_write(m):
+    if stopped:
+        return
+    logname = "%s_%s" % (m.botname, stripname(m.target))
+    m.type = m.type.upper()
+    line = logline(m, logformat())
     global loggers
     try:
         loggers[logname].info(line.strip())
+        index = indexes.get(logname)
+        if index:
+            parsed = parseline(line, index.format)
+            if parsed:
+                index.add(index.written(), *parsed)
     except KeyError:
         logging.error("no logger available for channel %s" % logname)
     except Exception as ex:
@@ -184,6 +204,304 @@ def log_write(m):
 
 backends["log"] = log_write
 
+# ChatlogIndex class
+
+wordre = re.compile(r"\w+", re.U)
+
+
+daystarts = {}
+
+
+def parseline(line, fmt="log"):
+    """
+    split a log line written by logline() in format fmt into (time, nick,
+    txt). nick is "unknown" for non message lines.
+
+    """
+    tsformat = format_opt("timestamp_format", fmt)
+    separator = format_opt("separator", fmt)
+    line = line.strip()
+    splitted = line.split(" ", tsformat.count(" ") + 1)
+    if len(splitted) < tsformat.count(" ") + 2:
+        return None
+    stamp = " ".join(splitted[: tsformat.count(" ") + 1])
+    txt = line[len(stamp) :]
+    if not txt.startswith(separator):
+        return None
+    txt = txt[len(separator) :].lstrip()
+    try:
+        if tsformat.endswith("%H:%M:%S"):
+            day = (fmt, stamp[:-8])
+            try:
+                daytime = daystarts[day]
+            except KeyError:
+                daytime = daystarts[day] = time.mktime(
+                    time.strptime(stamp[:-8], tsformat[:-8])
+                )
+            h, m, sec = stamp[-8:].split(":")
+            logtime = daytime + int(h) * 3600 + int(m) * 60 + int(sec)
+        else:
+            logtime = time.mktime(time.strptime(stamp, tsformat))
+    except ValueError:
+        return None
+    nick = "unknown"
+    if txt.startswith("<") and ">" in txt:
+        nick, txt = txt[1:].split(">", 1)
+    elif txt.startswith("* "):
+        nick = txt.split()[1]
+    elif txt.startswith("-") and "- " in txt:
+        nick, txt = txt[1:].split("- ", 1)
+    return (logtime, nick, txt.strip())
+
+
+class ChatlogIndex(object):
+
+    """
+    inverted index of one chatlog, kept up to date as log_write() appends
+    lines. only the file and offset of a line are kept, search results are
+    read back from disk.
+
+    """
+
+    def __init__(self, logname, fmt="log"):
+        self.logname = logname
+        self.format = fmt
+        self.times = array("d")
+        self.fileids = array("H")
+        self.offsets = array("Q")
+        self.files = []
+        self.active = None
+        self.inode = None
+        self.end = 0
+        self.words = {}
+        self.nicks = {}
+        self.days = {}
+        self.lock = threading.RLock()
+        self.ready = False
+        self.pending = []
+
+    def logfiles(self):
+        """return the log files of this chatlog, oldest first."""
+        logdir = initlog(getdatadir())
+        prefix = self.logname + ".log"
+        try:
+            names = [f for f in os.listdir(logdir) if f.startswith(prefix)]
+        except OSError:
+            return []
+        names.sort(key=lambda a: (a == prefix, a))
+        return [logdir + os.sep + name for name in names]
+
+    def activefile(self):
+        """return the file the logger is appending to."""
+        return initlog(getdatadir()) + os.sep + self.logname + ".log"
+
+    def snapshot(self):
+        """
+        return (fileid, size) of the log files, taken under outlock before
+        the index is registered so lines logged later are queued, not read.
+
+        """
+        sizes = []
+        active = self.activefile()
+        for fn in self.logfiles():
+            try:
+                stat = os.stat(fn)
+            except OSError:
+                continue
+            if fn == active:
+                self.active = len(self.files)
+                self.inode = stat.st_ino
+                self.end = stat.st_size
+            sizes.append((len(self.files), stat.st_size))
+            self.files.append(fn)
+        return sizes
+
+    def written(self):
+        """
+        return (fileid, offset) of the line log_write() just appended, called
+        under outlock. when the logger rotated, the old file is looked up
+        under its new name.
+
+        """
+        active = self.activefile()
+        try:
+            stat = os.stat(active)
+        except OSError:
+            return None
+        with self.lock:
+            if stat.st_ino != self.inode:
+                if self.active is not None:
+                    for fn in self.logfiles():
+                        try:
+                            if os.stat(fn).st_ino == self.inode:
+                                self.files[self.active] = fn
+                                break
+                        except OSError:
+                            continue
+                self.active = len(self.files)
+                self.files.append(active)
+                self.inode = stat.st_ino
+                self.end = 0
+            offset = self.end
+            self.end = stat.st_size
+            return (self.active, offset)
+
+    def build(self, sizes):
+        """index the log files up to the snapshot sizes, lines logged meanwhile are queued."""
+        started = time.time()
+        nr = 0
+        for fileid, size in sizes:
+            with self.lock:
+                fn = self.files[fileid]
+            try:
+                with open(fn, "rb") as logfile:
+                    data = logfile.read(size)
+            except IOError as ex:
+                logging.warn("can't read %s - %s" % (fn, str(ex)))
+                continue
+            offset = 0
+            for line in data.split(b"\n"):
+                parsed = parseline(line.decode("utf-8", "replace"), self.format)
+                if parsed:
+                    self.add((fileid, offset), *parsed, force=True)
+                    nr += 1
+                offset += len(line) + 1
+        with self.lock:
+            for args in self.pending:
+                self.add(*args, force=True)
+            self.pending = []
+            self.ready = True
+        logging.warn(
+            "%s - indexed %s lines in %.1f seconds"
+            % (self.logname, nr, time.time() - started)
+        )
+
+    def add(self, location, logtime, nick, txt, force=False):
+        """add the log line at location (fileid, offset) to the index."""
+        if not location:
+            return
+        with self.lock:
+            if not force and not self.ready:
+                self.pending.append((location, logtime, nick, txt))
+                return
+            nr = len(self.times)
+            nick = sys.intern(nick)
+            self.times.append(logtime)
+            self.fileids.append(location[0])
+            self.offsets.append(location[1])
+            self.nicks.setdefault(nick.lower(), array("I")).append(nr)
+            words = [w.lower() for w in wordre.findall(txt)]
+            for word in set(words):
+                self.words.setdefault(word, array("I")).append(nr)
+            day = time.strftime("%Y-%m-%d", time.localtime(logtime))
+            try:
+                users, wordstats = self.days[day]
+            except KeyError:
+                users, wordstats = self.days[day] = (StatDict(), {})
+            users.upitem(nick)
+            nickwords = wordstats.setdefault(nick, StatDict())
+            for word in words:
+                nickwords.upitem(word)
+
+    def search(self, words=[], phrases=[], nick=None, start=None, end=None):
+        """return log lines containing all words and phrases, optionally by nick and in a time range."""
+        with self.lock:
+            lo = bisect_left(self.times, start) if start else 0
+            hi = bisect_right(self.times, end) if end else len(self.times)
+            postings = []
+            for phrase in phrases:
+                words = words + wordre.findall(phrase)
+            for word in words:
+                postings.append(self.words.get(word.lower(), ()))
+            if nick:
+                postings.append(self.nicks.get(nick.lower(), ()))
+            if postings:
+                postings.sort(key=len)
+                candidates = postings[0][bisect_left(postings[0], lo) :]
+                result = []
+                for nr in candidates:
+                    if nr >= hi:
+                        break
+                    for other in postings[1:]:
+                        i = bisect_left(other, nr)
+                        if i == len(other) or other[i] != nr:
+                            break
+                    else:
+                        result.append(nr)
+            else:
+                result = range(lo, hi)
+            locations = [
+                (self.files[self.fileids[nr]], self.offsets[nr]) for nr in result
+            ]
+        lines = self.readlines(locations)
+        for phrase in phrases:
+            phrase = phrase.lower()
+            lines = [line for line in lines if phrase in line.lower()]
+        return lines
+
+    def readlines(self, locations):
+        """read the log lines at the (filename, offset) locations, in order."""
+        lines = []
+        logfile = None
+        current = None
+        try:
+            for fn, offset in locations:
+                if fn != current:
+                    current = fn
+                    if logfile:
+                        logfile.close()
+                    try:
+                        logfile = open(fn, "rb")
+                    except IOError as ex:
+                        logging.warn("can't read %s - %s" % (fn, str(ex)))
+                        logfile = None
+                if not logfile:
+                    continue
+                logfile.seek(offset)
+                lines.append(logfile.readline().decode("utf-8", "replace").strip())
+        finally:
+            if logfile:
+                logfile.close()
+        return lines
+
+    def size(self):
+        """return the number of indexed lines."""
+        return len(self.times)
+
+    def stats(self, since=0, nick=None):
+        """return (userstats, wordstats) summed over the days since the given time."""
+        userstats = StatDict()
+        wordstats = StatDict()
+        sinceday = since and time.strftime("%Y-%m-%d", time.localtime(since)) or ""
+        with self.lock:
+            for day, (users, words) in self.days.items():
+                if day < sinceday:
+                    continue
+                for who, nr in users.items():
+                    userstats.upitem(who, nr)
+                if nick and nick in words:
+                    for word, nr in words[nick].items():
+                        wordstats.upitem(word, nr)
+        return (userstats, wordstats)
+
+
+indexes = {}
+indexlock = _thread.allocate_lock()
+
+
+def getindex(botname, channel):
+    """return the index of a chatlog, start building it if needed."""
+    logname = "%s_%s" % (botname, stripname(channel))
+    with indexlock:
+        if logname not in indexes:
+            index = ChatlogIndex(logname, logformat())
+            with outlock:
+                sizes = index.snapshot()
+                indexes[logname] = index
+            start_new_thread(index.build, (sizes,))
+        return indexes[logname]
+
+
 # log function
 
 
@@ -248,6 +566,7 @@ def init():
     global loggers
     for (botname, channel) in cfg.get("channels"):
         enablelogging(botname, channel)
+        getindex(botname, channel)
     callbacks.add("PRIVMSG", chatlogcb, prechatlogcb)
     callbacks.add("JOIN", chatlogcb, prechatlogcb)
     callbacks.add("PART", chatlogcb, prechatlogcb)
@@ -281,6 +600,7 @@ def handle_chatlogon(bot, ievent):
     """no arguments - enable chatlog."""
     chan = ievent.channel
     enablelogging(bot.cfg.name, chan)
+    getindex(bot.cfg.name, chan)
     if [bot.cfg.name, chan] not in cfg.get("channels"):
         cfg["channels"].append([bot.cfg.name, chan])
         cfg.save()
@@ -324,26 +644,44 @@ examples.add(
 # chatlog-searh command
 
 
+def parsequery(txt):
+    """split search txt into words, "quoted phrases", nick:<nick>, from:<date> and to:<date>."""
+    query = LazyDict(words=[], phrases=[], nick=None, start=None, end=None)
+    query.phrases = re.findall(r'"([^"]+)"', txt)
+    for item in re.sub(r'"[^"]*"', " ", txt).split():
+        if item.startswith("nick:"):
+            query.nick = item[5:]
+        elif item.startswith("from:"):
+            query.start = strtotime2(item[5:])
+        elif item.startswith("to:"):
+            query.end = strtotime2(item[3:])
+            if query.end and ":" not in item:
+                query.end += 24 * 60 * 60
+        else:
+            query.words.append(item)
+    return query
+
+
 def handle_chatlogsearch(bot, event):
-    """arguments: <searchtxt> - search in the logs."""
+    """arguments: <searchtxt> - search in the logs. use "quoted phrases", nick:<nick>, from:<date> and to:<date> to narrow down."""
     if not event.rest:
         event.missing("<searchtxt>")
         return
-    result = []
-    chatlogdir = getdatadir() + os.sep + "chatlogs"
     if event.options and event.options.channel:
         chan = event.options.channel
     else:
         chan = event.channel
-    logs = os.listdir(chatlogdir)
-    logs.sort()
-    for f in logs:
-        filename = stripname(f)
-        if not chan[1:] in filename:
-            continue
-        for line in open(chatlogdir + os.sep + filename, "r"):
-            if event.rest in line:
-                result.append(line)
+    index = getindex(bot.cfg.name, chan)
+    if not index.ready:
+        event.reply(
+            "chatlog index of %s is still being built (%s lines so far)"
+            % (chan, index.size())
+        )
+        return
+    query = parsequery(event.rest)
+    result = index.search(
+        query.words, query.phrases, query.nick, query.start, query.end
+    )
     if result:
         event.reply("search results for %s: " % event.rest, result, dot=" || ")
     else:
@@ -354,7 +692,9 @@ cmnds.add(
     "chatlog-search", handle_chatlogsearch, ["OPER", "USER", "GUEST"], threaded=True
 )
 examples.add(
-    "chatlog-search", "search the chatlogs of a channel.", "chatlog-search jsonbot"
+    "chatlog-search",
+    "search the chatlogs of a channel.",
+    '1) chatlog-search jsonbot 2) chatlog-search "json bot" nick:dunker from:2012-01-01',
 )
 
 # chatlog-stats command
@@ -363,16 +703,20 @@ examples.add(
 def handle_chatlogstats(bot, event):
     """no arguments - create log stats of the channel, possible options: --chan <channel>"""
     what = event.rest.strip()
-    chatlogdir = getdatadir() + os.sep + "chatlogs"
     if event.options and event.options.channel:
         chan = event.options.channel
     else:
         chan = event.channel
-    logs = os.listdir(chatlogdir)
-    if not logs:
+    index = getindex(bot.cfg.name, chan)
+    if not index.ready:
+        event.reply(
+            "chatlog index of %s is still being built (%s lines so far)"
+            % (chan, index.size())
+        )
+        return
+    if not index.size():
         event.reply("no logs available for %s" % chan)
         return
-    now = time.time()
     if what:
         timetarget = strtotime2(what)
         what = striptime(what)
@@ -380,35 +724,7 @@ def handle_chatlogstats(bot, event):
         timetarget = 0
         what = None
     event.reply("creating stats for channel %s (%s)" % (chan, time.ctime(timetarget)))
-    userstats = StatDict()
-    wordstats = StatDict()
-    stop = False
-    for f in logs[::-1]:
-        filename = stripname(f)
-        channel = stripname(chan[1:])
-        if not channel in filename:
-            continue
-        for line in open(chatlogdir + os.sep + filename, "r"):
-            splitted = line.strip().split()
-            if len(splitted) < 2:
-                continue
-            who = "unknown"
-            for i in splitted:
-                if i.startswith("<"):
-                    who = i[1:-1]
-            if what and who != what:
-                continue
-            timestr = "%s %s" % (splitted[0], splitted[1])
-            logtime = strtotime2(timestr)
-            if logtime:
-                if logtime > timetarget:
-                    userstats.upitem(who)
-                else:
-                    continue
-            else:
-                userstats.upitem(who)
-            for word in splitted[4:]:
-                wordstats.upitem(word)
+    userstats, wordstats = index.stats(timetarget, what)
     if what:
         result = wordstats.top()
     else:
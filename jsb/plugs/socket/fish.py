@@ -17,7 +17,9 @@
 import base64
 import hashlib
 import struct
+import threading
 import time
+from collections import OrderedDict
 from math import log
 from os import urandom
 
@@ -46,13 +48,6 @@ from jsb.utils.name import stripname
 # basic imports
 
 
-# check for pycrypto dependancy
-
-raise ImportError(
-    "FiSH was using PyCrypto which is no longer supported and is insecure."
-    "You need to rewrite this module to use a maintained cryptography library."
-)
-
 #
 # Requires cryptodome python module
 #
@@ -61,8 +56,7 @@ try:
     import Crypto.Cipher.Blowfish
 except ImportError:
     raise ImportError(
-        "FiSH was using PyCrypto which is no longer supported and is insecure."
-        "You need to rewrite this module to use a maintained cryptography library."
+        "FiSH needs the pycryptodome module, PyCrypto is no longer supported."
     )
 
 # defines
@@ -71,6 +65,7 @@ cfg = PersistConfig()
 cfg.define("enable", 0)
 
 users = getusers()
+maxciphers = 100
 
 # KeyStore class
 
@@ -89,6 +84,44 @@ class KeyStore(Persist):
         )
 
 
+keystores = {}
+keylock = threading.Lock()
+
+
+def getkeystore(target):
+    """return the (cached) key store of target."""
+    name = stripname(target)
+    try:
+        return keystores[name]
+    except KeyError:
+        with keylock:
+            if name not in keystores:
+                keystores[name] = KeyStore(name)
+            return keystores[name]
+
+
+# cipher cache
+
+ciphers = OrderedDict()
+cipherlock = threading.Lock()
+
+
+def getcipher(key):
+    """return the (cached) Blowfish context of key, the least recently used are dropped."""
+    with cipherlock:
+        try:
+            ciphers.move_to_end(key)
+            return ciphers[key]
+        except KeyError:
+            pass
+    cipher = Blowfish(key)
+    with cipherlock:
+        ciphers[key] = cipher
+        while len(ciphers) > maxciphers:
+            ciphers.popitem(last=False)
+    return cipher
+
+
 # make sure we get loaded
 
 
@@ -133,7 +166,7 @@ def fishin(text, event=None):
         if not target:
             return
 
-        key = KeyStore(stripname(target))
+        key = getkeystore(target)
         if not key.data.key:
             logging.debug("FiSHin: No key found for target %s" % target)
             return text
@@ -166,7 +199,7 @@ def fishout(text, event):
     if not target:
         return
 
-    key = KeyStore(stripname(target))
+    key = getkeystore(target)
     if not key.data.key:
         logging.debug("FiSHout: No key found for target %s" % target)
         return text
@@ -179,16 +212,14 @@ def fishout(text, event):
 
 
 def encrypt(key, text):
-    b = Blowfish(key)
-    return blowcrypt_pack(text, b)
+    return blowcrypt_pack(text, getcipher(key))
 
 
 # decrypt function
 
 
 def decrypt(key, inp):
-    b = Blowfish(key)
-    return blowcrypt_unpack(inp, b)
+    return blowcrypt_unpack(inp, getcipher(key))
 
 
 # dh1080_exchange function
@@ -203,7 +234,7 @@ def dh1080_exchange(bot, ievent):
         return True
     if ievent.txt.startswith("DH1080_INIT "):
         logging.warn("FiSH: DH1080_INIT with %s" % target)
-        key = KeyStore(stripname(target))
+        key = getkeystore(target)
 
         dh = DH1080Ctx()
         if dh1080_unpack(ievent.txt, dh) != True:
@@ -220,7 +251,7 @@ def dh1080_exchange(bot, ievent):
         return False
 
     if ievent.txt.startswith("DH1080_FINISH "):
-        key = KeyStore(stripname(target))
+        key = getkeystore(target)
 
         logging.warn("FiSH: DH1080_FINISH")
         dh = pickle.loads(key.data.dh)
@@ -277,7 +308,7 @@ def handle_fish(bot, event):
         dh = DH1080Ctx()
         bot.notice(args[1], dh1080_pack(dh))
 
-        key = KeyStore(stripname(target))
+        key = getkeystore(target)
         key.data.dh = pickle.dumps(dh)
         key.save()
 
@@ -285,7 +316,7 @@ def handle_fish(bot, event):
         if len(args) != 3:
             event.missing("key <user|channel> <key>")
             return
-        key = KeyStore(stripname(args[1]))
+        key = getkeystore(args[1])
         key.data.key = args[2]
         key.save()
         event.reply("Stored key for %s" % args[1])
@@ -294,7 +325,7 @@ def handle_fish(bot, event):
         if len(args) != 2:
             event.missing("del <user|channel>")
             return
-        key = KeyStore(stripname(args[1]))
+        key = getkeystore(args[1])
 
         if not key.data.key:
             event.reply("No key found for %s" % args[1])
@@ -405,22 +436,12 @@ def sha256(s):
 
 def int2bytes(n):
     """Integer to variable length big endian."""
-    if n == 0:
-        return "\x00"
-    b = ""
-    while n:
-        b = chr(n % 256) + b
-        n /= 256
-    return b
+    return n.to_bytes((n.bit_length() + 7) // 8 or 1, "big")
 
 
 def bytes2int(b):
     """Variable length big endian to integer."""
-    n = 0
-    for p in b:
-        n *= 256
-        n += ord(p)
-    return n
+    return int.from_bytes(b, "big")
 
 
 # FIXME! Only usable for really small a with b near 16^x.
@@ -441,17 +462,16 @@ def padto(msg, length):
     If the length of msg is already a multiple of 'length', does nothing."""
     L = len(msg)
     if L % length:
-        msg += "\x00" * (length - L % length)
+        msg += (b"\x00" if isinstance(msg, bytes) else "\x00") * (length - L % length)
     assert len(msg) % length == 0
     return msg
 
 
-def xorstring(a, b, blocksize):  # Slow.
-    """xor string a and b, both of length blocksize."""
-    xored = ""
-    for i in range(blocksize):
-        xored += chr(ord(a[i]) ^ ord(b[i]))
-    return xored
+def xorstring(a, b, blocksize):
+    """xor byte strings a and b, both of length blocksize, as integers."""
+    return (
+        int.from_bytes(a[:blocksize], "big") ^ int.from_bytes(b[:blocksize], "big")
+    ).to_bytes(blocksize, "big")
 
 
 def cbc_encrypt(func, data, blocksize):
@@ -463,42 +483,35 @@ def cbc_encrypt(func, data, blocksize):
     IV = urandom(blocksize)
     assert len(IV) == blocksize
 
-    ciphertext = IV
-    for block_index in range(len(data) // blocksize):
-        xored = xorstring(data, IV, blocksize)
-        enc = func(xored)
-
-        ciphertext += enc
-        IV = enc
-        data = data[blocksize:]
-
-    assert len(ciphertext) % blocksize == 0
-    return ciphertext
+    ciphertext = [IV]
+    for block_index in range(0, len(data), blocksize):
+        IV = func(xorstring(data[block_index : block_index + blocksize], IV, blocksize))
+        ciphertext.append(IV)
+    return b"".join(ciphertext)
 
 
 def cbc_decrypt(func, data, blocksize):
-    """See cbc_encrypt."""
+    """See cbc_encrypt. 'func' decrypts the whole buffer in ECB mode, which
+    is then xored with the IV and the ciphertext shifted by one block."""
     assert len(data) % blocksize == 0
 
-    IV = data[0:blocksize]
-    data = data[blocksize:]
+    if len(data) <= blocksize:
+        return b""
+    plain = func(data[blocksize:])
+    return xorstring(plain, data[:-blocksize], len(plain))
 
-    plaintext = ""
-    for block_index in range(len(data) // blocksize):
-        temp = func(data[0:blocksize])
-        temp2 = xorstring(temp, IV, blocksize)
-        plaintext += temp2
-        IV = data[0:blocksize]
-        data = data[blocksize:]
 
-    assert len(plaintext) % blocksize == 0
-    return plaintext
+class Blowfish:
 
+    """Blowfish in ECB mode, data of any number of blocks is handled in one call."""
 
-class Blowfish:
     def __init__(self, key=None):
         if key:
-            self.blowfish = Crypto.Cipher.Blowfish.new(key)
+            if isinstance(key, str):
+                key = key.encode("utf-8")
+            self.blowfish = Crypto.Cipher.Blowfish.new(
+                key, Crypto.Cipher.Blowfish.MODE_ECB
+            )
 
     def decrypt(self, data):
         return self.blowfish.decrypt(data)
@@ -507,11 +520,7 @@ class Blowfish:
         return self.blowfish.encrypt(data)
 
 
-class BlowfishCBC:
-    def __init__(self, key=None):
-        if key:
-            self.blowfish = Crypto.Cipher.Blowfish.new(key)
-
+class BlowfishCBC(Blowfish):
     def decrypt(self, data):
         return cbc_decrypt(self.blowfish.decrypt, data, 8)
 
@@ -521,7 +530,7 @@ class BlowfishCBC:
 
 class AESCBC:
     def __init__(self, key):
-        self.aes = Crypto.Cipher.AES.new(key)
+        self.aes = Crypto.Cipher.AES.new(key, Crypto.Cipher.AES.MODE_ECB)
 
     def decrypt(self, data):
         return cbc_decrypt(self.aes.decrypt, data, 16)
@@ -534,40 +543,49 @@ class AESCBC:
 # blowcrypt, Fish etc.
 ##
 
-# XXX: Unstable.
+B64 = "./0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# two characters per 12 bits, least significant 6 bits first
+B64encode = [B64[i & 0x3F] + B64[i >> 6] for i in range(4096)]
+B64decode = dict((c, i) for i, c in enumerate(B64encode))
+
+
 def blowcrypt_b64encode(s):
-    """A non-standard base64-encode."""
-    B64 = "./0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    res = ""
-    while s:
-        left, right = struct.unpack(">LL", s[:8])
-        for i in range(6):
-            res += B64[right & 0x3F]
-            right >>= 6
-        for i in range(6):
-            res += B64[left & 0x3F]
-            left >>= 6
-        s = s[8:]
-    return res
+    """A non-standard base64-encode, 12 characters per 8 byte block."""
+    enc = B64encode
+    res = []
+    for word in struct.unpack(">%sL" % (len(s) // 4), s[: len(s) // 8 * 8]):
+        res.append(enc[word & 0xFFF] + enc[(word >> 12) & 0xFFF] + enc[word >> 24])
+    # the right word of a block goes first
+    res[::2], res[1::2] = res[1::2], res[::2]
+    return "".join(res)
 
 
 def blowcrypt_b64decode(s):
-    """A non-standard base64-decode."""
-    B64 = "./0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    res = ""
-    while s:
-        left, right = 0, 0
-        for i, p in enumerate(s[0:6]):
-            right |= B64.index(p) << (i * 6)
-        for i, p in enumerate(s[6:12]):
-            left |= B64.index(p) << (i * 6)
-        res += struct.pack(">LL", left, right)
-        s = s[12:]
-    return res
+    """A non-standard base64-decode, trailing characters that don't fill a block are ignored."""
+    dec = B64decode
+    words = []
+    try:
+        for i in range(0, len(s) // 12 * 12, 6):
+            words.append(
+                dec[s[i : i + 2]]
+                | dec[s[i + 2 : i + 4]] << 12
+                | dec[s[i + 4 : i + 6]] << 24
+            )
+    except KeyError:
+        raise ValueError("invalid blowcrypt base64")
+    # the right word of a block goes first
+    words[::2], words[1::2] = words[1::2], words[::2]
+    try:
+        return struct.pack(">%sL" % len(words), *words)
+    except struct.error:
+        raise ValueError("invalid blowcrypt base64")
 
 
 def blowcrypt_pack(msg, cipher):
     """."""
+    if isinstance(msg, str):
+        msg = msg.encode("utf-8")
     return "+OK " + blowcrypt_b64encode(cipher.encrypt(padto(msg, 8)))
 
 
@@ -580,8 +598,8 @@ def blowcrypt_unpack(msg, cipher):
         raise MalformedError
 
     try:
-        raw = blowcrypt_b64decode(padto(rest, 12))
-    except TypeError:
+        raw = blowcrypt_b64decode(rest)
+    except (TypeError, ValueError):
         raise MalformedError
     if not raw:
         raise MalformedError
@@ -591,7 +609,7 @@ def blowcrypt_unpack(msg, cipher):
     except ValueError:
         raise MalformedError
 
-    return plain.strip("\x00")
+    return plain.strip(b"\x00").decode("utf-8")
 
 
 ##
@@ -601,8 +619,10 @@ def blowcrypt_unpack(msg, cipher):
 
 def mircryption_cbc_pack(msg, cipher):
     """."""
+    if isinstance(msg, str):
+        msg = msg.encode("utf-8")
     padded = padto(msg, 8)
-    return "+OK *" + base64.b64encode(cipher.encrypt(padded))
+    return "+OK *" + base64.b64encode(cipher.encrypt(padded)).decode("ascii")
 
 
 def mircryption_cbc_unpack(msg, cipher):
@@ -613,7 +633,7 @@ def mircryption_cbc_unpack(msg, cipher):
     try:
         _, coded = msg.split("*", 1)
         raw = base64.b64decode(coded)
-    except TypeError:
+    except (TypeError, ValueError):
         raise MalformedError
     if not raw:
         raise MalformedError
@@ -625,8 +645,8 @@ def mircryption_cbc_unpack(msg, cipher):
     if not padded:
         raise MalformedError
 
-    plain = padded.strip("\x00")
-    return plain
+    plain = padded.strip(b"\x00")
+    return plain.decode("utf-8")
 
 
 ##
@@ -654,7 +674,7 @@ q_dh1080 = (p_dh1080 - 1) // 2
 # standard one but with the padding character '=' removed. A trailing 'A'
 # is also added sometimes.
 def dh1080_b64encode(s):
-    """A non-standard base64-encode."""
+    """A non-standard base64-encode of bytes."""
     b64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
     d = [0] * len(s) * 2
 
@@ -662,7 +682,7 @@ def dh1080_b64encode(s):
     m = 0x80
     i, j, k, t = 0, 0, 0, 0
     while i < L:
-        if ord(s[i >> 3]) & m:
+        if s[i >> 3] & m:
             t |= 1
         j += 1
         m >>= 1
@@ -692,7 +712,7 @@ def dh1080_b64encode(s):
 
 
 def dh1080_b64decode(s):
-    """A non-standard base64-encode."""
+    """A non-standard base64-decode, returns bytes."""
     b64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
     buf = [0] * 256
     for i in range(64):
@@ -746,7 +766,7 @@ def dh1080_b64decode(s):
         else:
             break
         k += 1
-    return "".join(map(chr, d[0 : i - 1]))
+    return bytes(d[0 : i - 1])
 
 
 def dh_validate_public(public, q, p):
@@ -24,13 +24,20 @@ __author__ = "Bas van Oostveen"
 __coauthor__ = "Bart Thate <bthate@gmail.com>"
 
 import logging
+import mmap
 import os
 import random
 import re
+import struct
+import sys
+import threading
 import time
 import traceback
+from array import array
+from bisect import bisect_left
 
 from jsb.lib.callbacks import callbacks
+from jsb.imports import getjson
 from jsb.lib.commands import cmnds
 from jsb.lib.datadir import getdatadir
 from jsb.lib.examples import examples
@@ -48,6 +55,9 @@ cfg.define("enable", [])
 cfg.define("command", 0)
 cfg.define("onjoin", [])
 cfg.define("target", "jsonbot")
+cfg.define("saveinterval", 600)
+
+json = getjson()
 
 
 def enabled(botname, channel):
@@ -88,14 +98,237 @@ ORDER_K = 2
 # Maximum generation cycles
 MAXGEN = 500
 
+# lines to learn per batch
+BATCH = 1000
+
 markovlearn = PlugPersist("markovlearn")
 markovlearn.data.l = markovlearn.data.l or []
-markovwords = {}
-markovwordi = []
-markovchains = {}
 
 cfg.define("loud", 0)
 
+# MarkovStore class
+
+MAGIC = b"JSBMRKV1"
+KEYBITS = 64 // ORDER_K
+
+
+class MarkovStore(object):
+
+    """
+    compact markov chains. words are interned as integers (0 is TOKEN), an
+    order is packed into one 64 bit key that maps to successor ids with counts.
+
+    the saved chains are kept in a file as sorted arrays and mmap-ed on load,
+    chains learned since the last save are kept in a dict and merged on save.
+
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.lock = threading.RLock()
+        self.words = {TOKEN: 0}
+        self.wordi = [TOKEN]
+        self.learned = {}
+        self.delta = {}
+        self.dirty = False
+        self.lastsave = time.time()
+        self.mm = None
+        self.clear()
+
+    def clear(self):
+        """drop the mapped chains."""
+        self.keys = self.offsets = self.succs = self.counts = ()
+        if self.mm:
+            self.mm.close()
+            self.mm = None
+
+    def load(self):
+        """map the chains file, return False if there is nothing (usable) to load."""
+        try:
+            f = open(self.fn, "rb")
+        except IOError:
+            return False
+        with self.lock, f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return False
+            if mm[:8] != MAGIC:
+                logging.warn("%s is not a markov chains file" % self.fn)
+                mm.close()
+                return False
+            metalen, wordslen = struct.unpack("<II", mm[8:16])
+            meta = json.loads(mm[16 : 16 + metalen].decode("utf-8"))
+            if meta["order"] != ORDER_K or meta["byteorder"] != sys.byteorder:
+                logging.warn("%s has a different layout, relearning" % self.fn)
+                mm.close()
+                return False
+            pos = 16 + metalen
+            words = mm[pos : pos + wordslen].decode("utf-8")
+            pos += wordslen
+            pos += -pos % 8
+            self.clear()
+            self.mm = mm
+            self.wordi = [TOKEN] + (words and words.split("\n") or [])
+            self.words = dict((w, i) for i, w in enumerate(self.wordi))
+            self.learned = meta["learned"]
+            view = memoryview(mm)
+            nkeys, nsuccs = meta["nkeys"], meta["nsuccs"]
+            self.keys = view[pos : pos + 8 * nkeys].cast("Q")
+            pos += 8 * nkeys
+            self.offsets = view[pos : pos + 4 * (nkeys + 1)].cast("I")
+            pos += 4 * (nkeys + 1)
+            self.succs = view[pos : pos + 4 * nsuccs].cast("I")
+            pos += 4 * nsuccs
+            self.counts = view[pos : pos + 4 * nsuccs].cast("I")
+            logging.warn(
+                "loaded %s markov chains of %s words from %s"
+                % (nkeys, len(self.wordi), self.fn)
+            )
+            return True
+
+    def save(self):
+        """merge learned chains with the mapped ones and write them to file."""
+        with self.lock:
+            if not self.dirty:
+                return
+            keys = array("Q")
+            offsets = array("I", [0])
+            succs = array("I")
+            counts = array("I")
+            dkeys = sorted(self.delta)
+            i = j = 0
+            while i < len(self.keys) or j < len(dkeys):
+                if j == len(dkeys) or (i < len(self.keys) and self.keys[i] < dkeys[j]):
+                    keys.append(self.keys[i])
+                    start, end = self.offsets[i], self.offsets[i + 1]
+                    succs.extend(self.succs[start:end])
+                    counts.extend(self.counts[start:end])
+                    i += 1
+                else:
+                    key = dkeys[j]
+                    successors = self.get(key)
+                    if i < len(self.keys) and self.keys[i] == key:
+                        i += 1
+                    j += 1
+                    keys.append(key)
+                    succs.extend(successors.keys())
+                    counts.extend(successors.values())
+                offsets.append(len(succs))
+            meta = {
+                "order": ORDER_K,
+                "byteorder": sys.byteorder,
+                "nkeys": len(keys),
+                "nsuccs": len(succs),
+                "learned": self.learned,
+            }
+            meta = json.dumps(meta).encode("utf-8")
+            words = "\n".join(self.wordi[1:]).encode("utf-8")
+            header = MAGIC + struct.pack("<II", len(meta), len(words)) + meta + words
+            header += b"\0" * (-len(header) % 8)
+            path = os.path.dirname(self.fn)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            tmp = self.fn + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(header)
+                for data in (keys, offsets, succs, counts):
+                    data.tofile(f)
+            self.clear()
+            os.replace(tmp, self.fn)
+            self.delta = {}
+            self.dirty = False
+            self.lastsave = time.time()
+            self.load()
+
+    def wordid(self, word):
+        """return the id of a word, interning it if needed."""
+        try:
+            return self.words[word]
+        except KeyError:
+            wi = self.words[word] = len(self.wordi)
+            self.wordi.append(word)
+            return wi
+
+    def packkey(self, order, create=False):
+        """pack an order into an integer key, None if a word is unknown."""
+        key = 0
+        for word in order:
+            if create:
+                wi = self.wordid(word)
+            else:
+                wi = self.words.get(word)
+            if wi is None:
+                return None
+            key = (key << KEYBITS) | wi
+        return key
+
+    def get(self, key):
+        """return {successorid: count} of a key, mapped counts first."""
+        result = {}
+        with self.lock:
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                start, end = self.offsets[i], self.offsets[i + 1]
+                result = dict(zip(self.succs[start:end], self.counts[start:end]))
+            for succ, nr in self.delta.get(key, {}).items():
+                result[succ] = result.get(succ, 0) + nr
+        return result
+
+    def successors(self, order):
+        """return the words that follow an order."""
+        with self.lock:
+            key = self.packkey(order)
+            if key is None:
+                return []
+            return [self.wordi[i] for i in self.get(key)]
+
+    def learn(self, lines):
+        """learn a batch of text lines."""
+        with self.lock:
+            for line in lines:
+                words = msg_to_array(line)
+                order = [TOKEN] * ORDER_K
+                for i in range(len(words) - 1):
+                    order.insert(0, words[i])
+                    order = order[:ORDER_K]
+                    key = self.packkey(order, create=True)
+                    succ = self.wordid(words[i + 1])
+                    chain = self.delta.setdefault(key, {})
+                    chain[succ] = chain.get(succ, 0) + 1
+                    self.dirty = True
+
+    def status(self):
+        """return sizes of the store."""
+        with self.lock:
+            memory = sys.getsizeof(self.delta) + sys.getsizeof(self.words)
+            memory += sys.getsizeof(self.wordi)
+            memory += sum(sys.getsizeof(w) for w in self.wordi)
+            memory += sum(sys.getsizeof(c) for c in self.delta.values())
+            try:
+                filesize = os.path.getsize(self.fn)
+            except OSError:
+                filesize = 0
+            new = 0
+            for key in self.delta:
+                i = bisect_left(self.keys, key)
+                if i == len(self.keys) or self.keys[i] != key:
+                    new += 1
+            return {
+                "words": len(self.wordi) - 1,
+                "chains": len(self.keys) + new,
+                "mapped": len(self.keys),
+                "unsaved": len(self.delta),
+                "successors": len(self.succs),
+                "filesize": filesize,
+                "memory": memory,
+                "learned": len(self.learned),
+            }
+
+
+store = MarkovStore(os.path.dirname(markovlearn.fn) + os.sep + "markovchains.bin")
+trainlock = threading.Lock()
+
 
 def dummycb(bot, event):
     pass
@@ -112,28 +345,42 @@ def init():
     callbacks.add("JOIN", cb_markovjoin, threaded=True)
     callbacks.add("MESSAGE", cb_markovtalk, cb_markovtalk_test, threaded=True)
     callbacks.add("CONSOLE", cb_markovtalk, cb_markovtalk_test, threaded=True)
+    callbacks.add("TICK60", cb_markovsave)
+    store.load()
     start_new_thread(markovtrain, (markovlearn.data.l,))
     return 1
 
 
+def shutdown():
+    """save the learned chains"""
+    store.save()
+
+
 def size():
     """return size of markov chains"""
-    return len(markovchains)
+    return store.status()["chains"]
+
+
+def cb_markovsave(bot, event):
+    """save the learned chains every saveinterval seconds"""
+    if store.dirty and time.time() - store.lastsave > cfg.get("saveinterval"):
+        store.save()
 
 
 def markovtrain(l):
-    """train items in list"""
-    time.sleep(1)
+    """train items in list, items already learned from are skipped"""
     logging.warn("list to scan is: %s" % ",".join(l))
-    for i in l:
-        if i.startswith("http://"):
-            start_new_thread(markovlearnurl, (i,))
-        elif i.startswith("spider://"):
-            start_new_thread(markovlearnspider, (i,))
-        elif i.startswith("spiders://"):
-            start_new_thread(markovlearnspider, (i,))
-        else:
-            start_new_thread(markovlearnlog, (i,))
+    with trainlock:
+        for i in list(l):
+            if i.startswith("http://") or i.startswith("https://"):
+                if i not in store.learned:
+                    markovlearnurl(i)
+            elif i.startswith("spider://") or i.startswith("spiders://"):
+                if i not in store.learned:
+                    markovlearnspider(i)
+            else:
+                markovlearnlog(i)
+        store.save()
     return 1
 
 
@@ -219,51 +466,84 @@ def cb_markovtalk(bot, ievent):
 txtre = re.compile("^\S+ ")
 
 
+def learnbatches(lines):
+    """learn lines in batches of BATCH lines, return number of lines learned"""
+    nr = 0
+    batch = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        batch.append(line)
+        if len(batch) >= BATCH:
+            store.learn(batch)
+            nr += len(batch)
+            batch = []
+    store.learn(batch)
+    return nr + len(batch)
+
+
 def markovlearnspider(target):
     logging.warn("starting spider learn on %s" % target)
     coll = PersistCollection(getdatadir() + os.sep + "spider" + os.sep + "data")
-    if target.startswith("spider://"):
-        target = target[9:]
-    objs = coll.search("url", target)
-    for obj in objs:
-        if not obj.data and obj.data.url:
-            print("skip - no url")
-            continue
-        time.sleep(0.001)
-        if target not in obj.data.url:
-            continue
-        logging.warn("url is %s" % obj.data.url)
-        try:
-            if obj.data and obj.data.txt:
-                for line in obj.data.txt.split("\n"):
-                    if line.count(";") > 1:
-                        continue
-                    markovtalk_learn(striphtml(line))
-        except:
-            handle_exception()
+    url = target.split("://", 1)[-1]
+    objs = coll.search("url", url)
+
+    def spiderlines():
+        for obj in objs:
+            if not obj.data or not obj.data.url:
+                logging.info("skip - no url")
+                continue
+            if url not in obj.data.url:
+                continue
+            logging.warn("url is %s" % obj.data.url)
+            for line in (obj.data.txt or "").split("\n"):
+                if line.count(";") > 1:
+                    continue
+                yield striphtml(line)
+
+    try:
+        lines = learnbatches(spiderlines())
+        store.learned[target] = time.time()
+    except:
+        handle_exception()
+        return 0
+    logging.warn("learning %s done. %s lines" % (target, lines))
+    return lines
+
+
+def loglines(fn, offset):
+    """yield the text of log lines from offset on"""
+    with open(fn, "r", errors="replace") as logfile:
+        logfile.seek(offset)
+        for line in logfile:
+            # log format is: 2011-08-07 00:02:16  <botfather> love, peace and happiness
+            yield " ".join(line.strip().split()[2:])
 
 
 def markovlearnlog(chan):
-    """learn a log"""
+    """learn a log, continue where the previous learn of a logfile stopped"""
     lines = 0
-    logfiles = os.listdir(getdatadir() + os.sep + "chatlogs")
+    logdir = getdatadir() + os.sep + "chatlogs"
+    try:
+        logfiles = os.listdir(logdir)
+    except OSError:
+        return 0
     for filename in logfiles:
         if chan[1:] not in filename:
             continue
-        logging.warn("opening %s" % filename)
-        for line in open(getdatadir() + os.sep + "chatlogs" + os.sep + filename, "r"):
-            if lines % 10 == 0:
-                time.sleep(0.001)
-            if not line:
-                continue
-            lines += 1
-            try:
-                txt = " ".join(
-                    line.strip().split()[2:]
-                )  # log format is: 2011-08-07 00:02:16  <botfather> love, peace and happiness
-                markovtalk_learn(txt)
-            except IndexError:
-                continue
+        fn = logdir + os.sep + filename
+        # logs are rotated by renaming, so the inode keeps track of what we learned
+        stat = os.stat(fn)
+        inode = "inode:%s" % stat.st_ino
+        offset = store.learned.get(inode, 0)
+        if offset > stat.st_size:
+            offset = 0
+        if offset == stat.st_size:
+            continue
+        logging.warn("opening %s at %s" % (filename, offset))
+        lines += learnbatches(loglines(fn, offset))
+        store.learned[inode] = stat.st_size
     logging.warn("learning %s log done. %s lines" % (chan, lines))
     return lines
 
@@ -274,15 +554,8 @@ def markovlearnurl(url):
     logging.warn("learning %s" % url)
     try:
         f = geturl(url)
-        for line in f.split("\n"):
-            line = striphtml(line)
-            if lines % 10 == 0:
-                time.sleep(0.01)
-            line = line.strip()
-            if not line:
-                continue
-            markovtalk_learn(line)
-            lines += 1
+        lines = learnbatches(striphtml(line) for line in f.split("\n"))
+        store.learned[url] = time.time()
     except Exception as exc:
         logging.error(traceback.format_exception(type(exc), exc, exc.__traceback__))
     logging.warn("learning %s done" % url)
@@ -305,37 +578,9 @@ def msg_to_array(msg):
     return [word.strip().lower() for word in msg.strip().split()]
 
 
-def mw(w):
-    if not w in markovwords:
-        wi = len(markovwordi)
-        markovwordi.append(w)
-        markovwords[w] = wi
-        return wi
-    return markovwords[w]
-
-
-def o2i(order):
-    return tuple(mw(w) for w in order)
-
-
-def i2o(iorder):
-    return tuple(markovwordi[i] for i in iorder)
-
-
 def markovtalk_learn(text_line):
     """this is the function were a text line gets learned"""
-    text_line = msg_to_array(text_line)
-    length = len(text_line)
-    order = [
-        TOKEN,
-    ] * ORDER_K
-    for i in range(length - 1):
-        order.insert(0, text_line[i])
-        order = order[:ORDER_K]
-        next_word = text_line[i + 1]
-        key = markovchains.setdefault(o2i(order), [])
-        if not next_word in key:
-            key.append(mw(next_word))
+    store.learn([text_line])
 
 
 def getreply(bot, ievent, text_line):
@@ -387,12 +632,11 @@ def getline(text_line):
     output = ""
     prev = ""
     for i in range(MAXGEN):
-        try:
-            logging.debug(str(order))
-            successorList = i2o(markovchains[o2i(order)])
-            logging.debug(str(successorList))
-        except KeyError as ex:
-            continue
+        logging.debug(str(order))
+        successorList = store.successors(order)
+        logging.debug(str(successorList))
+        if not successorList:
+            break
         word = successorList[0]
         if not word:
             break
@@ -410,7 +654,7 @@ def getline(text_line):
 
 def handle_markovsize(bot, ievent):
     """markov-size .. returns size of markovchains"""
-    ievent.reply("I know %s phrases" % str(len(list(markovchains.keys()))))
+    ievent.reply("I know %s phrases: " % size(), store.status())
 
 
 cmnds.add("markov-size", handle_markovsize, "OPER")
@@ -419,18 +663,20 @@ examples.add("markov-size", "size of markovchains", "markov-size")
 
 def handle_markovlearn(bot, ievent):
     """command to let the bot learn a log or an url .. learned data
-    is not persisted"""
+    is saved with the chains"""
     try:
         item = ievent.args[0]
     except IndexError:
         ievent.reply("<channel>|<url>")
         return
-    if item.startswith("http://"):
-        nrlines = markovlearnurl(item)
+    if item.startswith("http://") or item.startswith("https://"):
+        with trainlock:
+            nrlines = markovlearnurl(item)
         ievent.reply("learned %s lines" % nrlines)
         return
     ievent.reply("learning log file %s" % item)
-    nrlines = markovlearnlog(item)
+    with trainlock:
+        nrlines = markovlearnlog(item)
     ievent.reply("learned %s lines" % nrlines)
 
 
@@ -32,10 +32,15 @@
 import logging
 import queue
 import re
+import select
 import socket
+import struct
 import time
+from collections import OrderedDict
 
 from jsb.lib.callbacks import first_callbacks
+from jsb.lib.commands import cmnds
+from jsb.lib.examples import examples
 from jsb.lib.fleet import getfleet
 from jsb.lib.partyline import partyline
 from jsb.lib.persistconfig import PersistConfig
@@ -43,7 +48,9 @@ from jsb.lib.threads import start_new_thread
 from jsb.utils.exception import handle_exception
 from jsb.utils.generic import strippedtxt
 from jsb.utils.locking import lockdec
-from py3rijndael import rijndael
+from jsb.utils.statdict import StatDict
+from py3rijndael import Rijndael
+from py3rijndael.constants import T5, T6, T7, T8, Si
 
 # basic imports
 
@@ -51,6 +58,8 @@ from py3rijndael import rijndael
 # defines
 
 udplistener = None
+headerre = re.compile("(\\S+) (\\S+) (.*)")
+masks = {}
 
 cfg = PersistConfig()
 cfg.define("udp", 0)  # set to 0 to disnable
@@ -77,6 +86,9 @@ cfg.define("udpseed", "blablablablablaz", exposed=False)
 cfg.define("udpstrip", 1)  # strip all chars < char(32)
 cfg.define("udpsleep", 0)  # sleep in sendloop .. can be used to delay pack
 cfg.define("udpdblog", 0)
+cfg.define("udpbatch", 64)  # max packets/messages handled in one go
+cfg.define("udpcoalesce", 400)  # max length of merged lines per target, 0 disables
+cfg.define("udprcvbuf", 1048576)
 cfg.define(
     "udpbots",
     [
@@ -91,12 +103,96 @@ def _inmask(addr):
     """check if addr matches a mask."""
     if not cfg["udpmasks"]:
         return False
-    for i in cfg["udpmasks"]:
-        i = i.replace("*", ".*")
-        if re.match(i, addr):
+    key = tuple(cfg["udpmasks"])
+    if key not in masks:
+        masks.clear()
+        masks[key] = [re.compile(i.replace("*", ".*")) for i in key]
+    for i in masks[key]:
+        if i.match(addr):
             return True
 
 
+def decrypt(crypt, data):
+    """
+    decrypt all 16 byte blocks of data in one pass, the round keys and
+    tables are looked up once instead of per block. trailing bytes that
+    don't fill a block are dropped.
+
+    """
+    nrblocks = len(data) // 16
+    if crypt.block_size != 16:
+        size = crypt.block_size
+        return b"".join(
+            crypt.decrypt(data[i * size : i * size + size])
+            for i in range(len(data) // size)
+        )
+    t5, t6, t7, t8, si = T5, T6, T7, T8, Si
+    words = struct.unpack(">%sI" % (nrblocks * 4), data[: nrblocks * 16])
+    first = crypt.Kd[0]
+    rounds = crypt.Kd[1:-1]
+    k0, k1, k2, k3 = crypt.Kd[-1]
+    result = bytearray(nrblocks * 16)
+    for n in range(0, nrblocks * 4, 4):
+        t0 = words[n] ^ first[0]
+        t1 = words[n + 1] ^ first[1]
+        t2 = words[n + 2] ^ first[2]
+        t3 = words[n + 3] ^ first[3]
+        for k in rounds:
+            t0, t1, t2, t3 = (
+                t5[t0 >> 24]
+                ^ t6[(t3 >> 16) & 0xFF]
+                ^ t7[(t2 >> 8) & 0xFF]
+                ^ t8[t1 & 0xFF]
+                ^ k[0],
+                t5[t1 >> 24]
+                ^ t6[(t0 >> 16) & 0xFF]
+                ^ t7[(t3 >> 8) & 0xFF]
+                ^ t8[t2 & 0xFF]
+                ^ k[1],
+                t5[t2 >> 24]
+                ^ t6[(t1 >> 16) & 0xFF]
+                ^ t7[(t0 >> 8) & 0xFF]
+                ^ t8[t3 & 0xFF]
+                ^ k[2],
+                t5[t3 >> 24]
+                ^ t6[(t2 >> 16) & 0xFF]
+                ^ t7[(t1 >> 8) & 0xFF]
+                ^ t8[t0 & 0xFF]
+                ^ k[3],
+            )
+        result[n * 4 : n * 4 + 16] = (
+            (si[t0 >> 24] ^ (k0 >> 24)) & 0xFF,
+            (si[(t3 >> 16) & 0xFF] ^ (k0 >> 16)) & 0xFF,
+            (si[(t2 >> 8) & 0xFF] ^ (k0 >> 8)) & 0xFF,
+            (si[t1 & 0xFF] ^ k0) & 0xFF,
+            (si[t1 >> 24] ^ (k1 >> 24)) & 0xFF,
+            (si[(t0 >> 16) & 0xFF] ^ (k1 >> 16)) & 0xFF,
+            (si[(t3 >> 8) & 0xFF] ^ (k1 >> 8)) & 0xFF,
+            (si[t2 & 0xFF] ^ k1) & 0xFF,
+            (si[t2 >> 24] ^ (k2 >> 24)) & 0xFF,
+            (si[(t1 >> 16) & 0xFF] ^ (k2 >> 16)) & 0xFF,
+            (si[(t0 >> 8) & 0xFF] ^ (k2 >> 8)) & 0xFF,
+            (si[t3 & 0xFF] ^ k2) & 0xFF,
+            (si[t3 >> 24] ^ (k3 >> 24)) & 0xFF,
+            (si[(t2 >> 16) & 0xFF] ^ (k3 >> 16)) & 0xFF,
+            (si[(t1 >> 8) & 0xFF] ^ (k3 >> 8)) & 0xFF,
+            (si[t0 & 0xFF] ^ k3) & 0xFF,
+        )
+    return bytes(result)
+
+
+def coalesce(items, maxlen):
+    """merge (printto, txt) items for the same target into lines of at most maxlen."""
+    targets = OrderedDict()
+    for printto, txt in items:
+        lines = targets.setdefault(printto, [])
+        if lines and maxlen and len(lines[-1]) + len(txt) + 3 <= maxlen:
+            lines[-1] = "%s | %s" % (lines[-1], txt)
+        else:
+            lines.append(txt)
+    return [(printto, txt) for printto, lines in targets.items() for txt in lines]
+
+
 # Udplistener class
 
 
@@ -117,33 +213,68 @@ class Udplistener(object):
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except:
             pass
-        self.sock.setblocking(1)
-        self.sock.settimeout(1)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, cfg["udprcvbuf"])
+        except:
+            pass
+        self.sock.setblocking(0)
         self.loggers = []
+        self.stats = StatDict()
+        self.started = time.time()
 
     def _outloop(self):
-        """loop controling the rate of outputted messages."""
+        """loop controling the rate of outputted messages, queued messages are merged per target."""
         logging.info("udp - starting outloop")
         while not self.stop:
-            (printto, txt) = self.outqueue.get()
+            items = [self.outqueue.get()]
             if self.stop:
                 return
-            self.dosay(printto, txt)
+            while len(items) < (cfg["udpbatch"] or 1):
+                try:
+                    items.append(self.outqueue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in items if item[0]]
+            lines = coalesce(items, cfg["udpcoalesce"])
+            self.stats.upitem("coalesced", len(items) - len(lines))
+            for printto, txt in lines:
+                self.dosay(printto, txt)
         logging.info("udp - stopping outloop")
 
     def _handleloop(self):
-        """handle incoming udp data."""
+        """handle incoming udp data, a batch of packets at a time."""
         while not self.stop:
-            (input, addr) = self.queue.get()
-            if not input or not addr:
-                continue
+            batch = self.queue.get()
             if self.stop:
                 break
-            self.handle(input, addr)
+            for input, addr in batch:
+                if not input or not addr:
+                    continue
+                self.handle(input, addr)
             if cfg["udpsleep"]:
                 time.sleep(cfg["udpsleep"] or 0.01)
         logging.info("udp - shutting down udplistener")
 
+    def receive(self):
+        """
+        wait (at most a second) for packets and drain whatever is waiting on
+        the socket, returns a list of (data, addr) tuples.
+
+        """
+        if not select.select([self.sock], [], [], 1)[0]:
+            raise socket.timeout()
+        batch = []
+        while len(batch) < (cfg["udpbatch"] or 1):
+            try:
+                batch.append(self.sock.recvfrom(64000))
+            except BlockingIOError:
+                break
+        if not batch:
+            raise socket.timeout()
+        self.stats.upitem("batches")
+        self.stats.upitem("packets", len(batch))
+        return batch
+
     def _listen(self):
         """listen for udp messages .. /msg via bot"""
         if not cfg["udp"]:
@@ -165,7 +296,7 @@ class Udplistener(object):
         # loop on listening udp socket
         while not self.stop:
             try:
-                input, addr = self.sock.recvfrom(64000)
+                batch = self.receive()
             except socket.timeout:
                 continue
             except Exception as ex:
@@ -184,28 +315,26 @@ class Udplistener(object):
                     break
             if self.stop:
                 break
-            self.queue.put((input, addr))
+            self.queue.put(batch)
         logging.info("udp - shutting down main loop")
 
     def handle(self, input, addr):
         """handle an incoming udp packet."""
         if cfg["udpseed"]:
-            data = ""
-            for i in range(len(input) // 16):
-                try:
-                    data += crypt.decrypt(input[i * 16 : i * 16 + 16])
-                except Exception as ex:
-                    logging.warn("udp - can't decrypt: %s" % str(ex))
-                    data = input
-                    break
+            try:
+                data = decrypt(crypt, input)
+            except Exception as ex:
+                logging.warn("udp - can't decrypt: %s" % str(ex))
+                data = input
         else:
             data = input
+        data = data.rstrip(b"\0").decode("utf-8", "replace")
         if cfg["udpstrip"]:
             data = strippedtxt(data)
         # check if udp is enabled and source ip is in udpallow list
         if cfg["udp"] and (addr[0] in cfg["udpallow"] or _inmask(addr[0])):
             # get printto and passwd data
-            header = re.search("(\S+) (\S+) (.*)", data)
+            header = headerre.search(data)
             if header:
                 # check password
                 if header.group(1) == cfg["udppassword"]:
@@ -259,7 +388,7 @@ if cfg["udp"]:
 
 # initialize crypt object if udpseed is set in config
 if cfg["udp"] and cfg["udpseed"]:
-    crypt = rijndael(cfg["udpseed"])
+    crypt = Rijndael(cfg["udpseed"])
 
 
 def init():
@@ -281,10 +410,36 @@ def shutdown():
     if udplistener:
         udplistener.stop = 1
         udplistener.outqueue.put_nowait((None, None))
-        udplistener.queue.put_nowait((None, None))
+        udplistener.queue.put_nowait([])
     return 1
 
 
+# udp-status command
+
+
+def handle_udpstatus(bot, event):
+    """no arguments - show packets received, batches and merged messages of the udp listener."""
+    if not udplistener:
+        event.reply("udp is not enabled")
+        return
+    stats = udplistener.stats
+    elapsed = time.time() - udplistener.started
+    event.reply(
+        "udp status: ",
+        {
+            "packets": stats.packets or 0,
+            "batches": stats.batches or 0,
+            "packets/sec": "%.1f" % ((stats.packets or 0) / (elapsed or 1)),
+            "coalesced": stats.coalesced or 0,
+            "inqueue": udplistener.queue.qsize(),
+            "outqueue": udplistener.outqueue.qsize(),
+        },
+    )
+
+
+cmnds.add("udp-status", handle_udpstatus, "OPER")
+examples.add("udp-status", "show udp listener statistics", "udp-status")
+
 # start
 
 
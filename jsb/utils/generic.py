@@ -13,6 +13,7 @@ import os.path
 import random
 import re
 import time
+from queue import Empty
 from stat import S_IMODE, ST_MODE, ST_UID
 
 from jsb.imports import getjson
@@ -351,59 +352,40 @@ def gethighest(ddir, ffile):
 # waitevents function
 
 
-def waitevents(eventlist, millisec=5000):
+def waitevents(eventlist, millisec=500):
     result = []
     for e in eventlist:
         if not e or e.bot.isgae:
             continue
         # logging.warn("waitevents - waiting for %s" % e.txt)
-        # e.finished.wait(millisec)
-        res = waitforqueue(e.outqueue, 5000)
+        res = waitforqueue(e.outqueue, millisec)
         result.append(res)
-        e.finished.clear()
     return result
 
 
 # waitforqueue function
 
 
-def waitforqueue(queue, timeout=10000, maxitems=None, bot=None):
-    """wait for results to arrive in a queue. return list of results."""
-    # if len(queue) > 1: return list(queue)
-    result = []
-    counter = 0
-    if not maxitems:
-        maxitems = 100
-    logging.warn("waiting for queue: %s - %s" % (timeout, maxitems))
-    try:
-        while not len(queue):
-            if len(queue) > maxitems:
-                break
-            if counter > timeout:
-                break
-            time.sleep(0.001)
-            counter += 10
-        logging.warn(
-            "waitforqueue - result is %s items (%s) - %s"
-            % (len(queue), counter, str(queue))
-        )
+def waitforqueue(queue, timeout=1000, maxitems=None, bot=None):
+    """wait for results to arrive in a queue. timeout is in milliseconds. return list of results."""
+    if hasattr(queue, "waitfor"):
+        queue.waitfor(timeout / 1000.0)
+        logging.info("waitforqueue - result is %s items" % len(queue))
         return queue
-    except AttributeError:
-        q = []
-        while 1:
-            if counter > timeout:
-                break
-            try:
-                q.append(queue.get_nowait())
-            except queue.Empty:
-                break
-            time.sleep(0.001)
-            counter += 10
-        logging.warn(
-            "waitforqueue - result is %s items (%s) - %s" % (len(q), counter, str(q))
-        )
-        return q
-    # time.sleep(0.2)
+    if not hasattr(queue, "get"):
+        deadline = time.time() + timeout / 1000.0
+        while not len(queue) and time.time() < deadline:
+            time.sleep(0.01)
+        return queue
+    q = []
+    try:
+        q.append(queue.get(timeout=timeout / 1000.0))
+        while not maxitems or len(q) < maxitems:
+            q.append(queue.get_nowait())
+    except Empty:
+        pass
+    logging.info("waitforqueue - result is %s items" % len(q))
+    return q
 
 
 # checkqueues function
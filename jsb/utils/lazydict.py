@@ -167,6 +167,8 @@ class LazyDict(dict):
 
     """lazy dict allows dotted access to a dict"""
 
+    __slots__ = ()
+
     def __repr__(self):
         return "<%s.%s object at %s>" % (
             self.__class__.__module__,
@@ -8,12 +8,14 @@
 
 # import sgmllib
 import _thread
+import base64
 import cgi
 import html.entities
 import http.client
 import logging
 import re
 import sys
+import threading
 import time
 import urllib.error
 import urllib.parse
@@ -21,7 +23,9 @@ import urllib.request
 from bs4 import BeautifulSoup
 
 
+from jsb.lib.cache import Cache
 from jsb.lib.errors import URLNotEnabled
+from jsb.utils.statdict import StatDict
 
 from .generic import fromenc, toenc
 from .lazydict import LazyDict
@@ -32,6 +36,8 @@ from .lazydict import LazyDict
 # defines
 
 re_url_match = re.compile("((?:http|https)://\S+)")
+re_html_title = re.compile(b"<title[^>]*>(.*?)</title", re.I | re.S)
+re_html_charset = re.compile(rb"<meta[^>]+charset\s*=\s*['\"]?([-\w.:]+)", re.I)
 
 try:
     import chardet
@@ -215,6 +221,269 @@ def geturl2(url, decode=False, timeout=5):
     return res
 
 
+# istext function
+
+
+def istext(contenttype):
+    """check if a content-type header value is text we can look into."""
+    mime = contenttype.split(";", 1)[0].strip().lower()
+    return mime.startswith("text/") or mime.endswith("xml") or "html" in mime
+
+
+# readuntil function
+
+
+def readuntil(response, until, maxbytes=None, chunksize=4096):
+    """read a response until the until marker shows up or maxbytes are read."""
+    contenttype = response.getheader("content-type")
+    if contenttype and not istext(contenttype):
+        return b""
+    until = until.lower()
+    data = b""
+    while not maxbytes or len(data) < maxbytes:
+        if maxbytes:
+            chunksize = min(chunksize, maxbytes - len(data))
+        chunk = response.read(chunksize)
+        if not chunk:
+            break
+        start = max(len(data) - len(until), 0)
+        data += chunk
+        if until in data[start:].lower():
+            break
+    return data
+
+
+# HTTPPool class
+
+
+class HTTPPool(object):
+
+    """keep-alive HTTP(S) connections pooled per scheme, host and port."""
+
+    def __init__(self, maxperhost=4, timeout=10):
+        self.maxperhost = maxperhost
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = _thread.allocate_lock()
+
+    def acquire(self, key):
+        """return an idle connection to key or make a new one."""
+        with self.lock:
+            try:
+                return (self.idle[key].pop(), True)
+            except (KeyError, IndexError):
+                pass
+        scheme, host, port = key
+        if scheme == "https":
+            return (
+                http.client.HTTPSConnection(host, port, timeout=self.timeout),
+                False,
+            )
+        return (http.client.HTTPConnection(host, port, timeout=self.timeout), False)
+
+    def release(self, key, connection):
+        """give a connection back to the pool."""
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maxperhost:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """close all idle connections."""
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+            self.idle = {}
+
+    def request(self, url, headers, maxbytes=None, until=None):
+        """
+        do one GET on a pooled connection, retry once if a reused connection
+        went stale. with until set reading stops as soon as that marker has
+        been seen and bodies that are not text are not read at all.
+
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        key = (parts.scheme, parts.hostname, parts.port)
+        myheaders = {"User-Agent": useragent()}
+        if parts.username:
+            auth = "%s:%s" % (
+                urllib.parse.unquote(parts.username),
+                urllib.parse.unquote(parts.password or ""),
+            )
+            myheaders["Authorization"] = "Basic " + base64.b64encode(
+                auth.encode()
+            ).decode("ascii")
+        myheaders.update(headers)
+        while True:
+            connection, reused = self.acquire(key)
+            try:
+                connection.request("GET", path, headers=myheaders)
+                response = connection.getresponse()
+                if until:
+                    content = readuntil(response, until, maxbytes)
+                else:
+                    content = response.read(maxbytes) if maxbytes else response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            if response.isclosed() and not response.will_close:
+                self.release(key, connection)
+            else:
+                connection.close()
+            return (response, content)
+
+    def fetch(self, url, headers={}, maxbytes=None, redirects=5, until=None):
+        """GET url, following redirects. return LazyDict with status_code, headers, content and url."""
+        global enabled
+        if not enabled:
+            raise URLNotEnabled(url)
+        logging.info("fetching %s" % url)
+        for i in range(redirects + 1):
+            response, content = self.request(url, headers, maxbytes, until)
+            location = response.getheader("location")
+            if response.status in [301, 302, 303, 307, 308] and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            break
+        return LazyDict(
+            status_code=response.status,
+            headers=response.msg,
+            content=content,
+            url=url,
+        )
+
+
+# gettitle function
+
+
+def gettitle(content, contenttype=""):
+    """extract the <title> from raw html, decoded with the charset of the page."""
+    test_title = re_html_title.search(content)
+    if not test_title:
+        return None
+    charset = "utf-8"
+    if "charset=" in contenttype.lower():
+        charset = contenttype.lower().split("charset=", 1)[1].split(";")[0].strip()
+    else:
+        test_charset = re_html_charset.search(content)
+        if test_charset:
+            charset = test_charset.group(1).decode("ascii", "replace")
+    try:
+        title = test_title.group(1).decode(charset.strip("\"'"), "replace")
+    except LookupError:
+        title = test_title.group(1).decode("utf-8", "replace")
+    return html.unescape(" ".join(title.split())) or None
+
+
+# UrlMeta class
+
+
+class UrlMeta(object):
+
+    """
+    shared url metadata service .. title, content-type and final url of a
+    link and its shortened url are kept in a TTL and LRU bound cache and
+    concurrent lookups of the same url are collapsed into one fetch.
+
+    """
+
+    def __init__(self, ttl=3600, errorttl=60, maxitems=2000, maxbytes=32768):
+        self.ttl = ttl
+        self.errorttl = errorttl
+        self.maxbytes = maxbytes
+        self.waittimeout = 60
+        self.cache = Cache(maxitems, maxitems * 2048)
+        self.pool = HTTPPool()
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.stats = StatDict()
+        self.shortener = None
+
+    def cached(self, kind, url, func, ttl=None):
+        """return func(url) from cache, callers asking for the same url while it is fetched share its result."""
+        key = (kind, url)
+        result = self.cache.get(key, "urlmeta")
+        if result is not None:
+            return result
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = LazyDict(done=threading.Event(), result=None, error=None)
+                self.flights[key] = flight
+        if not leader:
+            self.stats.upitem("collapsed")
+            if not flight.done.wait(self.waittimeout):
+                raise TimeoutError("timeout waiting for %s" % url)
+            if flight.error:
+                raise flight.error
+            return flight.result
+        try:
+            self.stats.upitem(kind)
+            result = flight.result = func(url)
+            if result is not None:
+                if isinstance(result, dict) and result.get("status", 200) >= 500:
+                    ttl = self.errorttl
+                self.cache.set(key, result, ttl or self.ttl, "urlmeta")
+            return result
+        except Exception as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def fetchmeta(self, url):
+        """fetch url, only reading the body up to its </title>."""
+        response = self.pool.fetch(url, maxbytes=self.maxbytes, until=b"</title>")
+        contenttype = response.headers.get("content-type") or ""
+        return LazyDict(
+            url=url,
+            final=response.url,
+            status=response.status_code,
+            contenttype=contenttype.split(";", 1)[0].strip().lower(),
+            title=gettitle(response.content, contenttype),
+        )
+
+    def lookup(self, url):
+        """return LazyDict with url, final, status, contenttype and title of url."""
+        return self.cached("meta", url, self.fetchmeta)
+
+    def shorten(self, url):
+        """return the shortened url(s) of url as produced by the registered shortener."""
+        if not self.shortener:
+            return None
+        return self.cached("short", url, self.shortener, 7 * 24 * 3600)
+
+    def status(self):
+        """return cache and fetch statistics."""
+        result = self.cache.status()
+        result["inflight"] = len(self.flights)
+        result["fetches"] = self.stats.meta or 0
+        result["shortened"] = self.stats.short or 0
+        result["collapsed"] = self.stats.collapsed or 0
+        return result
+
+
+urlmeta = UrlMeta()
+
+# size function
+
+
+def size():
+    """show number of cached url metadata entries."""
+    return len(urlmeta.cache)
+
+
 # geturl4 function
 
 
@@ -0,0 +1,58 @@
+# jsb/utils/waitqueue.py
+#
+#
+
+""" deque that wakes up waiters when items are added or the producer is done. """
+
+# basic imports
+
+import threading
+import time
+from collections import deque
+
+# WaitQueue class
+
+
+class WaitQueue(deque):
+
+    """deque with a condition to wait on instead of polling its length."""
+
+    def __init__(self, iterable=(), cond=None):
+        deque.__init__(self, iterable)
+        self.cond = cond or threading.Condition()
+        self.done = False
+
+    def append(self, item):
+        """add item and wake up waiters."""
+        with self.cond:
+            deque.append(self, item)
+            self.cond.notify_all()
+
+    def appendleft(self, item):
+        """add item to the front and wake up waiters."""
+        with self.cond:
+            deque.appendleft(self, item)
+            self.cond.notify_all()
+
+    def extend(self, items):
+        """add items and wake up waiters."""
+        with self.cond:
+            deque.extend(self, items)
+            self.cond.notify_all()
+
+    def setdone(self):
+        """mark the producer as done and wake up waiters."""
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def waitfor(self, timeout=10.0):
+        """wait until items arrive, the producer is done or timeout seconds passed."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while not len(self) and not self.done:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        return self